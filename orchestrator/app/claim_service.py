@@ -0,0 +1,93 @@
+from datetime import datetime
+from sqlalchemy import select, update, or_
+from .models import db, Task
+from .lease_service import new_lease
+
+# How many queue-head candidates the SQLite path tries before giving up
+CLAIM_CANDIDATES = 8
+
+def claimable(provider_id, now=None, task=Task):
+    """
+    Criteria for a QUEUED task provider_id may claim now. Tasks requeued
+    after a lost lease wait out their backoff first, and speculative copies
+    are only for the provider they were pinned to. `task` may be an alias.
+    """
+    if now is None:
+        now = datetime.utcnow()
+    return [task.status == 'QUEUED',
+            or_(task.not_before.is_(None), task.not_before <= now),
+            or_(task.pinned_provider_id.is_(None), task.pinned_provider_id == provider_id)]
+
+def claim_next_task(provider_id, gpu_assigned, criterion=None):
+    """
+    Atomically flips the oldest QUEUED task (matching `criterion`, if given)
+    to RUNNING for this provider, under a fresh lease.
+    Returns the claimed Task (caller commits) or None if the queue is empty.
+    """
+    criteria = claimable(provider_id)
+    if criterion is not None:
+        criteria.append(criterion)
+
+    if db.engine.dialect.name == 'postgresql':
+        task_id = _claim_skip_locked(provider_id, gpu_assigned, criteria)
+    else:
+        task_id = _claim_conditional(provider_id, gpu_assigned, criteria)
+
+    if not task_id:
+        return None
+    # Reload so the ORM object reflects the row we just wrote
+    return db.session.get(Task, task_id, populate_existing=True)
+
+def _claim_values(provider_id, gpu_assigned):
+    now = datetime.utcnow()
+    return {
+        "status": 'RUNNING',
+        "provider_id": provider_id,
+        "gpu_assigned": gpu_assigned,
+        "start_time": now,
+        "last_update": now,
+        **new_lease(),
+    }
+
+def _claim_skip_locked(provider_id, gpu_assigned, criteria):
+    # Postgres: pick + flip in one statement. Rows locked by another
+    # worker's in-flight claim are skipped instead of waited on, so
+    # concurrent pollers fan out over the queue head.
+    head = (
+        select(Task.id)
+        .where(*criteria)
+        .order_by(Task.submission_time)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(Task)
+        .where(Task.id == head)
+        .values(**_claim_values(provider_id, gpu_assigned))
+        .returning(Task.id)
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(stmt).scalar()
+
+def _claim_conditional(provider_id, gpu_assigned, criteria):
+    # SQLite has no row locks (writers are serialized on the file), so we
+    # read a few candidates and flip the first one still QUEUED. The status
+    # guard in the WHERE makes a lost race a 0-row update, never a double claim.
+    candidates = db.session.execute(
+        select(Task.id)
+        .where(*criteria)
+        .order_by(Task.submission_time)
+        .limit(CLAIM_CANDIDATES)
+    ).scalars().all()
+
+    for task_id in candidates:
+        stmt = (
+            update(Task)
+            .where(Task.id == task_id, Task.status == 'QUEUED')
+            .values(**_claim_values(provider_id, gpu_assigned))
+            .execution_options(synchronize_session=False)
+        )
+        if db.session.execute(stmt).rowcount == 1:
+            return task_id
+    return None
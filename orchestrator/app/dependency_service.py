@@ -0,0 +1,154 @@
+from datetime import datetime
+from sqlalchemy import select, update, insert, case
+from .models import db, Task, TaskDependency, TaskEvent
+from .event_service import is_streamed
+from .notify_service import announce, WORK, TASK_EVENTS
+from .lease_service import artifact_key
+from .storage_service import presign_get
+
+# Dependencies between tasks. A task with parents starts out BLOCKED with
+# pending_parents set to their number. A parent's completion decrements its
+# children in one UPDATE over ix_task_dependencies_parent, and the same
+# statement queues the ones that reach zero, so nothing ever scans for
+# BLOCKED work. A parent that ends any other way fails its blocked
+# descendants. When a child is claimed, its parents' artifacts are handed to
+# the runner as presigned URLs in INPUT_ARTIFACTS.
+
+MAX_PARENTS = 128     # INPUT_ARTIFACTS must fit in one env var
+JOB_MAX_PARENTS = 16  # Every task of a job gets a row per parent
+DEAD_STATUSES = ('FAILED', 'CANCELLED')
+
+class InvalidDependencies(ValueError):
+    pass
+
+def lock_parents(user_id, raw, max_parents=MAX_PARENTS):
+    """
+    Checks a submission's depends_on and returns (parent_ids, pending): the
+    parents in order and how many of them have yet to complete. The
+    parents' rows stay locked until the caller commits, so none of them
+    can complete unseen before the new dependency rows are visible.
+    """
+    if not isinstance(raw, list) or not all(isinstance(p, str) for p in raw):
+        raise InvalidDependencies("depends_on must be a list of task ids")
+    parent_ids = list(dict.fromkeys(raw))
+    if len(parent_ids) > max_parents:
+        raise InvalidDependencies(f"depends_on can list at most {max_parents} tasks here")
+    if not parent_ids:
+        return [], 0
+
+    rows = db.session.execute(
+        select(Task.id, Task.user_id, Task.status, Task.speculative_of)
+        .where(Task.id.in_(parent_ids))
+        .with_for_update()
+    ).all()
+    parents = {row.id: row for row in rows if row.user_id == user_id and row.speculative_of is None}
+    unknown = [p for p in parent_ids if p not in parents]
+    if unknown:
+        raise InvalidDependencies(f"Unknown task(s) in depends_on: {', '.join(unknown)}")
+    dead = [p for p in parent_ids if parents[p].status in DEAD_STATUSES]
+    if dead:
+        raise InvalidDependencies(f"depends_on task(s) will never complete: {', '.join(dead)}")
+    return parent_ids, sum(1 for p in parent_ids if parents[p].status != 'COMPLETED')
+
+def block_on(task_ids, parent_ids):
+    """
+    Records that each of task_ids waits for parent_ids, in order. The tasks
+    themselves must be created BLOCKED with pending_parents set to the
+    number of parents not yet COMPLETED. Caller commits.
+    """
+    db.session.connection().execute(insert(TaskDependency.__table__), [
+        {"task_id": task_id, "parent_id": parent_id, "position": position}
+        for task_id in task_ids for position, parent_id in enumerate(parent_ids)
+    ])
+
+def parents_of(task_id):
+    return db.session.execute(
+        select(TaskDependency.parent_id).where(TaskDependency.task_id == task_id).order_by(TaskDependency.position)
+    ).scalars().all()
+
+def _record_events(rows, status, now):
+    events = [{"task_id": row.id, "user_id": row.user_id, "status": status, "created_at": now}
+              for row in rows if is_streamed(row)]
+    if events:
+        db.session.execute(insert(TaskEvent), events)
+        announce(TASK_EVENTS)
+
+def release_children(parent_id, now=None):
+    """
+    One parent completed: count it off for every blocked child and queue
+    those with nothing left to wait for. Returns how many were queued.
+    """
+    now = now or datetime.utcnow()
+    children = select(TaskDependency.task_id).where(TaskDependency.parent_id == parent_id)
+    rows = db.session.execute(
+        update(Task)
+        .where(Task.id.in_(children), Task.status == 'BLOCKED')
+        .values(pending_parents=Task.pending_parents - 1,
+                status=case((Task.pending_parents <= 1, 'QUEUED'), else_=Task.status),
+                last_update=now)
+        .returning(Task.id, Task.user_id, Task.status, Task.speculative_of, Task.job_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    released = [row for row in rows if row.status == 'QUEUED']
+    if released:
+        _record_events(released, 'QUEUED', now)
+        announce(WORK)
+    return len(released)
+
+def fail_dependents(parent_ids, now=None):
+    """
+    Parents that will never complete: every blocked task downstream of them
+    fails, level by level. Returns how many failed.
+    """
+    now = now or datetime.utcnow()
+    failed = 0
+    frontier = list(parent_ids)
+    while frontier:
+        children = select(TaskDependency.task_id).where(TaskDependency.parent_id.in_(frontier))
+        rows = db.session.execute(
+            update(Task)
+            .where(Task.id.in_(children), Task.status == 'BLOCKED')
+            .values(status='FAILED', error_message="A task it depends on did not complete.",
+                    end_time=now, last_update=now)
+            .returning(Task.id, Task.user_id, Task.speculative_of, Task.job_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        _record_events(rows, 'FAILED', now)
+        failed += len(rows)
+        frontier = [row.id for row in rows]
+    return failed
+
+def resolve(task):
+    """
+    Call in the transaction that moves `task` to a terminal status.
+    """
+    if task.status == 'COMPLETED':
+        return release_children(task.id)
+    fail_dependents([task.id])
+    return 0
+
+def input_artifacts(task_ids):
+    """
+    {task_id: [presigned GET URL of each parent's artifact, in order]} for
+    the given tasks that have parents. Two queries however many there are.
+    """
+    if not task_ids:
+        return {}
+    rows = db.session.execute(
+        select(TaskDependency.task_id, Task.id, Task.attempts, Task.winner_task_id)
+        .join(Task, Task.id == TaskDependency.parent_id)
+        .where(TaskDependency.task_id.in_(list(task_ids)))
+        .order_by(TaskDependency.task_id, TaskDependency.position)
+    ).all()
+
+    # A parent that a speculative copy completed has its results under the copy's key
+    winner_ids = [winner for _, _, _, winner in rows if winner]
+    winner_attempts = dict(db.session.execute(
+        select(Task.id, Task.attempts).where(Task.id.in_(winner_ids))
+    ).all()) if winner_ids else {}
+
+    inputs = {}
+    for task_id, parent_id, attempts, winner in rows:
+        key = artifact_key(winner, winner_attempts.get(winner)) if winner else artifact_key(parent_id, attempts)
+        inputs.setdefault(task_id, []).append(presign_get(key))
+    return inputs
@@ -0,0 +1,52 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from .models import db, TaskEvent
+from .notify_service import announce, TASK_EVENTS
+
+# Event ids are handed out at INSERT but become visible at COMMIT, so with
+# concurrent writers id N can commit after N+1 has already been streamed.
+# Streams re-read this many seconds of recent events below their cursor and
+# skip the ones they already sent; a transaction that takes longer than this
+# to commit can still be missed.
+EVENT_SETTLE_SECONDS = int(os.getenv('EVENT_SETTLE_SECONDS', '10'))
+
+def is_streamed(task):
+    # Speculative copies are followed through their original, job children through the job
+    return task.speculative_of is None and task.job_id is None
+
+def record_status_change(task):
+    """
+    Appends the task's current status to the per-user event log that feeds
+    /consumer/tasks/stream. Call inside the transaction that changes the status.
+    """
+    if not is_streamed(task):
+        return
+    db.session.add(TaskEvent(task_id=task.id, user_id=task.user_id, status=task.status))
+    announce(TASK_EVENTS)
+
+def latest_cursor(user_id):
+    return db.session.query(func.max(TaskEvent.id)).filter(TaskEvent.user_id == user_id).scalar() or 0
+
+def events_since(user_id, cursor, limit=100, sent=()):
+    """
+    The user's events after `cursor`, in id order, preceded by any recent
+    ones at or below it that committed late. `sent` holds the ids the stream
+    already delivered from the last EVENT_SETTLE_SECONDS; those are skipped.
+    """
+    # Lowest id still young enough to have committed behind the cursor
+    floor = db.session.query(func.min(TaskEvent.id)).filter(
+        TaskEvent.created_at >= datetime.utcnow() - timedelta(seconds=EVENT_SETTLE_SECONDS)
+    ).scalar()
+    late = []
+    if floor is not None and floor <= cursor:
+        late = (TaskEvent.query
+                .filter(TaskEvent.user_id == user_id, TaskEvent.id >= floor, TaskEvent.id <= cursor,
+                        TaskEvent.id.not_in(list(sent)))
+                .order_by(TaskEvent.id)
+                .all())
+    return late + (TaskEvent.query
+                   .filter(TaskEvent.user_id == user_id, TaskEvent.id > cursor)
+                   .order_by(TaskEvent.id)
+                   .limit(limit)
+                   .all())
@@ -0,0 +1,147 @@
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import update
+from .models import db, Provider
+from .lease_service import renew_leases
+
+# Heartbeats are acknowledged from memory and written to the database in
+# batches. Each gunicorn worker buffers its own share and flushes every
+# HEARTBEAT_FLUSH_SECONDS with one multi-row UPDATE; liveness checks read
+# the buffer first, so a provider never looks older than its last ping here.
+# HEARTBEAT_FLUSH_SECONDS=0 turns buffering off (write-through).
+# Heartbeats also renew task leases; a flush renews every buffered lease
+# with (at most) two set-based UPDATEs, in the same transaction.
+
+FLUSH_SECONDS = float(os.getenv('HEARTBEAT_FLUSH_SECONDS', '3'))
+
+_UNSET = object()
+_lock = threading.Lock()
+_pending = {}       # provider_id -> {"last_seen": dt, "last_telemetry": ..., "leases": set() | None}
+_last_seen = {}     # provider_id -> newest heartbeat seen by this process
+_known = set()      # provider ids confirmed to exist, so pings skip the lookup
+_flusher_started = False
+
+def buffering_enabled():
+    return FLUSH_SECONDS > 0
+
+def mark_known(provider_id):
+    with _lock:
+        _known.add(provider_id)
+
+def is_known(provider_id):
+    """
+    True if the provider exists; only the first check per process hits the database.
+    """
+    if provider_id in _known:
+        return True
+    if db.session.query(Provider.id).filter_by(id=provider_id).first():
+        mark_known(provider_id)
+        return True
+    return False
+
+def record_heartbeat(provider_id, telemetry=_UNSET, leases=_UNSET):
+    """
+    leases: lease ids the agent is still running (renewed), None for an
+    agent that doesn't report them (all its RUNNING tasks are renewed), or
+    left out to renew nothing.
+    """
+    now = datetime.utcnow()
+    if not buffering_enabled():
+        values = {"last_seen": now, "status": 'active'}
+        if telemetry is not _UNSET:
+            values["last_telemetry"] = telemetry
+        db.session.execute(update(Provider).where(Provider.id == provider_id).values(**values))
+        if leases is not _UNSET:
+            renew_leases(leases or (), [provider_id] if leases is None else ())
+        db.session.commit()
+        return
+
+    with _lock:
+        entry = _pending.setdefault(provider_id, {})
+        entry["last_seen"] = now
+        if telemetry is not _UNSET:
+            entry["last_telemetry"] = telemetry
+        if leases is not _UNSET:
+            entry["leases"] = None if leases is None else set(leases)
+        _last_seen[provider_id] = now
+    _ensure_flusher()
+
+def buffered_last_seen(provider_id, db_value=None):
+    """
+    The freshest last_seen we know of: this process's buffer or the stored column.
+    """
+    buffered = _last_seen.get(provider_id)
+    if buffered and (db_value is None or buffered > db_value):
+        return buffered
+    return db_value
+
+def flush():
+    """
+    Writes all buffered heartbeats: one executemany UPDATE per column shape.
+    """
+    with _lock:
+        batch = dict(_pending)
+        _pending.clear()
+    if not batch:
+        return 0
+
+    with_telemetry, without_telemetry = [], []
+    lease_ids, whole_providers = set(), set()
+    for provider_id, entry in batch.items():
+        if "leases" in entry:
+            if entry["leases"] is None:
+                whole_providers.add(provider_id)
+            else:
+                lease_ids |= entry["leases"]
+        row = {"id": provider_id, "last_seen": entry["last_seen"], "status": 'active'}
+        if "last_telemetry" in entry:
+            row["last_telemetry"] = entry["last_telemetry"]
+            with_telemetry.append(row)
+        else:
+            without_telemetry.append(row)
+
+    try:
+        for rows in (with_telemetry, without_telemetry):
+            if rows:
+                # ORM bulk UPDATE by primary key
+                db.session.execute(update(Provider), rows)
+        renew_leases(lease_ids, whole_providers)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"💓 Heartbeat flush failed, will retry: {e}")
+        with _lock:
+            # Put them back unless a newer ping already replaced them
+            for provider_id, entry in batch.items():
+                _pending.setdefault(provider_id, entry)
+        return 0
+    return len(batch)
+
+def _ensure_flusher():
+    global _flusher_started
+    if _flusher_started:
+        return
+    from flask import current_app
+    app = current_app._get_current_object()
+    with _lock:
+        if _flusher_started:
+            return
+        _flusher_started = True
+
+    def _run():
+        while True:
+            time.sleep(FLUSH_SECONDS)
+            with app.app_context():
+                flush()
+
+    thread = threading.Thread(target=_run)
+    thread.daemon = True
+    thread.start()
+
+    def _final_flush():
+        with app.app_context():
+            flush()
+    atexit.register(_final_flush)
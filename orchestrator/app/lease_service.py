@@ -0,0 +1,87 @@
+import os
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import update, case, func
+from .models import db, Task
+
+# Lease-based execution. A claim grants the agent a lease on the task
+# (lease_id + lease_expires_at); the agent renews it by listing the lease in
+# its heartbeats. When a lease runs out the reaper puts the task back in the
+# queue after a backoff, until max_attempts is used up and it fails for good.
+# Reports from anyone but the current lease holder are rejected, and every
+# attempt uploads to its own artifact key, so a stale execution can never
+# overwrite the winner's results.
+
+LEASE_SECONDS = int(os.getenv('TASK_LEASE_SECONDS', '120'))
+MAX_ATTEMPTS = int(os.getenv('TASK_MAX_ATTEMPTS', '3'))
+RETRY_BACKOFF_SECONDS = int(os.getenv('TASK_RETRY_BACKOFF_SECONDS', '30'))  # Doubles per attempt
+MAX_BACKOFF_SECONDS = 15 * 60
+
+def new_lease():
+    """
+    Column values a claim writes: a fresh lease and one more attempt.
+    """
+    now = datetime.utcnow()
+    return {
+        "lease_id": str(uuid.uuid4()),
+        "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS),
+        "attempts": func.coalesce(Task.attempts, 0) + 1,
+        "not_before": None,
+    }
+
+def renew_leases(lease_ids=(), provider_ids=()):
+    """
+    Pushes out the expiry of the given leases, plus every RUNNING task of
+    provider_ids (agents that don't report their leases). Caller commits.
+    """
+    expires = datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+    renewed = 0
+    if lease_ids:
+        renewed += db.session.execute(
+            update(Task)
+            .where(Task.lease_id.in_(list(lease_ids)), Task.status == 'RUNNING')
+            .values(lease_expires_at=expires)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    if provider_ids:
+        renewed += db.session.execute(
+            update(Task)
+            .where(Task.provider_id.in_(list(provider_ids)), Task.status == 'RUNNING')
+            .values(lease_expires_at=expires)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    return renewed
+
+def holds_lease(task, lease_id=None, provider_id=None):
+    """
+    True if a report about `task` comes from the holder of its current
+    lease. Only a RUNNING task has one: once it was requeued, finished or
+    handed to someone else, every report about it is stale. Agents echo the
+    lease_id they were given; older agents that don't are matched on the
+    provider the lease was issued to, and a report naming neither is refused.
+    """
+    if task.status != 'RUNNING' or task.lease_id is None:
+        return False
+    if lease_id is not None:
+        return lease_id == task.lease_id
+    return provider_id is not None and task.provider_id == provider_id
+
+def artifact_key(task_id, attempt):
+    # First attempts keep the historical key; retries get their own
+    if not attempt or attempt <= 1:
+        return f"artifacts/{task_id}.zip"
+    return f"artifacts/{task_id}.attempt{attempt}.zip"
+
+def retry_after(now):
+    """
+    SQL expression for not_before of a requeued task: exponential in its
+    attempt count, capped at MAX_BACKOFF_SECONDS.
+    """
+    whens = {}
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        seconds = min(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1), MAX_BACKOFF_SECONDS)
+        whens[attempt] = now + timedelta(seconds=seconds)
+    return case(whens, value=Task.attempts, else_=now + timedelta(seconds=MAX_BACKOFF_SECONDS))
+
+def attempts_left():
+    return func.coalesce(Task.attempts, 0) < func.coalesce(Task.max_attempts, MAX_ATTEMPTS)
@@ -1,74 +1,339 @@
-import os
-import threading
-import json
-
-# Global variables to cache the connection so we don't reload it every time
-_W3 = None
-_CONTRACT = None
-
-def record_on_chain(task_id, status):
-    """
-    Decoupled logger. Spawns a thread so the main app stays fast.
-    """
-    # 1. THE SAFETY VALVE: Default to false so you don't crash by accident
-    if os.getenv('BLOCKCHAIN_ENABLED', 'false').lower() != 'true':
-        print(f"🔗 Ledger (SIMULATED): {task_id} -> {status}")
-        return
-
-    # 2. RUN IN BACKGROUND: Don't make the user wait for the blockchain
-    thread = threading.Thread(target=_heavy_blockchain_call, args=(task_id, status))
-    thread.daemon = True # Thread dies if the main app stops
-    thread.start()
-
-def _heavy_blockchain_call(task_id, status):
-    global _W3, _CONTRACT
-    
-    try:
-        # 🚀 LAZY IMPORTS: Only eats RAM when actually recording
-        from web3 import Web3 
-        
-        # 1. Initialize only once to save resources
-        if _W3 is None:
-            rpc_url = "https://sepolia.base.org"
-            _W3 = Web3(Web3.HTTPProvider(rpc_url))
-            
-            contract_addr = os.getenv('CONTRACT_ADDRESS')
-            base_dir = os.path.dirname(os.path.abspath(__file__))
-            abi_path = os.path.join(base_dir, 'contract_abi.json')
-            
-            if not os.path.exists(abi_path):
-                print(f"❌ Ledger Error: ABI file missing at {abi_path}")
-                return
-
-            with open(abi_path, 'r') as f:
-                abi = json.load(f)
-            
-            _CONTRACT = _W3.eth.contract(address=contract_addr, abi=abi)
-
-        # 2. Setup Credentials
-        account_addr = os.getenv('LEDGER_ACCOUNT_ADDRESS')
-        raw_key = os.getenv('LEDGER_PRIVATE_KEY')
-        if not account_addr or not raw_key:
-            print("❌ Ledger Error: Missing credentials in Env Vars")
-            return
-
-        private_key = raw_key if raw_key.startswith('0x') else '0x' + raw_key
-        nonce = _W3.eth.get_transaction_count(account_addr)
-        
-        # 3. Build & Sign Transaction
-        tx = _CONTRACT.functions.recordTask(str(task_id), str(status)).build_transaction({
-            'from': account_addr,
-            'nonce': nonce,
-            'gas': 200000,
-            'gasPrice': _W3.eth.gas_price,
-            'chainId': 84532
-        })
-
-        signed_tx = _W3.eth.account.sign_transaction(tx, private_key)
-        tx_hash = _W3.eth.send_raw_transaction(signed_tx.rawTransaction)
-        
-        print(f"🔗 Ledger SUCCESS! Hash: {_W3.to_hex(tx_hash)}")
-
-    except Exception as e:
-        # We catch everything so the background thread dying doesn't kill Flask
-        print(f"🔗 Ledger Background Error: {e}")
\ No newline at end of file
+import os
+import threading
+import time
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import func, text, update, select
+from .models import db, Task, LedgerOutbox, LedgerAnchor
+from .merkle import leaf_hash, build_tree
+
+# Ledger events go through a DB-backed outbox instead of a thread per event.
+# record_on_chain() only inserts an outbox row in the caller's transaction,
+# so an event exists exactly when the state change it describes commits and
+# survives restarts. A single writer drains the outbox: it hands out nonces
+# from a local counter, keeps up to MAX_IN_FLIGHT transactions pipelined
+# without waiting on receipts, and re-sends stuck ones with a bumped gas price.
+# Every hash broadcast for a nonce is kept and polled, since the original can
+# still be mined after it was replaced.
+#
+# LEDGER_MODE=anchor: instead of one transaction per event, the writer folds
+# every ANCHOR_WINDOW_SECONDS of events into a Merkle tree, keeps each event's
+# inclusion proof in its outbox row, and sends only the root (as a 'kind=anchor'
+# outbox row, through the same nonce/gas pipeline).
+
+LEDGER_LOCK_ID = 715_011
+WRITER_INTERVAL_SECONDS = 2
+MAX_IN_FLIGHT = 16
+MAX_ATTEMPTS = 8
+BUMP_AFTER = timedelta(seconds=90)   # Re-send a tx not mined after this long
+GAS_BUMP_PERCENT = 125               # Replacement tx needs >= +10%; bump harder to get mined
+GAS_LIMIT = 200000
+LEDGER_MODE = os.getenv('LEDGER_MODE', 'per_event')  # per_event | anchor
+ANCHOR_WINDOW = timedelta(seconds=int(os.getenv('ANCHOR_WINDOW_SECONDS', '300')))
+ANCHOR_MAX_LEAVES = 10000
+
+# Global variables to cache the connection so we don't reload it every time
+_CHAIN = None
+_writer_started = False
+
+def ledger_enabled():
+    return os.getenv('BLOCKCHAIN_ENABLED', 'false').lower() == 'true'
+
+def record_on_chain(task_id, status):
+    """
+    Queues a ledger event in the current transaction; it is sent once the caller commits.
+    """
+    # 1. THE SAFETY VALVE: Default to false so you don't crash by accident
+    if not ledger_enabled():
+        print(f"🔗 Ledger (SIMULATED): {task_id} -> {status}")
+        return
+
+    # 2. DURABLE: the writer picks it up after commit, even across restarts
+    db.session.add(LedgerOutbox(task_id=str(task_id), status=str(status)))
+
+class Web3Chain:
+    """
+    The handful of chain calls the writer needs. Swap in a stub with set_chain()
+    to test without a node, or point LEDGER_RPC_URL at a local dev chain (anvil).
+    """
+    def __init__(self):
+        # 🚀 LAZY IMPORTS: Only eats RAM when actually recording
+        from web3 import Web3
+
+        rpc_url = os.getenv('LEDGER_RPC_URL', 'https://sepolia.base.org')
+        self.w3 = Web3(Web3.HTTPProvider(rpc_url))
+        self.chain_id = int(os.getenv('LEDGER_CHAIN_ID', '84532'))
+
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        abi_path = os.path.join(base_dir, 'contract_abi.json')
+        with open(abi_path, 'r') as f:
+            abi = json.load(f)
+        self.contract = self.w3.eth.contract(address=os.getenv('CONTRACT_ADDRESS'), abi=abi)
+
+        self.account = os.getenv('LEDGER_ACCOUNT_ADDRESS')
+        raw_key = os.getenv('LEDGER_PRIVATE_KEY')
+        if not self.account or not raw_key:
+            raise RuntimeError("Missing LEDGER_ACCOUNT_ADDRESS / LEDGER_PRIVATE_KEY")
+        self.private_key = raw_key if raw_key.startswith('0x') else '0x' + raw_key
+
+    def pending_nonce(self):
+        return self.w3.eth.get_transaction_count(self.account, 'pending')
+
+    def gas_price(self):
+        return self.w3.eth.gas_price
+
+    def send(self, task_id, status, nonce, gas_price):
+        tx = self.contract.functions.recordTask(str(task_id), str(status)).build_transaction({
+            'from': self.account,
+            'nonce': nonce,
+            'gas': GAS_LIMIT,
+            'gasPrice': gas_price,
+            'chainId': self.chain_id
+        })
+        signed_tx = self.w3.eth.account.sign_transaction(tx, self.private_key)
+        return self.w3.to_hex(self.w3.eth.send_raw_transaction(signed_tx.rawTransaction))
+
+    def receipt_status(self, tx_hash):
+        """
+        1 = mined OK, 0 = reverted, None = not mined yet.
+        """
+        from web3.exceptions import TransactionNotFound
+        try:
+            return self.w3.eth.get_transaction_receipt(tx_hash)['status']
+        except TransactionNotFound:
+            return None
+
+def set_chain(chain):
+    global _CHAIN
+    _CHAIN = chain
+
+def _chain():
+    global _CHAIN
+    # Initialize only once to save resources
+    if _CHAIN is None:
+        _CHAIN = Web3Chain()
+    return _CHAIN
+
+def start_ledger_writer(app):
+    global _writer_started
+    if _writer_started or not ledger_enabled():
+        return
+    _writer_started = True
+
+    def _run():
+        while True:
+            time.sleep(WRITER_INTERVAL_SECONDS)
+            with app.app_context():
+                try:
+                    drain_outbox()
+                except Exception as e:
+                    # We catch everything so the writer thread dying doesn't kill Flask
+                    db.session.rollback()
+                    print(f"🔗 Ledger writer error: {e}")
+
+    thread = threading.Thread(target=_run)
+    thread.daemon = True # Thread dies if the main app stops
+    thread.start()
+
+def drain_outbox():
+    """
+    One writer tick. Only one process may run it at a time (advisory lock on
+    Postgres), which is what makes the local nonce counter safe.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        got_lock = db.session.execute(text('SELECT pg_try_advisory_xact_lock(:k)'), {'k': LEDGER_LOCK_ID}).scalar()
+        if not got_lock:
+            db.session.rollback()
+            return None
+
+    chain = _chain()
+    now = datetime.utcnow()
+    gas_price = chain.gas_price()
+    counts = {"confirmed": 0, "bumped": 0, "sent": 0, "failed": 0, "anchored": 0}
+
+    # 0. Anchor mode: close the window into a Merkle root first
+    if LEDGER_MODE == 'anchor':
+        counts["anchored"] = anchor_window(now)
+
+    # 1. Receipts for what's in flight; re-send stuck ones at the same nonce
+    in_flight = LedgerOutbox.query.filter_by(state='sent').order_by(LedgerOutbox.nonce).all()
+    for row in in_flight:
+        tx_hash, status = _mined(chain, row)
+        if status is not None:
+            _finish(row, tx_hash, status, counts)
+        elif now - row.sent_at > BUMP_AFTER:
+            bumped = max(row.gas_price * GAS_BUMP_PERCENT // 100, gas_price)
+            try:
+                tx_hash = chain.send(row.task_id, row.status, row.nonce, bumped)
+            except Exception as e:
+                row.last_error = str(e)
+                if _nonce_used(e):
+                    _nonce_taken(chain, row, now, counts)
+                continue  # Anything else ("already known", underpriced): try again next round
+            row.tx_hashes = _hashes(row) + [tx_hash]
+            row.tx_hash = tx_hash
+            row.gas_price = bumped
+            row.sent_at = now
+            counts["bumped"] += 1
+
+    # 2. Pipeline new sends on top, without waiting for receipts
+    slots = MAX_IN_FLIGHT - sum(1 for r in in_flight if r.state == 'sent')
+    if slots > 0:
+        highest = db.session.query(func.max(LedgerOutbox.nonce)).filter(
+            LedgerOutbox.state.in_(['sent', 'confirmed'])).scalar()
+        next_nonce = max(chain.pending_nonce(), (highest + 1) if highest is not None else 0)
+
+        pending = LedgerOutbox.query.filter(LedgerOutbox.state == 'pending', LedgerOutbox.next_attempt_at <= now)
+        if LEDGER_MODE == 'anchor':
+            # Events only reach the chain through their window's root
+            pending = pending.filter(LedgerOutbox.kind == 'anchor')
+        pending = (pending
+                   .order_by(LedgerOutbox.id)
+                   .limit(slots)
+                   .all())
+        for row in pending:
+            row.attempts += 1
+            try:
+                row.tx_hash = chain.send(row.task_id, row.status, next_nonce, gas_price)
+            except Exception as e:
+                row.last_error = str(e)
+                if row.attempts >= MAX_ATTEMPTS:
+                    row.state = 'failed'
+                    counts["failed"] += 1
+                else:
+                    # Exponential backoff; the nonce was not used, so don't advance it
+                    row.next_attempt_at = now + timedelta(seconds=2 ** row.attempts)
+                if 'nonce' in str(e).lower():
+                    next_nonce = chain.pending_nonce()
+                continue
+            row.tx_hashes = [row.tx_hash]
+            row.state = 'sent'
+            row.nonce = next_nonce
+            row.gas_price = gas_price
+            row.sent_at = now
+            next_nonce += 1
+            counts["sent"] += 1
+            # Hash is known as soon as it's broadcast; confirmed hashes overwrite it
+            _set_task_tx_hash(row)
+
+    db.session.commit()
+    if any(counts.values()):
+        print(f"🔗 Ledger writer: {counts}")
+    return counts
+
+def _hashes(row):
+    # Rows sent before tx_hashes existed only know their latest hash
+    return list(row.tx_hashes or ([row.tx_hash] if row.tx_hash else []))
+
+def _mined(chain, row):
+    """
+    (tx_hash, receipt status) of whichever transaction sent for the row's
+    nonce got mined, or (None, None) while none has.
+    """
+    for tx_hash in reversed(_hashes(row)):
+        status = chain.receipt_status(tx_hash)
+        if status is not None:
+            return tx_hash, status
+    return None, None
+
+def _finish(row, tx_hash, status, counts):
+    row.tx_hash = tx_hash
+    if status == 1:
+        row.state = 'confirmed'
+        _set_task_tx_hash(row)
+        counts["confirmed"] += 1
+    else:
+        row.state = 'failed'
+        row.last_error = "Transaction reverted"
+        counts["failed"] += 1
+
+def _nonce_used(error):
+    message = str(error).lower()
+    return 'nonce too low' in message or 'nonce has already been used' in message or 'nonce_expired' in message
+
+def _nonce_taken(chain, row, now, counts):
+    """
+    A bump was refused because the nonce is already mined. Normally one of
+    the row's own earlier sends landed since we polled. If none did, the nonce
+    went to a transaction we don't know about, and the event is sent again
+    under a new nonce instead of holding an in-flight slot forever.
+    """
+    tx_hash, status = _mined(chain, row)
+    if status is not None:
+        _finish(row, tx_hash, status, counts)
+        return
+    print(f"🔗 Ledger writer: nonce {row.nonce} of outbox row {row.id} was used by an unknown transaction; re-sending")
+    row.state = 'pending'
+    row.nonce = None
+    row.tx_hash = None
+    row.tx_hashes = None
+    row.next_attempt_at = now
+
+def _set_task_tx_hash(row):
+    if row.kind == 'anchor':
+        # Every task in the window shares the anchor transaction
+        anchored_tasks = select(LedgerOutbox.task_id).where(
+            LedgerOutbox.anchor_id == row.anchor_id, LedgerOutbox.kind == 'event')
+        criterion = Task.id.in_(anchored_tasks)
+    else:
+        criterion = Task.id == row.task_id
+    db.session.execute(update(Task).where(criterion).values(eth_tx_hash=row.tx_hash)
+                       .execution_options(synchronize_session=False))
+
+def _leaf_for(row):
+    created = row.created_at.isoformat() if row.created_at else ''
+    return f"{row.id}|{row.task_id}|{row.status}|{created}"
+
+def anchor_window(now):
+    """
+    Folds pending events into one Merkle root once the oldest has waited a
+    full window (or the window is full). Returns the number of events anchored.
+    """
+    base = LedgerOutbox.query.filter(LedgerOutbox.kind == 'event', LedgerOutbox.state == 'pending')
+    oldest = base.order_by(LedgerOutbox.id).first()
+    if not oldest or (now - oldest.created_at < ANCHOR_WINDOW and base.count() < ANCHOR_MAX_LEAVES):
+        return 0
+
+    rows = base.order_by(LedgerOutbox.id).limit(ANCHOR_MAX_LEAVES).all()
+    leaves = [_leaf_for(r) for r in rows]
+    root, proofs = build_tree([leaf_hash(leaf) for leaf in leaves])
+
+    anchor = LedgerAnchor(root=root, leaf_count=len(rows))
+    db.session.add(anchor)
+    db.session.flush()
+
+    db.session.execute(update(LedgerOutbox), [
+        {"id": r.id, "state": 'anchored', "anchor_id": anchor.id, "leaf": leaf, "proof": proof}
+        for r, leaf, proof in zip(rows, leaves, proofs)
+    ])
+    # The root itself rides the normal send pipeline
+    db.session.add(LedgerOutbox(kind='anchor', anchor_id=anchor.id, next_attempt_at=now,
+                                task_id=f"anchor-{anchor.id}", status=f"merkle-root:0x{root}"))
+    return len(rows)
+
+def task_proofs(task_id):
+    """
+    Inclusion proofs for a task's anchored ledger events, ready for verify_proof.py.
+    """
+    events = (LedgerOutbox.query
+              .filter(LedgerOutbox.task_id == task_id, LedgerOutbox.kind == 'event',
+                      LedgerOutbox.anchor_id.isnot(None))
+              .order_by(LedgerOutbox.id)
+              .all())
+    if not events:
+        return []
+
+    anchor_ids = {e.anchor_id for e in events}
+    anchors = {a.id: a for a in LedgerAnchor.query.filter(LedgerAnchor.id.in_(anchor_ids))}
+    anchor_txs = {r.anchor_id: r for r in LedgerOutbox.query.filter(
+        LedgerOutbox.kind == 'anchor', LedgerOutbox.anchor_id.in_(anchor_ids))}
+
+    return [{
+        "status": e.status,
+        "leaf": e.leaf,
+        "proof": e.proof,
+        "root": anchors[e.anchor_id].root,
+        "anchor_id": e.anchor_id,
+        "anchor_tx_hash": anchor_txs[e.anchor_id].tx_hash if e.anchor_id in anchor_txs else None,
+        "anchor_state": anchor_txs[e.anchor_id].state if e.anchor_id in anchor_txs else None
+    } for e in events]
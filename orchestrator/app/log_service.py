@@ -0,0 +1,176 @@
+import os
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
+from .models import db, Task, TaskLogChunk
+from .storage_service import put_gzipped_text
+
+LOG_STREAMS = ('stdout', 'stderr')
+TERMINAL_STATUSES = ('COMPLETED', 'FAILED', 'CANCELLED')
+MAX_CHUNK_CHARS = 1024 * 1024  # Agents should flush well below this
+MAX_READ_CHARS = 256 * 1024
+INLINE_LOG_LIMIT = 64 * 1024  # Characters kept in the tasks row; bigger logs go to R2
+OFFLOADABLE_FIELDS = ('stdout', 'stderr', 'error_message')
+COMPACT_BATCH = int(os.getenv('LOG_COMPACT_BATCH', '50'))  # Finished tasks the reaper compacts per sweep
+
+class ChunkRejected(Exception):
+    def __init__(self, message, expected_seq=None):
+        super().__init__(message)
+        self.expected_seq = expected_seq
+
+def append_chunk(task, stream, seq, data):
+    """
+    Appends chunk `seq` to a task's log. Re-sending a chunk that is already
+    stored is a no-op, so agents can retry blindly. Returns (duplicate, next_seq).
+    """
+    if stream not in LOG_STREAMS:
+        raise ChunkRejected(f"Unknown stream '{stream}'")
+    if len(data) > MAX_CHUNK_CHARS:
+        raise ChunkRejected(f"Chunk larger than {MAX_CHUNK_CHARS} characters")
+
+    if task.status in TERMINAL_STATUSES:
+        raise ChunkRejected("Task already finished; logs are closed")
+
+    if TaskLogChunk.query.filter_by(task_id=task.id, stream=stream, seq=seq).first():
+        return True, _next_seq(task.id, stream)
+
+    # Only the previous chunk is needed to place this one: constant cost per append
+    prev = None
+    if seq > 0:
+        prev = TaskLogChunk.query.filter_by(task_id=task.id, stream=stream, seq=seq - 1).first()
+        if not prev:
+            raise ChunkRejected("Out of order chunk", expected_seq=_next_seq(task.id, stream))
+
+    start = prev.end_offset if prev else 0
+    db.session.add(TaskLogChunk(
+        task_id=task.id,
+        stream=stream,
+        seq=seq,
+        start_offset=start,
+        end_offset=start + len(data),
+        data=data
+    ))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A retry of the same chunk raced us in; it's already stored
+        db.session.rollback()
+        return True, _next_seq(task.id, stream)
+    return False, seq + 1
+
+def _next_seq(task_id, stream):
+    last = db.session.query(func.max(TaskLogChunk.seq)).filter_by(task_id=task_id, stream=stream).scalar()
+    return 0 if last is None else last + 1
+
+def offloaded_ref(task, field):
+    return (task.log_refs or {}).get(field)
+
+def store_log(task, field, parts, size):
+    """
+    Size-tiered write of a whole log: up to INLINE_LOG_LIMIT characters stay
+    in the row, anything larger is gzipped to R2 and only a pointer is kept.
+    `parts` is an iterable of strings totalling `size` characters.
+    """
+    refs = dict(task.log_refs or {})
+    if size <= INLINE_LOG_LIMIT:
+        setattr(task, field, ''.join(parts))
+        refs.pop(field, None)
+    else:
+        parts = list(parts) if isinstance(parts, (list, tuple)) else parts
+        key = f"logs/{task.id}/{field}.txt.gz"
+        try:
+            stored_bytes = put_gzipped_text(key, parts)
+        except Exception as e:
+            if not isinstance(parts, list):
+                raise  # A consumed generator can't be replayed inline
+            print(f"R2 log offload failed for {task.id}/{field}, keeping inline: {e}")
+            setattr(task, field, ''.join(parts))
+            refs.pop(field, None)
+        else:
+            setattr(task, field, None)
+            refs[field] = {"key": key, "size": size, "stored_bytes": stored_bytes}
+    # Reassign so SQLAlchemy notices the JSON change
+    task.log_refs = refs or None
+
+def log_size(task, stream):
+    size = db.session.query(func.max(TaskLogChunk.end_offset)).filter_by(task_id=task.id, stream=stream).scalar()
+    if size is not None:
+        return size
+    ref = offloaded_ref(task, stream)
+    if ref:
+        return ref['size']
+    # Compacted (or legacy whole-text) log
+    return len(getattr(task, stream) or '')
+
+def read_range(task, stream, offset, limit=MAX_READ_CHARS):
+    """
+    Returns up to `limit` characters of the log starting at `offset`,
+    touching only the chunks that overlap the range. Returns None when the
+    log has been offloaded to R2 (serve offloaded_ref(...)['key'] instead).
+    """
+    limit = min(limit, MAX_READ_CHARS)
+    chunks = (TaskLogChunk.query
+              .filter(TaskLogChunk.task_id == task.id,
+                      TaskLogChunk.stream == stream,
+                      TaskLogChunk.end_offset > offset,
+                      TaskLogChunk.start_offset < offset + limit)
+              .order_by(TaskLogChunk.end_offset)
+              .all())
+
+    if not chunks:
+        if offloaded_ref(task, stream):
+            return None
+        text = getattr(task, stream) or ''
+        return text[offset:offset + limit]
+
+    # Appends are strictly ordered, so the overlapping chunks are contiguous
+    text = ''.join(c.data for c in chunks)
+    start = offset - chunks[0].start_offset
+    return text[start:start + limit]
+
+def compact_task_logs(task_id):
+    """
+    Folds a finished task's chunks into its stdout/stderr columns and drops
+    them. Caller commits. Returns whether there was anything to fold.
+    """
+    task = db.session.get(Task, task_id)
+    if not task or task.status not in TERMINAL_STATUSES:
+        return False
+
+    compacted = False
+    for stream in LOG_STREAMS:
+        size = db.session.query(func.max(TaskLogChunk.end_offset)).filter_by(task_id=task_id, stream=stream).scalar()
+        if size is None:
+            continue
+        # Stream chunks in batches straight into the tiered store
+        chunks = (TaskLogChunk.query
+                  .filter_by(task_id=task_id, stream=stream)
+                  .order_by(TaskLogChunk.seq)
+                  .yield_per(200))
+        store_log(task, stream, (c.data for c in chunks), size)
+        TaskLogChunk.query.filter_by(task_id=task_id, stream=stream).delete(synchronize_session=False)
+        compacted = True
+    return compacted
+
+def compact_finished_logs(limit=COMPACT_BATCH):
+    """
+    Compacts up to `limit` finished tasks that still have log chunks, however
+    they finished: agent report, reaper, cancelled copy or failed parent.
+    Each task gets its own savepoint, so one failed R2 upload only leaves
+    that task for the next sweep. Caller commits. Returns how many were done.
+    """
+    task_ids = db.session.execute(
+        select(TaskLogChunk.task_id)
+        .join(Task, Task.id == TaskLogChunk.task_id)
+        .where(Task.status.in_(TERMINAL_STATUSES))
+        .distinct()
+        .limit(limit)
+    ).scalars().all()
+
+    done = 0
+    for task_id in task_ids:
+        try:
+            with db.session.begin_nested():
+                done += compact_task_logs(task_id)
+        except Exception as e:
+            print(f"Log compaction failed for {task_id}: {e}")
+    return done
@@ -0,0 +1,52 @@
+import hashlib
+
+# Binary SHA-256 Merkle tree over ledger events. Leaves are hashed with a
+# 0x00 prefix and inner nodes with 0x01 so a leaf can never pose as a node.
+# An odd node at the end of a level is promoted unchanged.
+
+def _h(data):
+    return hashlib.sha256(data).digest()
+
+def leaf_hash(leaf):
+    return _h(b'\x00' + leaf.encode('utf-8')).hex()
+
+def _node(left, right):
+    return _h(b'\x01' + bytes.fromhex(left) + bytes.fromhex(right)).hex()
+
+def build_tree(leaf_hashes):
+    """
+    Returns (root, proofs) where proofs[i] is a list of {"hash", "side"} steps
+    taking leaf i to the root; "side" is where the sibling sits.
+    """
+    if not leaf_hashes:
+        raise ValueError("Cannot build a Merkle tree with no leaves")
+
+    proofs = [[] for _ in leaf_hashes]
+    positions = list(range(len(leaf_hashes)))  # Index of each leaf's ancestor at this level
+    level = list(leaf_hashes)
+
+    while len(level) > 1:
+        parents = []
+        for i in range(0, len(level), 2):
+            parents.append(_node(level[i], level[i + 1]) if i + 1 < len(level) else level[i])
+
+        for leaf, pos in enumerate(positions):
+            sibling = pos ^ 1
+            if sibling < len(level):
+                proofs[leaf].append({"hash": level[sibling], "side": "left" if sibling < pos else "right"})
+            positions[leaf] = pos // 2
+        level = parents
+
+    return level[0], proofs
+
+def root_from_proof(leaf_hex, proof):
+    current = leaf_hex
+    for step in proof:
+        if step["side"] == "left":
+            current = _node(step["hash"], current)
+        else:
+            current = _node(current, step["hash"])
+    return current
+
+def verify(leaf, proof, root):
+    return root_from_proof(leaf_hash(leaf), proof) == root.lower().removeprefix('0x')
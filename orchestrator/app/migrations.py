@@ -0,0 +1,153 @@
+from datetime import datetime, timedelta
+from sqlalchemy import inspect, text
+from .models import db, User, Provider, Task, GpuSlot, TaskEvent, LedgerOutbox, Job, SchemaMigration
+from .lease_service import LEASE_SECONDS
+
+# db.create_all() only creates missing tables; it never touches tables that
+# already exist on NeonDB. Anything that changes an existing table (new
+# columns, new indexes) goes here as a numbered step. Steps must be
+# idempotent: a fresh database already has everything via create_all().
+
+MIGRATION_LOCK_ID = 715_002  # Arbitrary pg_advisory_lock key for schema changes
+
+def _create_index(index):
+    index.create(bind=db.session.connection(), checkfirst=True)
+
+def _add_column(model, column_name):
+    table = model.__table__
+    existing = {c['name'] for c in inspect(db.session.connection()).get_columns(table.name)}
+    if column_name in existing:
+        return
+    column = table.c[column_name]
+    col_type = column.type.compile(dialect=db.engine.dialect)
+    db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column_name} {col_type}'))
+
+def _index(model, name):
+    return next(i for i in model.__table__.indexes if i.name == name)
+
+def _0001_hot_query_indexes():
+    for name in ['ix_tasks_queued_fifo', 'ix_tasks_user_submitted',
+                 'ix_tasks_running_last_update', 'ix_tasks_provider_id']:
+        _create_index(_index(Task, name))
+    _create_index(_index(Provider, 'ix_providers_user_id'))
+
+def _0002_task_delta_index():
+    _create_index(_index(Task, 'ix_tasks_user_last_update'))
+
+def _0003_task_log_refs():
+    _add_column(Task, 'log_refs')
+
+def _0004_task_event_retention_index():
+    _create_index(_index(TaskEvent, 'ix_task_events_created_at'))
+
+def _0005_ledger_anchoring():
+    for column in ['kind', 'anchor_id', 'leaf', 'proof']:
+        _add_column(LedgerOutbox, column)
+    # Existing rows predate anchoring and are all plain events
+    db.session.execute(text("UPDATE ledger_outbox SET kind = 'event' WHERE kind IS NULL"))
+    _create_index(_index(LedgerOutbox, 'ix_ledger_outbox_anchor_id'))
+
+def _0006_task_project_digest():
+    _add_column(Task, 'project_digest')
+
+def _0007_capability_scheduling():
+    for column in ['req_gpu_memory_mb', 'req_gpu_count', 'req_cpu_cores', 'req_ram_mb', 'req_cuda_capability']:
+        _add_column(Task, column)
+    # Existing tasks asked for nothing beyond one GPU
+    db.session.execute(text(
+        "UPDATE tasks SET req_gpu_memory_mb = 0, req_gpu_count = 1, req_cpu_cores = 0, "
+        "req_ram_mb = 0, req_cuda_capability = 0 WHERE req_gpu_count IS NULL"
+    ))
+    _create_index(_index(Task, 'ix_tasks_queued_class'))
+    _add_column(GpuSlot, 'cuda_capability')
+    _create_index(_index(GpuSlot, 'ix_gpu_slots_idle_capacity'))
+    for column in ['cpu_cores', 'ram_mb']:
+        _add_column(Provider, column)
+
+def _0008_fair_share():
+    _add_column(Task, 'priority')
+    db.session.execute(text("UPDATE tasks SET priority = 1 WHERE priority IS NULL"))
+    for column in ['share_weight', 'max_running']:
+        _add_column(User, column)
+    db.session.execute(text("UPDATE users SET share_weight = 1.0 WHERE share_weight IS NULL"))
+    for name in ['ix_tasks_queued_lane', 'ix_tasks_start_time']:
+        _create_index(_index(Task, name))
+
+def _0009_task_leases():
+    for column in ['lease_id', 'lease_expires_at', 'attempts', 'max_attempts', 'not_before']:
+        _add_column(Task, column)
+    # Anything that already ran used up one attempt
+    db.session.execute(text(
+        "UPDATE tasks SET attempts = CASE WHEN start_time IS NULL THEN 0 ELSE 1 END WHERE attempts IS NULL"
+    ))
+    for name in ['ix_tasks_lease_id', 'ix_tasks_running_lease']:
+        _create_index(_index(Task, name))
+
+def _0010_speculative_execution():
+    for column in ['batch_id', 'speculative', 'speculative_of', 'pinned_provider_id', 'winner_task_id']:
+        _add_column(Task, column)
+    for name in ['ix_tasks_batch_id', 'ix_tasks_speculative_of']:
+        _create_index(_index(Task, name))
+
+def _0011_jobs():
+    # The jobs table itself comes from create_all()
+    _add_column(Task, 'job_id')
+    _create_index(_index(Task, 'ix_tasks_job_status'))
+
+def _0012_task_dependencies():
+    # task_dependencies comes from create_all()
+    _add_column(Task, 'pending_parents')
+    _add_column(Job, 'reduce_task_id')
+
+def _0013_lease_running_tasks():
+    # Reports only count from the holder of a RUNNING task's lease. Tasks
+    # claimed before leases existed get one (their own id will do), so their
+    # agents, matched on provider_id, can still finish them.
+    db.session.execute(text(
+        "UPDATE tasks SET lease_id = id, lease_expires_at = :expires "
+        "WHERE status = 'RUNNING' AND lease_id IS NULL"
+    ), {"expires": datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)})
+
+def _0014_ledger_tx_hashes():
+    _add_column(LedgerOutbox, 'tx_hashes')
+
+def _0015_running_user_index():
+    _create_index(_index(Task, 'ix_tasks_running_user'))
+
+MIGRATIONS = [
+    (1, 'hot_query_indexes', _0001_hot_query_indexes),
+    (2, 'task_delta_index', _0002_task_delta_index),
+    (3, 'task_log_refs', _0003_task_log_refs),
+    (4, 'task_event_retention_index', _0004_task_event_retention_index),
+    (5, 'ledger_anchoring', _0005_ledger_anchoring),
+    (6, 'task_project_digest', _0006_task_project_digest),
+    (7, 'capability_scheduling', _0007_capability_scheduling),
+    (8, 'fair_share', _0008_fair_share),
+    (9, 'task_leases', _0009_task_leases),
+    (10, 'speculative_execution', _0010_speculative_execution),
+    (11, 'jobs', _0011_jobs),
+    (12, 'task_dependencies', _0012_task_dependencies),
+    (13, 'lease_running_tasks', _0013_lease_running_tasks),
+    (14, 'ledger_tx_hashes', _0014_ledger_tx_hashes),
+    (15, 'running_user_index', _0015_running_user_index),
+]
+
+def run_migrations():
+    """
+    Applies any pending MIGRATIONS in order. Safe to call from every worker:
+    on Postgres an advisory lock makes the others wait, then skip.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:k)'), {'k': MIGRATION_LOCK_ID})
+
+    applied = {m.version for m in SchemaMigration.query.all()}
+    pending = [m for m in MIGRATIONS if m[0] not in applied]
+
+    for version, name, step in pending:
+        step()
+        db.session.add(SchemaMigration(version=version, name=name))
+        print(f" Migration {version:04d}_{name} applied.")
+
+    # Commits the steps and releases the advisory lock in one go
+    db.session.commit()
+    return [name for _, name, _ in pending]
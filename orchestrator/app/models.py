@@ -1,71 +1,265 @@
-from datetime import datetime
-from flask_sqlalchemy import SQLAlchemy
-import uuid
-from datetime import datetime
-
-db = SQLAlchemy()
-
-class User(db.Model):
-    __tablename__ = 'users'
-    id = db.Column(db.String(128), primary_key=True) # Clerk ID
-    email = db.Column(db.String(255), unique=True, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    tasks = db.relationship('Task', backref='owner', lazy=True)
-    providers = db.relationship('Provider', backref='owner', lazy=True)
-
-class Provider(db.Model):
-    __tablename__ = 'providers'
-    id = db.Column(db.String(36), primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    user_id = db.Column(db.String(128), db.ForeignKey('users.id'), nullable=True)
-    gpus = db.Column(db.Text) # JSON string of GPU resources
-    status = db.Column(db.String(20), default='active')
-    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
-    address = db.Column(db.String(255), nullable=True)
-    last_telemetry = db.Column(db.JSON, nullable=True)
-    specs = db.Column(db.JSON)
-
-class EnrollmentToken(db.Model):
-    __tablename__ = 'enrollment_tokens'
-    token = db.Column(db.String, primary_key=True)
-    user_id = db.Column(db.String, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    expires_at = db.Column(db.DateTime, nullable=False)
-    is_used = db.Column(db.Boolean, default=False)
-
-class Task(db.Model):
-    __tablename__ = 'tasks'
-    
-    # Identity & Ownership
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = db.Column(db.String(128), db.ForeignKey('users.id'), nullable=True)
-    provider_id = db.Column(db.String(36), db.ForeignKey('providers.id'), nullable=True)
-    
-    # Execution State
-    status = db.Column(db.String(20), default='QUEUED')
-    docker_image = db.Column(db.String(255))
-    gpu_requirements = db.Column(db.Text)
-    gpu_assigned = db.Column(db.Text)
-    
-    # Workflow Metadata
-    input_path = db.Column(db.Text)   # Presigned URL for code
-    output_path = db.Column(db.Text)  # Target path if applicable
-    script_path = db.Column(db.Text)  # Entry point (e.g. main.py)
-    env_vars = db.Column(db.Text)     # JSON string of env variables
-    result_url = db.Column(db.Text)   # Artifacts download link (R2)
-    
-    # Time Tracking
-    submission_time = db.Column(db.DateTime, default=datetime.utcnow)
-    start_time = db.Column(db.DateTime, nullable=True)
-    end_time = db.Column(db.DateTime, nullable=True)
-    last_update = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    
-    # Execution Feedback
-    stdout = db.Column(db.Text)
-    stderr = db.Column(db.Text)
-    error_message = db.Column(db.Text)
-    
-    # Verification
-    eth_tx_hash = db.Column(db.String(66), nullable=True)
\ No newline at end of file
+from datetime import datetime
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+import uuid
+from datetime import datetime
+
+db = SQLAlchemy()
+
+class User(db.Model):
+    __tablename__ = 'users'
+    id = db.Column(db.String(128), primary_key=True) # Clerk ID
+    email = db.Column(db.String(255), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Fair-share scheduling: relative share of the fleet, and a cap on RUNNING tasks (NULL = USER_MAX_RUNNING)
+    share_weight = db.Column(db.Float, default=1.0)
+    max_running = db.Column(db.Integer, nullable=True)
+    
+    # Relationships
+    tasks = db.relationship('Task', backref='owner', lazy=True)
+    providers = db.relationship('Provider', backref='owner', lazy=True)
+
+class Provider(db.Model):
+    __tablename__ = 'providers'
+    id = db.Column(db.String(36), primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    user_id = db.Column(db.String(128), db.ForeignKey('users.id'), nullable=True, index=True)
+    gpus = db.Column(db.Text) # JSON string of GPUs as reported at registration (live state is in gpu_slots)
+    status = db.Column(db.String(20), default='active')
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    address = db.Column(db.String(255), nullable=True)
+    last_telemetry = db.Column(db.JSON, nullable=True)
+    specs = db.Column(db.JSON)
+    # Parsed from specs at registration so the scheduler can filter on them
+    cpu_cores = db.Column(db.Integer, nullable=True)
+    ram_mb = db.Column(db.Integer, nullable=True)
+
+    slots = db.relationship('GpuSlot', backref='provider', lazy=True)
+
+class GpuSlot(db.Model):
+    __tablename__ = 'gpu_slots'
+    __table_args__ = (
+        db.UniqueConstraint('provider_id', 'gpu_id', name='uq_gpu_slots_provider_gpu'),
+        # "Idle slot on this provider" and fleet-wide idle capacity
+        db.Index('ix_gpu_slots_status_provider', 'status', 'provider_id'),
+        # Capacity lookups: "idle slots with at least N MB"
+        db.Index('ix_gpu_slots_idle_capacity', 'status', 'memory_mb'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    provider_id = db.Column(db.String(36), db.ForeignKey('providers.id'), nullable=False)
+    gpu_id = db.Column(db.String(64), nullable=False)  # Agent-side id, e.g. "gpu-0"
+    name = db.Column(db.String(255))
+    memory_mb = db.Column(db.Integer, nullable=True)
+    cuda_capability = db.Column(db.Float, nullable=True)  # e.g. 8.6
+    status = db.Column(db.String(20), default='idle', nullable=False)  # idle | busy
+    task_id = db.Column(db.String(36), db.ForeignKey('tasks.id'), nullable=True, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class EnrollmentToken(db.Model):
+    __tablename__ = 'enrollment_tokens'
+    token = db.Column(db.String, primary_key=True)
+    user_id = db.Column(db.String, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    is_used = db.Column(db.Boolean, default=False)
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Task(db.Model):
+    __tablename__ = 'tasks'
+    __table_args__ = (
+        # FIFO head lookup: status='QUEUED' ORDER BY submission_time
+        db.Index('ix_tasks_queued_fifo', 'submission_time',
+                 postgresql_where=text("status = 'QUEUED'"),
+                 sqlite_where=text("status = 'QUEUED'")),
+        # /consumer/tasks: user_id = ? ORDER BY submission_time DESC
+        db.Index('ix_tasks_user_submitted', 'user_id', 'submission_time'),
+        # /consumer/tasks?since=: user_id = ? AND last_update > ?
+        db.Index('ix_tasks_user_last_update', 'user_id', 'last_update'),
+        # Stale sweep: status='RUNNING' AND last_update < ?
+        db.Index('ix_tasks_running_last_update', 'last_update',
+                 postgresql_where=text("status = 'RUNNING'"),
+                 sqlite_where=text("status = 'RUNNING'")),
+        # Scheduler: queued requirement classes and the FIFO head of each
+        db.Index('ix_tasks_queued_class', 'req_gpu_memory_mb', 'req_gpu_count', 'req_cpu_cores',
+                 'req_ram_mb', 'req_cuda_capability', 'submission_time',
+                 postgresql_where=text("status = 'QUEUED'"),
+                 sqlite_where=text("status = 'QUEUED'")),
+        # Fair-share scheduler: queued lanes (priority, owner, class) and the FIFO head of each
+        db.Index('ix_tasks_queued_lane', 'priority', 'user_id', 'req_gpu_memory_mb', 'req_gpu_count',
+                 'req_cpu_cores', 'req_ram_mb', 'req_cuda_capability', 'submission_time',
+                 postgresql_where=text("status = 'QUEUED'"),
+                 sqlite_where=text("status = 'QUEUED'")),
+        # Fair share: RUNNING tasks per user, on every claim
+        db.Index('ix_tasks_running_user', 'user_id',
+                 postgresql_where=text("status = 'RUNNING'"),
+                 sqlite_where=text("status = 'RUNNING'")),
+        # Queue wait stats: tasks started in a recent window
+        db.Index('ix_tasks_start_time', 'start_time'),
+        # Reaper: RUNNING tasks whose lease ran out
+        db.Index('ix_tasks_running_lease', 'lease_expires_at',
+                 postgresql_where=text("status = 'RUNNING'"),
+                 sqlite_where=text("status = 'RUNNING'")),
+        # Job progress: job_id = ? GROUP BY status
+        db.Index('ix_tasks_job_status', 'job_id', 'status'),
+    )
+    
+    # Identity & Ownership
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.String(128), db.ForeignKey('users.id'), nullable=True)
+    provider_id = db.Column(db.String(36), db.ForeignKey('providers.id'), nullable=True, index=True)
+    
+    # Execution State
+    status = db.Column(db.String(20), default='QUEUED')
+    docker_image = db.Column(db.String(255))
+    gpu_requirements = db.Column(db.Text)  # JSON as submitted
+    gpu_assigned = db.Column(db.Text)
+
+    # Requirements normalized for matching (see scheduler_service); 0 = no minimum
+    req_gpu_memory_mb = db.Column(db.Integer, default=0)
+    req_gpu_count = db.Column(db.Integer, default=1)
+    req_cpu_cores = db.Column(db.Integer, default=0)
+    req_ram_mb = db.Column(db.Integer, default=0)
+    req_cuda_capability = db.Column(db.Float, default=0)
+    priority = db.Column(db.Integer, default=1)  # scheduler_service.PRIORITIES: 0 low, 1 normal, 2 high
+
+    # Lease-based execution (lease_service): the holder renews via heartbeats
+    lease_id = db.Column(db.String(36), nullable=True, index=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, nullable=True)  # NULL = TASK_MAX_ATTEMPTS
+    not_before = db.Column(db.DateTime, nullable=True)   # Retry backoff: not claimable until then
+
+    # Batches and speculative execution (speculation_service)
+    batch_id = db.Column(db.String(64), nullable=True, index=True)
+    speculative = db.Column(db.Boolean, default=False)  # Opted in to straggler copies
+    speculative_of = db.Column(db.String(36), nullable=True, index=True)  # Set on copies: the original
+    pinned_provider_id = db.Column(db.String(36), nullable=True)  # Only this provider may claim it
+    winner_task_id = db.Column(db.String(36), nullable=True)  # Set on an original a copy completed
+
+    # Parent job (sweep_service); its children are listed and followed through the job
+    job_id = db.Column(db.String(36), db.ForeignKey('jobs.id'), nullable=True)
+
+    # Dependencies (dependency_service): a BLOCKED task is queued once this reaches 0
+    pending_parents = db.Column(db.Integer, default=0)
+    
+    # Workflow Metadata
+    input_path = db.Column(db.Text)   # Presigned URL for code
+    project_digest = db.Column(db.String(64), nullable=True)  # sha256 of the project ZIP, if content-addressed
+    output_path = db.Column(db.Text)  # Target path if applicable
+    script_path = db.Column(db.Text)  # Entry point (e.g. main.py)
+    env_vars = db.Column(db.Text)     # JSON string of env variables
+    result_url = db.Column(db.Text)   # Artifacts download link (R2)
+    
+    # Time Tracking
+    submission_time = db.Column(db.DateTime, default=datetime.utcnow)
+    start_time = db.Column(db.DateTime, nullable=True)
+    end_time = db.Column(db.DateTime, nullable=True)
+    last_update = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Execution Feedback
+    # Deferred: only loaded when accessed, so hot queries don't drag log text along.
+    # Logs over the inline limit live in R2; log_refs holds {field: {key, size, stored_bytes}}.
+    stdout = db.deferred(db.Column(db.Text))
+    stderr = db.deferred(db.Column(db.Text))
+    error_message = db.deferred(db.Column(db.Text))
+    log_refs = db.Column(db.JSON, nullable=True)
+    
+    # Verification
+    eth_tx_hash = db.Column(db.String(66), nullable=True)
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # /consumer/jobs: user_id = ? ORDER BY created_at DESC
+        db.Index('ix_jobs_user_created', 'user_id', 'created_at'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.String(128), db.ForeignKey('users.id'), nullable=True)
+    kind = db.Column(db.String(20), default='sweep', nullable=False)
+    name = db.Column(db.String(255), nullable=True)
+    task_count = db.Column(db.Integer, default=0, nullable=False)
+    reduce_task_id = db.Column(db.String(36), nullable=True)  # Sharded jobs: the task that combines the shards
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class TaskDependency(db.Model):
+    __tablename__ = 'task_dependencies'
+    __table_args__ = (
+        # Release on completion: parent_id = ?
+        db.Index('ix_task_dependencies_parent', 'parent_id'),
+    )
+
+    task_id = db.Column(db.String(36), db.ForeignKey('tasks.id'), primary_key=True)
+    parent_id = db.Column(db.String(36), db.ForeignKey('tasks.id'), primary_key=True)
+    position = db.Column(db.Integer, default=0, nullable=False)  # Order of the parent's artifact in the child's inputs
+
+class TaskEvent(db.Model):
+    __tablename__ = 'task_events'
+    __table_args__ = (
+        # SSE resume: user_id = ? AND id > cursor ORDER BY id
+        db.Index('ix_task_events_user_cursor', 'user_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)  # Monotonic; doubles as the stream cursor
+    task_id = db.Column(db.String(36), db.ForeignKey('tasks.id'), nullable=False)
+    user_id = db.Column(db.String(128), nullable=True)
+    status = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Retention pruning
+
+class TaskLogChunk(db.Model):
+    __tablename__ = 'task_log_chunks'
+    __table_args__ = (
+        # Idempotent appends and in-order range reads per (task, stream)
+        db.UniqueConstraint('task_id', 'stream', 'seq', name='uq_task_log_chunks_seq'),
+        db.Index('ix_task_log_chunks_range', 'task_id', 'stream', 'end_offset'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.String(36), db.ForeignKey('tasks.id'), nullable=False)
+    stream = db.Column(db.String(10), nullable=False)  # stdout | stderr
+    seq = db.Column(db.Integer, nullable=False)         # 0, 1, 2, ... per stream
+    start_offset = db.Column(db.Integer, nullable=False)  # Character offsets into the full log
+    end_offset = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class LedgerOutbox(db.Model):
+    __tablename__ = 'ledger_outbox'
+    __table_args__ = (
+        # Writer picks pending rows in order and polls receipts of sent ones
+        db.Index('ix_ledger_outbox_state', 'state', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), default='event', nullable=False)  # event | anchor (Merkle root)
+    task_id = db.Column(db.String(36), nullable=False)
+    status = db.Column(db.String(100), nullable=False)  # What gets written on-chain
+    state = db.Column(db.String(20), default='pending', nullable=False)  # pending | sent | confirmed | failed | anchored
+    nonce = db.Column(db.Integer, nullable=True)
+    gas_price = db.Column(db.BigInteger, nullable=True)
+    tx_hash = db.Column(db.String(66), nullable=True)  # The mined one once confirmed, else the latest sent
+    tx_hashes = db.Column(db.JSON, nullable=True)      # Every hash sent for this nonce (bumps); any may get mined
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    # Anchor mode: events are not sent themselves but folded into a Merkle root
+    anchor_id = db.Column(db.Integer, db.ForeignKey('ledger_anchors.id'), nullable=True, index=True)
+    leaf = db.Column(db.Text, nullable=True)   # Exact string that was hashed into the tree
+    proof = db.Column(db.JSON, nullable=True)  # [{"hash", "side"}, ...] from leaf to root
+
+class LedgerAnchor(db.Model):
+    __tablename__ = 'ledger_anchors'
+    id = db.Column(db.Integer, primary_key=True)
+    root = db.Column(db.String(64), nullable=False)
+    leaf_count = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
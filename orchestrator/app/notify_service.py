@@ -0,0 +1,135 @@
+import os
+import select
+import threading
+import time
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from .models import db
+
+# Wake-ups for requests that park waiting on something to happen (long-polling
+# agents, SSE streams). Every process keeps one generation counter per topic,
+# guarded by a Condition; bumping it wakes all requests parked on that topic in
+# this process. On Postgres, NOTIFY carries the bump across gunicorn workers:
+# each process runs one LISTEN thread that forwards notifications locally.
+
+WORK = 'matcha_work'            # A task was queued or a GPU slot was freed
+TASK_EVENTS = 'matcha_task_events'  # A task changed status
+TOPICS = (WORK, TASK_EVENTS)
+
+# Parked requests hold a gunicorn thread for their whole wait (gthread: 16 per
+# worker, see the Dockerfile). At most PARKED_MAX of them may be parked at once
+# per process, so short requests always find a free thread; the rest are
+# turned away with 503 + Retry-After instead of queueing behind them.
+PARKED_MAX = int(os.getenv('PARKED_CONNECTIONS_MAX', '12'))
+PARKED_RETRY_AFTER_SECONDS = 5
+
+_cond = threading.Condition()
+_parked = threading.BoundedSemaphore(PARKED_MAX)
+_generations = {topic: 0 for topic in TOPICS}
+_listener_started = False
+_listener_lock = threading.Lock()
+
+def _fire(topic):
+    with _cond:
+        _generations[topic] += 1
+        _cond.notify_all()
+
+def generation(topic):
+    """
+    Snapshot to pass to wait_for(); take it *before* checking the database
+    so a change that lands in between is never missed.
+    """
+    _ensure_listener()
+    return _generations[topic]
+
+def wait_for(topic, seen, timeout):
+    """
+    Blocks until `topic` was announced since `seen`, or timeout. Returns True if woken.
+    """
+    with _cond:
+        return _cond.wait_for(lambda: _generations[topic] != seen, timeout)
+
+def try_park():
+    """
+    Takes one of this process's parking places without blocking. Returns
+    False when all PARKED_MAX are taken; on True, call unpark() when done.
+    """
+    return _parked.acquire(blocking=False)
+
+def unpark():
+    _parked.release()
+
+def announce(topic):
+    """
+    Call inside the transaction that makes the change; waiters are woken
+    only once that transaction commits.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        # Delivered by Postgres at COMMIT, discarded on ROLLBACK
+        db.session.execute(text("SELECT pg_notify(:channel, '')"), {"channel": topic})
+    else:
+        db.session.info.setdefault('announce', set()).add(topic)
+
+def work_generation():
+    return generation(WORK)
+
+def wait_for_work(seen, timeout):
+    return wait_for(WORK, seen, timeout)
+
+def announce_work():
+    announce(WORK)
+
+@event.listens_for(Session, 'after_commit')
+def _fire_after_commit(session):
+    for topic in session.info.pop('announce', ()):
+        _fire(topic)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('announce', None)
+
+def _ensure_listener():
+    global _listener_started
+    if _listener_started or db.engine.dialect.name != 'postgresql':
+        return
+    with _listener_lock:
+        if _listener_started:
+            return
+        dsn = db.engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+        thread = threading.Thread(target=_listen_forever, args=(dsn,))
+        thread.daemon = True
+        thread.start()
+        _listener_started = True
+
+def _listen_forever(dsn):
+    import psycopg2
+    from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+    while True:
+        conn = None
+        try:
+            # Dedicated connection: a LISTEN must not sit in the SQLAlchemy pool
+            conn = psycopg2.connect(dsn, sslmode=os.environ.get('DATABASE_SSLMODE', 'require'))
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = conn.cursor()
+            for topic in TOPICS:
+                cursor.execute(f"LISTEN {topic}")
+            print(f"📡 Listening for {', '.join(TOPICS)}")
+
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                for topic in {n.channel for n in conn.notifies}:
+                    if topic in _generations:
+                        _fire(topic)
+                conn.notifies.clear()
+        except Exception as e:
+            print(f"📡 Listener error, reconnecting: {e}")
+            # Parked requests re-check the database rather than sleeping through an outage
+            for topic in TOPICS:
+                _fire(topic)
+            time.sleep(5)
+        finally:
+            if conn is not None:
+                conn.close()
@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, insert, and_, or_, text
+from .models import db, Provider, Task, GpuSlot, TaskEvent
+from .lease_service import attempts_left, retry_after
+from .notify_service import announce, WORK, TASK_EVENTS
+from .event_service import is_streamed
+from .heartbeat_service import flush as flush_heartbeats
+from .speculation_service import launch_copies, expire_pins, settle, live_copy_originals
+from .dependency_service import fail_dependents, resolve
+from .log_service import compact_finished_logs
+
+# One background sweep per process, but only one process does the work per
+# tick: on Postgres the sweep runs inside a transaction that must first win
+# a pg_try_advisory_xact_lock, so the other gunicorn workers skip that tick.
+# Every step is a set-based UPDATE/DELETE; only the speculative-execution
+# steps load task rows, and only the few copies involved. Log compaction
+# reads chunk rows, for a bounded batch of finished tasks per tick.
+
+REAPER_LOCK_ID = 715_010
+INTERVAL_SECONDS = float(os.getenv('REAPER_INTERVAL_SECONDS', '60'))  # 0 disables
+PROVIDER_DEAD_AFTER = timedelta(seconds=int(os.getenv('PROVIDER_DEAD_AFTER_SECONDS', '120')))
+EVENT_RETENTION = timedelta(days=7)
+
+_started = False
+
+def start_reaper(app):
+    global _started
+    if _started or INTERVAL_SECONDS <= 0:
+        return
+    _started = True
+
+    def _run():
+        while True:
+            time.sleep(INTERVAL_SECONDS)
+            with app.app_context():
+                try:
+                    run_once()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"🧹 Reaper error: {e}")
+
+    thread = threading.Thread(target=_run)
+    thread.daemon = True
+    thread.start()
+
+def _acquire_leadership():
+    if db.engine.dialect.name != 'postgresql':
+        return True  # SQLite: single writer anyway, and every step is idempotent
+    return db.session.execute(
+        text('SELECT pg_try_advisory_xact_lock(:k)'), {'k': REAPER_LOCK_ID}
+    ).scalar()
+
+def run_once():
+    """
+    One sweep. Returns a dict of counts, or None if another worker holds the lock.
+    """
+    # Our own buffered pings must be on disk before we judge liveness
+    flush_heartbeats()
+
+    if not _acquire_leadership():
+        db.session.rollback()
+        return None
+
+    now = datetime.utcnow()
+    cutoff = now - PROVIDER_DEAD_AFTER
+
+    # 1. Providers whose heartbeat lapsed go offline
+    offline = db.session.execute(
+        update(Provider)
+        .where(Provider.status == 'active', Provider.last_seen < cutoff)
+        .values(status='offline')
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    # 2. RUNNING tasks whose lease ran out, or whose provider is dead (or
+    #    vanished), go back to the queue after a backoff; once they are out
+    #    of attempts they fail for good, unless a speculative copy of theirs
+    #    is still live and can finish them (handed over: no lease from then on)
+    live_providers = select(Provider.id).where(Provider.last_seen >= cutoff)
+    lost = and_(Task.status == 'RUNNING', Task.lease_id.is_not(None),
+                or_(Task.lease_expires_at < now, Task.provider_id.is_(None),
+                    Task.provider_id.not_in(live_providers)))
+    requeued = db.session.execute(
+        update(Task)
+        .where(lost, attempts_left())
+        .values(status='QUEUED', provider_id=None, gpu_assigned=None, start_time=None,
+                lease_id=None, lease_expires_at=None, not_before=retry_after(now), last_update=now)
+        .returning(Task.id, Task.user_id, Task.speculative_of, Task.job_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    handed_over = db.session.execute(
+        update(Task)
+        .where(lost, Task.id.in_(live_copy_originals()))
+        .values(lease_id=None, lease_expires_at=None, last_update=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    failed = db.session.execute(
+        update(Task)
+        .where(lost)
+        .values(status='FAILED', error_message="Task lost: its provider stopped renewing the lease and no attempts are left.",
+                lease_expires_at=None, end_time=now, last_update=now)
+        .returning(Task.id, Task.user_id, Task.speculative_of, Task.job_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    events = [{"task_id": row.id, "user_id": row.user_id, "status": status, "created_at": now}
+              for rows, status in [(requeued, 'QUEUED'), (failed, 'FAILED')] for row in rows if is_streamed(row)]
+    if events:
+        db.session.execute(insert(TaskEvent), events)
+        announce(TASK_EVENTS)
+    # A lost copy may have been the last hope of a handed-over original
+    ended = [settle(db.session.get(Task, row.id, populate_existing=True)) for row in failed if row.speculative_of]
+
+    # 3. Copies their pinned provider never claimed are dropped
+    expired, ended_unclaimed = expire_pins(now)
+    ended = [original for original in ended + ended_unclaimed if original]
+
+    # Whatever was waiting on a task that just failed for good can't run either
+    if failed:
+        fail_dependents([row.id for row in failed], now)
+    for original in ended:
+        resolve(original)
+
+    # 4. Busy slots whose task is no longer RUNNING under a lease (reaped or
+    #    handed over above, or lost some other way) go back to idle
+    running = select(Task.id).where(Task.status == 'RUNNING', Task.lease_id.is_not(None))
+    freed = db.session.execute(
+        update(GpuSlot)
+        .where(GpuSlot.status == 'busy',
+               or_(GpuSlot.task_id.is_(None), GpuSlot.task_id.not_in(running)))
+        .values(status='idle', task_id=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    # 5. Stragglers at the tail of a batch get a copy on a faster idle provider
+    #    (loads rows too, but only opted-in RUNNING tasks)
+    copies = launch_copies(now)
+
+    if freed or requeued or copies:
+        announce(WORK)
+
+    # 6. The SSE event log only needs to cover reconnect windows
+    pruned = db.session.execute(
+        delete(TaskEvent).where(TaskEvent.created_at < now - EVENT_RETENTION)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    # 7. Finished tasks' streamed log chunks fold into one object, a bounded
+    #    batch per sweep (reads every chunk, and may upload to R2)
+    compacted = compact_finished_logs()
+
+    # Commit also releases the advisory lock
+    db.session.commit()
+
+    counts = {"providers_offline": offline, "tasks_requeued": len(requeued), "tasks_failed": len(failed),
+              "tasks_handed_over": handed_over, "slots_freed": freed, "speculative_copies": copies,
+              "copies_expired": expired, "events_pruned": pruned, "logs_compacted": compacted}
+    if offline or requeued or failed or handed_over or freed or copies or expired or compacted:
+        print(f"🧹 Reaper: {counts}")
+    return counts
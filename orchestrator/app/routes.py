@@ -1,29 +1,44 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from datetime import datetime, timedelta
 import jsonpickle
 import uuid
 import json
 import os
 import secrets
-import boto3
-from botocore.config import Config
+import time
 from functools import wraps
-from .models import db, Provider, Task, User, EnrollmentToken
-from .ledger_service import record_on_chain
+from sqlalchemy import and_, or_, true
+from .storage_service import (s3_client, presign_get, presign_put, object_exists, forget_object,
+                              multipart_part_size, create_multipart_upload, presign_upload_part,
+                              list_uploaded_parts, complete_multipart_upload, abort_multipart_upload,
+                              MULTIPART_MAX_PARTS, public_url, is_digest, project_blob_key, sha256_fileobj,
+                              staging_blob_key, staged_digest, object_sha256, delete_object, move_object)
+from .models import db, Provider, Task, User, EnrollmentToken, GpuSlot, Job
+from .ledger_service import record_on_chain, task_proofs
+from .scheduler_service import (claim_matching_tasks, explain_unscheduled, parse_requirements, parse_priority,
+                                queue_wait_stats, slot_gpus, InvalidRequirements)
+from .slot_service import sync_provider_slots, idle_slots, occupy_slot, release_task_slot, provider_capacity
+from .notify_service import (announce_work, work_generation, wait_for_work, generation, wait_for, TASK_EVENTS,
+                             try_park, unpark, PARKED_RETRY_AFTER_SECONDS)
+from .lease_service import holds_lease, artifact_key, LEASE_SECONDS
+from .speculation_service import settle as settle_speculation, hand_over
+from .sweep_service import (expand_sweep, shard_overrides, parse_reduce, create_sweep, add_reduce_task,
+                            job_progress, describe_job, InvalidSweep)
+from .dependency_service import (resolve as resolve_dependencies, input_artifacts, lock_parents, block_on,
+                                 parents_of, InvalidDependencies, JOB_MAX_PARENTS)
+from .heartbeat_service import record_heartbeat, buffered_last_seen, is_known, mark_known
+from .event_service import record_status_change, latest_cursor, events_since, EVENT_SETTLE_SECONDS
+from .log_service import (append_chunk, read_range, log_size, ChunkRejected,
+                          store_log, offloaded_ref, LOG_STREAMS, OFFLOADABLE_FIELDS,
+                          TERMINAL_STATUSES, MAX_READ_CHARS)
 
 bp = Blueprint('api', __name__, url_prefix='/')
-LAST_CLEANUP_TIME = datetime.utcnow()
-
-# Initialize the R2 client
-# Use 'auto' for region_name as R2 doesn't use standard AWS regions
-s3_client = boto3.client(
-    's3',
-    endpoint_url=os.getenv('R2_ENDPOINT_URL'),
-    aws_access_key_id=os.getenv('R2_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('R2_SECRET_ACCESS_KEY'),
-    config=Config(signature_version='s3v4'),
-    region_name='auto'
-)
+LONG_POLL_MAX_SECONDS = 25  # Stay under proxy/tunnel idle timeouts
+SSE_MAX_SECONDS = 300       # Recycle task streams every 5 minutes
+SSE_KEEPALIVE_SECONDS = 15
+MAX_BATCH_CLAIM = 16        # Tasks one /provider/get_task may hand out
+CLAIM_RACE_RETRIES = 3      # Fresh looks at the idle slots after losing one to a concurrent poll
+AGENT_STATUSES = ('RUNNING',) + TERMINAL_STATUSES  # What /provider/task_update accepts
 
 # --- Security Decorator ---
 def require_api_key(f):
@@ -96,18 +111,16 @@ def download_results(task_id):
     if not task or task.status != 'COMPLETED':
         return jsonify({"error": "Results not ready or task not found"}), 404
 
-    # Ensure this matches the upload path used by the agent!
-    object_key = f"artifacts/{task_id}.zip"
+    # A speculative copy that finished first holds the results
+    source = Task.query.get(task.winner_task_id) if task.winner_task_id else task
+    # Each attempt uploads to its own key; the completed one is the current attempt
+    object_key = artifact_key(source.id, source.attempts)
 
     try:
-        url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={
-                'Bucket': os.getenv('R2_BUCKET_NAME'),
-                'Key': object_key
-            },
-            ExpiresIn=3600 # 1-hour
-        )
+        # Cached HEAD: a COMPLETED task whose agent never uploaded gets a clear answer
+        if not object_exists(object_key):
+            return jsonify({"error": "Results not uploaded yet"}), 404
+        url = presign_get(object_key) # 1-hour, reused until close to expiry
         return jsonify({"download_url": url}), 200
     except Exception as e:
         print(f"R2 Error: {e}")
@@ -134,8 +147,10 @@ def get_my_devices():
             # If the device hasn't checked in recently, it's 'offline' 
             # regardless of what the status column says.
             is_active = False
-            if d.last_seen:
-                seconds_since_seen = (now - d.last_seen).total_seconds()
+            # Pings not flushed to the database yet still count
+            last_seen = buffered_last_seen(d.id, d.last_seen)
+            if last_seen:
+                seconds_since_seen = (now - last_seen).total_seconds()
                 is_active = seconds_since_seen < OFFLINE_THRESHOLD
 
             current_status = 'active' if is_active else 'offline'
@@ -144,7 +159,7 @@ def get_my_devices():
                 "id": d.id,
                 "name": d.name,
                 "status": current_status, # Overriding with our dynamic check
-                "last_seen": d.last_seen.isoformat() if d.last_seen else None,
+                "last_seen": last_seen.isoformat() if last_seen else None,
                 "telemetry": d.last_telemetry 
             })
         
@@ -156,6 +171,8 @@ def get_my_devices():
 
 @bp.route('/consumer/upload_project', methods=['POST'])
 def upload_project():
+    # Legacy proxy upload, kept for small scripts and older clients.
+    # The web UI uploads through /consumer/uploads/* straight to R2.
     try:
         file = request.files.get('file')
         clerk_id = request.form.get('clerk_id')
@@ -163,26 +180,190 @@ def upload_project():
         if not file or not clerk_id:
             return jsonify({"error": "Missing file or user ID"}), 400
 
-        file_name = f"{clerk_id}/{file.filename}"
-        bucket = os.getenv('R2_BUCKET_NAME')
-        
-        # Upload to R2
-        s3_client.upload_fileobj(
-            file,
-            bucket,
-            file_name,
-            ExtraArgs={'ContentType': file.content_type}
-        )
+        # Content-addressed: identical ZIPs share one object, and a re-upload is skipped
+        digest = sha256_fileobj(file.stream)
+        file_name = project_blob_key(clerk_id, digest)
 
-        # Generate the public URL
-        public_url = f"{os.getenv('R2_PUBLIC_DOMAIN')}/{file_name}"
-        
-        return jsonify({"project_url": public_url}), 200
+        if not object_exists(file_name):
+            # Upload to R2
+            s3_client.upload_fileobj(
+                file,
+                os.getenv('R2_BUCKET_NAME'),
+                file_name,
+                ExtraArgs={'ContentType': file.content_type}
+            )
+            forget_object(file_name)
+
+        return jsonify({"project_url": public_url(file_name), "project_digest": digest}), 200
 
     except Exception as e:
         print(f"R2 Upload Error: {str(e)}")
         return jsonify({"error": "Storage configuration error on server"}), 500
 
+@bp.route('/consumer/blobs/check', methods=['POST'])
+@require_api_key
+def check_project_blob():
+    """
+    Called with the ZIP's sha256 before uploading: if we already have it,
+    the client skips the upload and submits with the digest.
+    """
+    data = request.json or {}
+    clerk_id, digest = data.get('clerk_id'), data.get('digest')
+    if not clerk_id or not is_digest(digest):
+        return jsonify({"error": "clerk_id and a lowercase hex sha256 digest are required"}), 400
+
+    key = project_blob_key(clerk_id, digest)
+    try:
+        exists = object_exists(key)
+    except Exception as e:
+        print(f"R2 HEAD Error: {e}")
+        return jsonify({"error": "Storage configuration error on server"}), 500
+    return jsonify({
+        "exists": exists,
+        "project_digest": digest,
+        "project_url": public_url(key) if exists else None
+    }), 200
+
+# --- Direct-to-R2 Multipart Uploads ---
+# The browser asks us to start an upload and sign part URLs, PUTs the parts to
+# R2 itself (in parallel), then asks us to complete. We never see the bytes.
+
+MAX_SIGN_BATCH = 100
+
+def _upload_target(data):
+    """
+    (key, upload_id) from a request body, or None if the key isn't the caller's.
+    """
+    clerk_id, key, upload_id = data.get('clerk_id'), data.get('key'), data.get('upload_id')
+    if not clerk_id or not key or not upload_id or not key.startswith(f"{clerk_id}/"):
+        return None
+    return key, upload_id
+
+@bp.route('/consumer/uploads/initiate', methods=['POST'])
+@require_api_key
+def initiate_upload():
+    data = request.json or {}
+    clerk_id = data.get('clerk_id')
+    filename = os.path.basename(data.get('filename') or '')
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        size = 0
+
+    if not clerk_id or not filename or size <= 0:
+        return jsonify({"error": "clerk_id, filename and size are required"}), 400
+
+    digest = data.get('digest')
+    if digest is not None and not is_digest(digest):
+        return jsonify({"error": "digest must be a lowercase hex sha256"}), 400
+
+    # A hashed file is staged and only moved to its content address once
+    # /complete has checked the bytes; otherwise a fresh prefix per upload,
+    # so two uploads of project.zip never collide
+    key = staging_blob_key(clerk_id, digest) if digest else f"{clerk_id}/{uuid.uuid4()}/{filename}"
+    part_size = multipart_part_size(size)
+    try:
+        upload_id = create_multipart_upload(key, data.get('content_type') or 'application/zip')
+    except Exception as e:
+        print(f"R2 Multipart Init Error: {e}")
+        return jsonify({"error": "Storage configuration error on server"}), 500
+
+    return jsonify({
+        "key": key,
+        "upload_id": upload_id,
+        "part_size": part_size,
+        "part_count": -(-size // part_size)
+    }), 200
+
+@bp.route('/consumer/uploads/sign_parts', methods=['POST'])
+@require_api_key
+def sign_upload_parts():
+    data = request.json or {}
+    target = _upload_target(data)
+    if not target:
+        return jsonify({"error": "Missing or foreign upload"}), 400
+
+    part_numbers = data.get('part_numbers') or []
+    if (not isinstance(part_numbers, list) or len(part_numbers) > MAX_SIGN_BATCH
+            or not all(isinstance(n, int) and 1 <= n <= MULTIPART_MAX_PARTS for n in part_numbers)):
+        return jsonify({"error": f"part_numbers must be 1-{MAX_SIGN_BATCH} ints in 1..{MULTIPART_MAX_PARTS}"}), 400
+
+    key, upload_id = target
+    try:
+        urls = {str(n): presign_upload_part(key, upload_id, n) for n in part_numbers}
+    except Exception as e:
+        print(f"R2 Sign Error: {e}")
+        return jsonify({"error": "Could not sign upload parts"}), 500
+    return jsonify({"urls": urls}), 200
+
+@bp.route('/consumer/uploads/parts', methods=['POST'])
+@require_api_key
+def uploaded_parts():
+    """
+    What R2 already has for an upload, so an interrupted one can resume.
+    """
+    target = _upload_target(request.json or {})
+    if not target:
+        return jsonify({"error": "Missing or foreign upload"}), 400
+    try:
+        return jsonify({"parts": list_uploaded_parts(*target)}), 200
+    except Exception as e:
+        # NoSuchUpload: it was completed, aborted or expired; the client starts over
+        print(f"R2 List Parts Error: {e}")
+        return jsonify({"error": "Upload not found"}), 404
+
+@bp.route('/consumer/uploads/complete', methods=['POST'])
+@require_api_key
+def complete_upload():
+    data = request.json or {}
+    target = _upload_target(data)
+    parts = data.get('parts')
+    if not target or not isinstance(parts, list) or not parts:
+        return jsonify({"error": "Missing upload or parts"}), 400
+
+    key, upload_id = target
+    try:
+        complete_multipart_upload(key, upload_id, [
+            {"PartNumber": int(p['part_number']), "ETag": p['etag']} for p in parts
+        ])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Each part needs part_number and etag"}), 400
+    except Exception as e:
+        print(f"R2 Multipart Complete Error: {e}")
+        return jsonify({"error": "Could not complete upload"}), 500
+
+    digest = staged_digest(key)
+    if not digest:
+        # Same shape as /consumer/upload_project
+        return jsonify({"project_url": public_url(key)}), 200
+
+    # Read the staged bytes back once: a buggy or resumed client must not
+    # get the wrong ZIP stored (and deduplicated) under this digest
+    try:
+        actual = object_sha256(key)
+        if actual != digest:
+            delete_object(key)
+            return jsonify({"error": f"Uploaded bytes hash to {actual}, not {digest}; nothing was stored. "
+                                     "Upload the file again."}), 400
+        blob_key = project_blob_key(data['clerk_id'], digest)
+        move_object(key, blob_key)
+    except Exception as e:
+        print(f"R2 Blob Verify Error: {e}")
+        return jsonify({"error": "Could not verify upload"}), 500
+    return jsonify({"project_url": public_url(blob_key), "project_digest": digest}), 200
+
+@bp.route('/consumer/uploads/abort', methods=['POST'])
+@require_api_key
+def abort_upload():
+    target = _upload_target(request.json or {})
+    if not target:
+        return jsonify({"error": "Missing or foreign upload"}), 400
+    try:
+        abort_multipart_upload(*target)
+    except Exception as e:
+        print(f"R2 Multipart Abort Error: {e}")
+    return jsonify({"message": "Upload aborted."}), 200
+
 # --- Auth Management ---
 
 @bp.route('/auth/sync', methods=['POST'])
@@ -227,11 +408,14 @@ def provider_register():
     if not detected_gpus and "gpu" in specs and specs["gpu"]:
         detected_gpus = [{"id": "gpu-0", "name": specs["gpu"]["name"], "status": "idle"}]
 
+    cpu_cores, ram_mb = provider_capacity(specs)
     provider = Provider.query.get(provider_id)
     
     if provider:
         provider.specs = specs
-        # We store the list as a JSON string for the matching logic
+        provider.cpu_cores = cpu_cores
+        provider.ram_mb = ram_mb
+        # Raw inventory snapshot; per-GPU state lives in gpu_slots
         provider.gpus = jsonpickle.encode(detected_gpus, unpicklable=False)
         provider.user_id = data.get('user_id') # Update user_id just in case
         provider.last_seen = datetime.utcnow()
@@ -242,14 +426,19 @@ def provider_register():
             name=provider_id,
             user_id=data.get('user_id'),
             specs=specs,
+            cpu_cores=cpu_cores,
+            ram_mb=ram_mb,
             gpus=jsonpickle.encode(detected_gpus, unpicklable=False),
             last_seen=datetime.utcnow(),
             status='active'
         )
         db.session.add(provider)
+
+    sync_provider_slots(provider_id, detected_gpus)
     
     try:
         db.session.commit()
+        mark_known(provider_id)
         return jsonify({"message": "Successfully registered"}), 200
     except Exception as e:
         db.session.rollback()
@@ -265,18 +454,32 @@ def agent_task_update():
 
     if not task_id or not status:
         return jsonify({"error": "Missing task_id or status"}), 400
+    if status not in AGENT_STATUSES:
+        return jsonify({"error": f"status must be one of {', '.join(AGENT_STATUSES)}"}), 400
 
     task = Task.query.get(task_id)
     if not task:
         return jsonify({"error": "Task not found."}), 404
 
+    # Only the holder of a RUNNING task's current lease may move it. A QUEUED
+    # task was taken away from its last holder, a finished one stays finished.
+    if not holds_lease(task, data.get('lease_id'), data.get('provider_id')):
+        return jsonify({"error": f"Lease is no longer valid for this task (it is {task.status})."}), 409
+
+    # A straggler that fails while its speculative copy is still live leaves the task to the copy
+    if status == 'FAILED' and hand_over(task):
+        status = task.status
+
     # Update task details
+    status_changed = task.status != status
     task.status = status
     task.last_update = datetime.utcnow()
-    if 'stdout' in details:
-        task.stdout = details['stdout']
-    if 'stderr' in details:
-        task.stderr = details['stderr']
+    if status_changed:
+        record_status_change(task)
+    for stream in LOG_STREAMS:
+        if details.get(stream) is not None:
+            # Small logs stay inline, big ones are offloaded to R2
+            store_log(task, stream, [details[stream]], len(details[stream]))
     # Check if result_url was sent in the 'details' dict
     if 'result_url' in details:
         task.result_url = details['result_url']
@@ -284,36 +487,115 @@ def agent_task_update():
     if status in ['COMPLETED', 'FAILED', 'CANCELLED']:
         task.end_time = datetime.utcnow()
     
+    # If task is finished, free its GPU slot in the same transaction
+    if status in ['COMPLETED', 'FAILED', 'CANCELLED']:
+        if release_task_slot(task_id):
+            announce_work()
+            print(f"Provider {task.provider_id} GPU slot for task {task_id} has been freed.")
+
+    # Speculative pairs: the first to finish settles the other
+    if status in ['COMPLETED', 'FAILED', 'CANCELLED'] and status_changed:
+        original = settle_speculation(task)
+        if original:
+            record_on_chain(original.id, original.status)
+            resolve_dependencies(original)
+        if task.speculative_of is None:
+            # Queue the tasks waiting on this one, or fail them if it didn't complete
+            resolve_dependencies(task)
+
+    # BLOCKCHAIN LOG: Task Status Update (Completed/Failed)
+    # We log the final outcome to the ledger (queued in this transaction)
+    if status in ['COMPLETED', 'FAILED'] and status_changed and task.speculative_of is None:
+        record_on_chain(task_id, status)
+
     try:
         db.session.commit()
-        # BLOCKCHAIN LOG: Task Status Update (Completed/Failed)
-        # We log the final outcome to the ledger
-        if status in ['COMPLETED', 'FAILED']:
-            record_on_chain(task_id, status)
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": f"DB error updating task: {e}"}), 500
 
-    # If task is finished, free the GPU
-    if status in ['COMPLETED', 'FAILED', 'CANCELLED']:
-        if task.provider_id and task.gpu_assigned:
-            provider = Provider.query.get(task.provider_id)
-            gpu_assigned_id = jsonpickle.decode(task.gpu_assigned)['id']
-            if provider:
-                provider_gpus = jsonpickle.decode(provider.gpus)
-                gpu_freed = False
-                for i, gpu in enumerate(provider_gpus):
-                    if gpu['id'] == gpu_assigned_id:
-                        provider_gpus[i]['status'] = 'idle'
-                        gpu_freed = True
-                        break
-                if gpu_freed:
-                    provider.gpus = jsonpickle.encode(provider_gpus, unpicklable=False)
-                    db.session.commit()
-                    print(f"Provider {task.provider_id} GPU {gpu_assigned_id} has been freed.")
-    
+    # The agent uploads its artifact before reporting; don't serve a cached "missing"
+    if status == 'COMPLETED':
+        forget_object(artifact_key(task.id, task.attempts))
+
+    # Streamed chunks are folded into one object by the reaper's next sweep
     return jsonify({"message": "Task status updated."}), 200
 
+@bp.route('/provider/task_log', methods=['POST'])
+def agent_task_log():
+    """
+    Append-only log streaming: {task_id, stream, seq, data}. Chunks are
+    numbered from 0 per stream; re-sending an accepted chunk is a no-op.
+    """
+    data = request.get_json()
+    task_id = data.get('task_id')
+    stream = data.get('stream', 'stdout')
+    seq = data.get('seq')
+    chunk = data.get('data')
+
+    if not task_id or not isinstance(seq, int) or seq < 0 or chunk is None:
+        return jsonify({"error": "Missing task_id, seq or data"}), 400
+
+    task = Task.query.get(task_id)
+    if not task:
+        return jsonify({"error": "Task not found."}), 404
+    # Same rule as task_update: only a RUNNING task's current holder appends
+    if not holds_lease(task, data.get('lease_id'), data.get('provider_id')):
+        return jsonify({"error": f"Lease is no longer valid for this task (it is {task.status})."}), 409
+
+    try:
+        duplicate, next_seq = append_chunk(task, stream, seq, chunk)
+    except ChunkRejected as e:
+        return jsonify({"error": str(e), "expected_seq": e.expected_seq}), 409
+
+    return jsonify({"accepted": not duplicate, "next_seq": next_seq}), 200
+
+@bp.route('/consumer/task_log/<task_id>', methods=['GET'])
+def consumer_task_log(task_id):
+    """
+    Range read of a task's log: ?stream=stdout|stderr&offset=N&limit=N, or
+    ?tail=N for the last N characters. Poll again from next_offset to follow.
+    """
+    task = Task.query.get(task_id)
+    if not task:
+        return jsonify({"error": "Task not found"}), 404
+
+    stream = request.args.get('stream', 'stdout')
+    if stream not in LOG_STREAMS:
+        return jsonify({"error": f"Unknown stream '{stream}'"}), 400
+
+    try:
+        limit = int(request.args.get('limit', MAX_READ_CHARS))
+        size = log_size(task, stream)
+        if request.args.get('tail'):
+            offset = max(size - int(request.args['tail']), 0)
+        else:
+            offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({"error": "Invalid offset, tail or limit"}), 400
+
+    text = read_range(task, stream, offset, limit)
+    if text is None:
+        # Offloaded to R2: hand out the whole (gzip-encoded) object instead of a slice
+        return jsonify({
+            "task_id": task.id,
+            "stream": stream,
+            "size": size,
+            "download_url": presign_get(offloaded_ref(task, stream)['key']),
+            "complete": task.status in TERMINAL_STATUSES
+        }), 200
+
+    next_offset = offset + len(text)
+    return jsonify({
+        "task_id": task.id,
+        "stream": stream,
+        "offset": offset,
+        "next_offset": next_offset,
+        "size": size,
+        "data": text,
+        "complete": task.status in TERMINAL_STATUSES and next_offset >= size
+    }), 200
+
 # --- Consumer Management ---
 @bp.route('/consumer/submit_task', methods=['POST'])
 def consumer_submit_task():
@@ -323,88 +605,432 @@ def consumer_submit_task():
     if not clerk_id:
         return jsonify({"error": "User authentication required"}), 401
 
+    # Tasks can reference a content-addressed project by digest alone
+    project_digest = data.get('project_digest')
+    input_path = data.get('input_path')
+    if project_digest is not None:
+        if not is_digest(project_digest):
+            return jsonify({"error": "project_digest must be a lowercase hex sha256"}), 400
+        input_path = input_path or public_url(project_blob_key(clerk_id, project_digest))
+
+    # What the task needs from a provider (GPU memory/count, CUDA capability, CPU, RAM)
+    raw_requirements = data.get('requirements', data.get('gpu_requirements'))
+    try:
+        requirements = parse_requirements(raw_requirements)
+        priority = parse_priority(data.get('priority'))  # low | normal | high
+    except InvalidRequirements as e:
+        return jsonify({"error": str(e)}), 400
+
+    batch_id = data.get('batch_id')  # Groups a sweep's tasks; stragglers are judged against it
+    if batch_id is not None and (not isinstance(batch_id, str) or not 0 < len(batch_id) <= 64):
+        return jsonify({"error": "batch_id must be a string of at most 64 characters"}), 400
+
+    # How many times a task may be (re)started after losing its provider; default TASK_MAX_ATTEMPTS
+    max_attempts = data.get('max_attempts')
+    if max_attempts is not None and (not isinstance(max_attempts, int) or not 1 <= max_attempts <= 10):
+        return jsonify({"error": "max_attempts must be an integer between 1 and 10"}), 400
+
+    # Columns a single task and every child of a sweep share
+    fields = dict(
+        docker_image=data.get('docker_image', 'ruasnv/matcha-runner:latest'),
+        input_path=input_path, # This is the Presigned R2 URL
+        project_digest=project_digest,
+        script_path=data.get('script_path', 'main.py'),
+        gpu_requirements=json.dumps(raw_requirements) if raw_requirements else None,
+        priority=priority,
+        max_attempts=max_attempts,
+        speculative=bool(data.get('speculative', False)),  # Allow a straggler copy on a faster provider
+        **requirements
+    )
+
+    # Task array: one child per point of a grid (or list) of env_vars overrides, under one job.
+    # Sharded job: one child per SHARD_INDEX, plus an optional reduce over their artifacts.
+    if data.get('sweep') is not None or data.get('shards') is not None:
+        name = data.get('name')
+        if name is not None and (not isinstance(name, str) or len(name) > 255):
+            return jsonify({"error": "name must be a string of at most 255 characters"}), 400
+        try:
+            if data.get('shards') is not None:
+                kind, overrides = 'shard', shard_overrides(data['shards'])
+                reduce = parse_reduce(data['reduce'], fields) if data.get('reduce') is not None else None
+            else:
+                if data.get('reduce') is not None:
+                    raise InvalidSweep("reduce needs shards")
+                kind, overrides, reduce = 'sweep', expand_sweep(data['sweep']), None
+            # Every task of the job waits for all of depends_on
+            parents = lock_parents(clerk_id, data.get('depends_on') or [], JOB_MAX_PARENTS)
+        except (InvalidSweep, InvalidRequirements, InvalidDependencies) as e:
+            return jsonify({"error": str(e)}), 400
+
+        base_env = data.get('env_vars') or {}
+        job, task_ids = create_sweep(clerk_id, overrides, base_env, fields, name, kind, parents)
+        response = {"job_id": job.id}
+        if reduce:
+            reduce_env, reduce_fields = reduce
+            response["reduce_task_id"] = add_reduce_task(job, task_ids, {**base_env, **reduce_env}, reduce_fields).id
+        announce_work()
+        record_on_chain(job.id, f"QUEUED {kind} job of {job.task_count}")
+        db.session.commit()
+        response.update(task_count=job.task_count, message=f"Job of {job.task_count} tasks submitted.")
+        return jsonify(response), 200
+
+    # Workflow step: BLOCKED until every task in depends_on has completed, then gets their artifacts
+    try:
+        parent_ids, pending = lock_parents(clerk_id, data.get('depends_on') or [])
+    except InvalidDependencies as e:
+        return jsonify({"error": str(e)}), 400
+
     task_id = str(uuid.uuid4())
     new_task = Task(
         id=task_id,
         user_id=clerk_id, # Link task to the authenticated user
-        docker_image=data.get('docker_image', 'ruasnv/matcha-runner:latest'),
-        status='QUEUED',
+        status='BLOCKED' if pending else 'QUEUED',
+        pending_parents=pending,
         submission_time=datetime.utcnow(),
-        input_path=data.get('input_path'), # This is the Presigned R2 URL
-        script_path=data.get('script_path', 'main.py'),
-        env_vars=json.dumps(data.get('env_vars', {})) 
+        env_vars=json.dumps(data.get('env_vars', {})),
+        batch_id=batch_id,
+        **fields
     )
     
     db.session.add(new_task)
+    if parent_ids:
+        db.session.flush()
+        block_on([task_id], parent_ids)
+    record_status_change(new_task)
+    if not pending:
+        announce_work()  # Wakes long-polling agents once this commits
+    record_on_chain(task_id, new_task.status)
     db.session.commit()
-    record_on_chain(task_id, "QUEUED")
-    return jsonify({"task_id": task_id, "message": "Task submitted."}), 200
+    return jsonify({"task_id": task_id, "status": new_task.status, "message": "Task submitted."}), 200
+
+def _offloaded_log(field, ref):
+    """
+    What an offloaded log reads as in the API: no inline text, a short-lived
+    download link and the original size.
+    """
+    return {field: None, f'{field}_url': presign_get(ref['key']), f'{field}_size': ref['size']}
 
 @bp.route('/consumer/task_status/<task_id>', methods=['GET'])
 def consumer_task_status(task_id):
     task = Task.query.get(task_id)
     if task:
-        return jsonify({
+        result = {
             'id': task.id, 
             'user_id': task.user_id,
             'status': task.status,
             'docker_image': task.docker_image,
             'submission_time': task.submission_time,
-            'stdout': task.stdout,
-            'stderr': task.stderr,
-            'error_message': task.error_message,
             'provider_id': task.provider_id
-        }), 200
+        }
+        # Offloaded logs come back as a short-lived download link instead of inline text
+        for field in OFFLOADABLE_FIELDS:
+            ref = offloaded_ref(task, field)
+            if ref:
+                result.update(_offloaded_log(field, ref))
+            else:
+                result[field] = getattr(task, field)
+        if task.job_id:
+            result['job_id'] = task.job_id
+        parent_ids = parents_of(task.id)
+        if parent_ids:
+            result['depends_on'] = parent_ids
+        if task.status == 'BLOCKED':
+            result['pending_parents'] = task.pending_parents  # Tasks it still waits for
+        if task.winner_task_id:
+            result['speculative_winner'] = task.winner_task_id  # Its logs hold the winning run
+        # Merkle inclusion proofs (LEDGER_MODE=anchor); check with scripts/verify_proof.py
+        result['ledger_proofs'] = task_proofs(task.id)
+        if task.status == 'QUEUED':
+            # Why nobody has picked it up: no capable hardware, all busy, or just queued behind others
+            result['scheduling'] = explain_unscheduled(task)
+        return jsonify(result), 200
     return jsonify({"error": "Task not found"}), 404
 
+@bp.route('/consumer/queue_stats', methods=['GET'])
+def queue_stats():
+    """
+    Per-user queue wait percentiles over the last ?hours= (default 24), to
+    check that fair share holds up under load.
+    """
+    try:
+        hours = min(max(float(request.args.get('hours', 24)), 0), 24 * 30)
+    except ValueError:
+        return jsonify({"error": "Invalid hours"}), 400
+    since = datetime.utcnow() - timedelta(hours=hours)
+    return jsonify({"window_hours": hours, "users": queue_wait_stats(since)}), 200
+
+# --- Task listings ---
+# Columns a listing may project with ?fields=. Heavy text columns are only
+# returned when asked for explicitly; the defaults never include them.
+LISTABLE_FIELDS = [
+    'id', 'user_id', 'provider_id', 'status', 'docker_image', 'script_path', 'env_vars', 'result_url',
+    'submission_time', 'start_time', 'end_time', 'last_update', 'error_message', 'stdout', 'stderr'
+]
+USER_LIST_FIELDS = ['id', 'status', 'result_url', 'submission_time']
+JOB_TASK_FIELDS = ['id', 'status', 'env_vars', 'result_url']
+DEBUG_LIST_FIELDS = ['id', 'status', 'submission_time', 'provider_id']
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+def _encode_page_cursor(ts, task_id):
+    return f"{ts.isoformat()}|{task_id}"
+
+def _decode_page_cursor(raw):
+    ts, task_id = raw.split('|', 1)
+    return datetime.fromisoformat(ts), task_id
+
+def _task_page(criterion, default_fields):
+    """
+    Keyset-paginated, column-projected task listing driven by request args:
+      ?limit=   page size (default 100, max 500)
+      ?cursor=  X-Next-Cursor from the previous page
+      ?since=   ISO timestamp: only tasks whose last_update is after it (oldest change first)
+      ?fields=  comma-separated subset of LISTABLE_FIELDS
+    Returns (response, status_code); more pages are signalled with X-Next-Cursor.
+    """
+    args = request.args
+    fields = [f for f in args.get('fields', '').split(',') if f] or default_fields
+    unknown = [f for f in fields if f not in LISTABLE_FIELDS]
+    if unknown:
+        return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+    if 'id' not in fields:
+        fields = ['id'] + fields
+
+    try:
+        limit = min(max(int(args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        since = datetime.fromisoformat(args['since']) if args.get('since') else None
+        cursor = _decode_page_cursor(args['cursor']) if args.get('cursor') else None
+    except ValueError:
+        return jsonify({"error": "Invalid limit, since or cursor"}), 400
+
+    # Delta mode walks last_update forward; listing mode walks submission_time backward
+    if since:
+        key = Task.last_update
+        query = Task.query.filter(criterion, Task.last_update > since)
+        if cursor:
+            query = query.filter(or_(key > cursor[0], and_(key == cursor[0], Task.id > cursor[1])))
+        query = query.order_by(key.asc(), Task.id.asc())
+    else:
+        key = Task.submission_time
+        query = Task.query.filter(criterion)
+        if cursor:
+            query = query.filter(or_(key < cursor[0], and_(key == cursor[0], Task.id < cursor[1])))
+        query = query.order_by(key.desc(), Task.id.desc())
+
+    # Only the projected columns (plus the sort key) ever leave the database;
+    # log_refs too when a log is asked for, so offloaded ones get their link
+    columns = [getattr(Task, f) for f in fields]
+    offloadable = [f for f in fields if f in OFFLOADABLE_FIELDS]
+    if offloadable:
+        columns.append(Task.log_refs)
+    rows = query.with_entities(*columns, key.label('_page_key')).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    def _value(v):
+        return v.isoformat() if isinstance(v, datetime) else v
+
+    def _item(row):
+        item = {f: _value(getattr(row, f)) for f in fields}
+        for f in offloadable:
+            ref = (row.log_refs or {}).get(f)
+            if ref:
+                item.update(_offloaded_log(f, ref))
+        return item
+
+    response = jsonify([_item(row) for row in rows])
+    if has_more:
+        response.headers['X-Next-Cursor'] = _encode_page_cursor(rows[-1]._page_key, rows[-1].id)
+    response.headers['X-Server-Time'] = datetime.utcnow().isoformat()
+    return response, 200
+
 @bp.route('/consumer/tasks', methods=['GET'])
 def get_user_tasks():
-    global LAST_CLEANUP_TIME
     clerk_id = request.args.get('clerk_id')
     
     if not clerk_id:
         return jsonify({"error": "Unauthorized"}), 401
 
-    # 1. Only run if it's been more than 5 minutes
-    now = datetime.utcnow()
-    if (now - LAST_CLEANUP_TIME).total_seconds() > 300: # 300 seconds = 5 minutes
-        stale_limit = now - timedelta(minutes=10)
-        
-        # Only cleanup tasks that are stuck in 'RUNNING'
-        stuck_tasks = Task.query.filter(
-            Task.status == 'RUNNING',
-            Task.last_update < stale_limit
-        ).all()
-
-        for task in stuck_tasks:
-            task.status = 'FAILED'
-            task.error_message = "Task timed out: Provider heartbeat lost."
-            # If the task had a provider, we should ideally free that GPU too
-        
-        if stuck_tasks:
-            try:
-                db.session.commit()
-                print(f"🧹 Cleaned up {len(stuck_tasks)} stuck tasks.")
-            except Exception as e:
-                db.session.rollback()
-                print(f"Cleanup error: {e}")
-        
-        LAST_CLEANUP_TIME = now # Reset the timer
+    # Stale RUNNING tasks are cleaned up by the background reaper (reaper_service)
+    # Get one page of the user's tasks
+    # Read the event cursor first: anything that changes after it will be on the stream
+    event_cursor = latest_cursor(clerk_id)
+    # Speculative copies are internal and never listed; job children are listed under their job
+    response, code = _task_page(and_(Task.user_id == clerk_id, Task.speculative_of.is_(None), Task.job_id.is_(None)),
+                                USER_LIST_FIELDS)
+    # Hand this to /consumer/tasks/stream so it resumes exactly after this snapshot
+    response.headers['X-Task-Event-Cursor'] = str(event_cursor)
+    return response, code
 
-    # 2. Get the user's tasks
-    user_tasks = Task.query.filter_by(user_id=clerk_id).order_by(Task.submission_time.desc()).all()
-    
-    return jsonify([{
-        "id": t.id,
-        "status": t.status,
-        "stdout": t.stdout,
-        "result_url": t.result_url,
-        "submission_time": t.submission_time.isoformat() if t.submission_time else None
-    } for t in user_tasks]), 200
+@bp.route('/consumer/jobs', methods=['GET'])
+def get_user_jobs():
+    """
+    The user's most recent jobs (?limit=, default 100) with per-status counts.
+    """
+    clerk_id = request.args.get('clerk_id')
+    if not clerk_id:
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    jobs = Job.query.filter(Job.user_id == clerk_id).order_by(Job.created_at.desc()).limit(limit).all()
+    progress = job_progress([job.id for job in jobs])
+    return jsonify([describe_job(job, progress[job.id]) for job in jobs]), 200
+
+def _user_job(job_id):
+    job = db.session.get(Job, job_id)
+    if not job or job.user_id != request.args.get('clerk_id'):
+        return None
+    return job
+
+@bp.route('/consumer/jobs/<job_id>', methods=['GET'])
+def get_user_job(job_id):
+    job = _user_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(describe_job(job, job_progress([job.id])[job.id])), 200
+
+@bp.route('/consumer/jobs/<job_id>/tasks', methods=['GET'])
+def get_user_job_tasks(job_id):
+    """
+    One page of a job's tasks; same paging and ?fields= as /consumer/tasks.
+    """
+    job = _user_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return _task_page(Task.job_id == job.id, JOB_TASK_FIELDS)
+
+def _parking_full(**body):
+    """
+    503 for a stream/long-poll when this worker's parked requests are at
+    PARKED_CONNECTIONS_MAX; clients come back after Retry-After.
+    """
+    return jsonify({"error": "Too many open streams on this server, retry shortly", **body}), 503, {
+        'Retry-After': str(PARKED_RETRY_AFTER_SECONDS)
+    }
+
+@bp.route('/consumer/tasks/stream', methods=['GET'])
+def stream_user_tasks():
+    """
+    Server-Sent Events: pushes a user's task status transitions as they commit.
+    Resumes from Last-Event-ID (browser reconnects) or ?cursor= (first connect).
+    """
+    clerk_id = request.args.get('clerk_id')
+    if not clerk_id:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    raw_cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor')
+    try:
+        cursor = int(raw_cursor) if raw_cursor else latest_cursor(clerk_id)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    db.session.commit()
+
+    # Held for the stream's whole life, released when the server closes it
+    if not try_park():
+        return _parking_full()
+
+    def generate():
+        nonlocal cursor
+        # Streams are recycled so a thread is never pinned forever; EventSource
+        # reconnects on its own and resumes from Last-Event-ID.
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        sent = {}  # Event id -> when it went out, for the settle window
+        yield "retry: 2000\n\n"
+        while time.monotonic() < deadline:
+            seen = generation(TASK_EVENTS)
+            events = events_since(clerk_id, cursor, sent=sent)
+            db.session.commit()  # Don't hold a pooled connection while parked
+
+            now = time.monotonic()
+            sent = {event_id: at for event_id, at in sent.items() if now - at < EVENT_SETTLE_SECONDS * 2}
+            for e in events:
+                # Late events arrive below the cursor; Last-Event-ID stays at the
+                # highest id, and clients drop repeats by seq after a reconnect
+                cursor = max(cursor, e.id)
+                sent[e.id] = now
+                payload = json.dumps({
+                    "id": e.task_id,
+                    "status": e.status,
+                    "seq": e.id,
+                    "at": e.created_at.isoformat() if e.created_at else None
+                })
+                yield f"id: {cursor}\nevent: status\ndata: {payload}\n\n"
+
+            if not events and not wait_for(TASK_EVENTS, seen, SSE_KEEPALIVE_SECONDS):
+                yield ": keepalive\n\n"
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Don't let proxies buffer the stream
+    })
+    response.call_on_close(unpark)
+    return response
 
 
 
 # --- PROVIDERS ---
+def _claim_for_provider(provider, max_tasks=1):
+    """
+    One claim attempt: take up to max_tasks of the oldest queued tasks this
+    provider's idle GPU slots can run, one set of slots each, and occupy the
+    slots, looking again if a concurrent poll took a slot first. Returns
+    (claims, message) with claims = [(task, gpus)]; empty on a miss.
+    """
+    provider_id = provider.id
+
+    for _ in range(CLAIM_RACE_RETRIES):
+        # Idle GPU slots (indexed lookup, no blob decoding)
+        slots = idle_slots(provider_id)
+        if not slots and provider.gpus and not GpuSlot.query.filter_by(provider_id=provider_id).first():
+            # Provider registered before gpu_slots existed: seed slots from its blob once
+            sync_provider_slots(provider_id, jsonpickle.decode(provider.gpus))
+            db.session.flush()
+            slots = idle_slots(provider_id)
+
+        if not slots:
+            return [], "No idle GPUs."
+
+        # Atomically claim the oldest tasks we can run (no two providers can get the same one)
+        claims = claim_matching_tasks(provider, slots, max_tasks)
+
+        if not claims:
+            return [], "No queued tasks fit this provider."
+
+        # Mark the slots busy. A concurrent poll of this same provider may have
+        # taken one since we read them: release every claim and look again.
+        if all(occupy_slot(slot.id, task.id) for task, chosen in claims for slot in chosen):
+            for task, _ in claims:
+                record_status_change(task)
+            return [(task, slot_gpus(chosen)) for task, chosen in claims], None
+        db.session.rollback()
+
+    return [], "No idle GPUs."
+
+def _assignment(task, gpus, upload_url, inputs=None):
+    env_vars = json.loads(task.env_vars) if task.env_vars else {}
+    if inputs:
+        # Parents' artifacts, in order; the runner downloads them into inputs/
+        env_vars['INPUT_ARTIFACTS'] = ' '.join(inputs)
+    return {
+        "task_id": task.id,
+        "docker_image": task.docker_image,
+        "gpu_id": gpus[0]['id'],
+        "gpu_ids": [g['id'] for g in gpus], # More than one if the task asked for gpu_count > 1
+        "input_path": task.input_path,
+        "project_digest": task.project_digest, # Agents cache downloads by this
+        "upload_url": upload_url,
+        "script_path": task.script_path,
+        "env_vars": env_vars,
+        # Echo lease_id in task_update/task_log and list it in heartbeats to keep the task
+        "lease_id": task.lease_id,
+        "lease_seconds": LEASE_SECONDS,
+        "attempt": task.attempts
+    }
+
 @bp.route('/provider/get_task', methods=['POST'])
 @require_api_key
 def provider_get_task():
@@ -414,79 +1040,77 @@ def provider_get_task():
     if not provider_id:
         return jsonify({"error": "Missing provider_id"}), 400
 
+    # Long-poll: agents may ask us to hold the request open until work shows up
+    try:
+        wait_seconds = min(max(float(data.get('wait', 0) or 0), 0), LONG_POLL_MAX_SECONDS)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid wait value"}), 400
+    deadline = time.monotonic() + wait_seconds
+
+    # Batch claim: a multi-GPU agent can fill every idle GPU in one round trip
+    try:
+        max_tasks = min(max(int(data.get('max_tasks', 1) or 1), 1), MAX_BATCH_CLAIM)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid max_tasks value"}), 400
+
     provider = Provider.query.get(provider_id)
     if not provider:
         return jsonify({"error": "Provider not registered."}), 404
 
-    # 1. Update heartbeat
-    provider.last_seen = datetime.utcnow()
-    provider.status = 'active'
-    
-    # 2. Check for an idle GPU
-    provider_gpus = jsonpickle.decode(provider.gpus)
-    idle_gpu = next((gpu for gpu in provider_gpus if gpu.get('status') == 'idle'), None)
-    
-    if not idle_gpu:
-        db.session.commit()
-        return jsonify({"task": None, "message": "Heartbeat received. No idle GPUs."}), 200
+    # 1. Update heartbeat (buffered; once per request, not once per wake-up)
+    record_heartbeat(provider_id)
 
-    # 3. Find the oldest queued task
-    task = Task.query.filter_by(status='QUEUED').order_by(Task.submission_time).first()
-    
-    if not task:
-        db.session.commit()
-        return jsonify({"task": None, "message": "Heartbeat received. No queued tasks."}), 200
+    # 2. Claim tasks, parking between attempts until a submit/free wakes us.
+    #    Only the wait needs a parking place; the first look never does.
+    parked = False
+    try:
+        while True:
+            seen = work_generation()
+            claims, message = _claim_for_provider(provider, max_tasks)
+            if claims:
+                break
+            # Release the connection before parking
+            db.session.commit()
+            remaining = deadline - time.monotonic()
+            if remaining > 0 and not parked:
+                parked = try_park()
+                if not parked:
+                    return _parking_full(task=None, tasks=[])
+            if remaining <= 0 or not wait_for_work(seen, remaining):
+                return jsonify({"task": None, "tasks": [], "message": f"Heartbeat received. {message}"}), 200
+    finally:
+        if parked:
+            unpark()
 
-    # 4. Generate a temporary "Ticket" for the Agent to upload results
+    # 3. Generate a temporary "Ticket" for the Agent to upload results
     # The agent uses this URL to put its results directly to R2 without needing api keys.
     try:
-        upload_url = s3_client.generate_presigned_url(
-            'put_object',
-            Params={
-                'Bucket': os.getenv('R2_BUCKET_NAME'),
-                'Key': f"artifacts/{task.id}.zip",
-                'ContentType': 'application/zip'
-            },
-            ExpiresIn=3600  # Link valid for 1 hour
-        )
+        # Link valid for 1 hour; a re-claimed task reuses its still-fresh URL
+        upload_urls = [presign_put(artifact_key(task.id, task.attempts), 'application/zip') for task, _ in claims]
+        inputs = input_artifacts([task.id for task, _ in claims])
     except Exception as e:
+        # Release the claims so the tasks go back to the queue
+        db.session.rollback()
         print(f"Failed to generate presigned URL: {e}")
         return jsonify({"error": "Internal storage error"}), 500
 
-    # 5. Assign task and mark GPU as busy
-    task.provider_id = provider_id
-    task.gpu_assigned = jsonpickle.encode(idle_gpu, unpicklable=False)
-    task.status = 'RUNNING'
-    task.start_time = datetime.utcnow()
-    
-    # Update GPU status in the provider's list
-    for gpu in provider_gpus:
-        if gpu['id'] == idle_gpu['id']:
-            gpu['status'] = 'busy'
-            break
-            
-    provider.gpus = jsonpickle.encode(provider_gpus, unpicklable=False)
-    
+    # We log that each task is now RUNNING and which provider took it
+    for task, _ in claims:
+        record_on_chain(task.id, f"RUNNING on {provider_id}")
+
+    # Built before the commit expires the task objects (no reload per task)
+    assignments = [_assignment(task, gpus, url, inputs.get(task.id)) for (task, gpus), url in zip(claims, upload_urls)]
+
     try:
+        # One commit for the whole batch
         db.session.commit()
-        print(f"Task {task.id} assigned to {provider_id} on {idle_gpu['name']}")
-        try:
-            # We log that the task is now RUNNING and which provider took it
-            record_on_chain(task.id, f"RUNNING on {provider_id}")
-        except Exception as bce:
-            print(f"Blockchain audit failed but continuing: {bce}")
+        for a in assignments:
+            print(f"Task {a['task_id']} assigned to {provider_id} on GPU(s) {', '.join(a['gpu_ids'])}")
         
         return jsonify({
-            "task": {
-                "task_id": task.id,
-                "docker_image": task.docker_image,
-                "gpu_id": idle_gpu['id'],
-                "input_path": task.input_path,
-                "upload_url": upload_url,
-                "script_path": task.script_path,
-                "env_vars": json.loads(task.env_vars) if task.env_vars else {}
-            },
-            "message": "Task assigned."
+            "task": assignments[0], # Single-task agents read this
+            "tasks": assignments,
+            "message": f"{len(assignments)} task(s) assigned." if len(assignments) > 1 else "Task assigned."
         }), 200
         
     except Exception as e:
@@ -497,13 +1121,8 @@ def provider_get_task():
 # --- Other Endpoints (Health, Debug) ---
 @bp.route('/consumer/tasks/debug', methods=['GET'])
 def get_all_tasks_debug():
-    tasks = Task.query.order_by(Task.submission_time.desc()).all()
-    return jsonify([{
-        'id': t.id,
-        'status': t.status,
-        'submission_time': t.submission_time.isoformat() if t.submission_time else None,
-        'provider_id': t.provider_id
-    } for t in tasks]), 201
+    response, code = _task_page(true(), DEBUG_LIST_FIELDS)
+    return response, 201 if code == 200 else code
 
 @bp.route('/provider/heartbeat', methods=['POST'])
 @require_api_key 
@@ -511,16 +1130,17 @@ def provider_heartbeat():
     data = request.get_json()
     provider_id = data.get('provider_id')
     telemetry = data.get('telemetry')
+    # Leases of the tasks the agent is running; agents that don't send them renew all of theirs
+    leases = data.get('leases')
     
     if not provider_id:
         return jsonify({"error": "Missing provider_id"}), 400
+    if leases is not None and (not isinstance(leases, list) or not all(isinstance(l, str) for l in leases)):
+        return jsonify({"error": "leases must be a list of lease ids"}), 400
 
-    provider = Provider.query.get(provider_id)
-    if provider:
-        provider.last_seen = datetime.utcnow()
-        # Ensure 'last_telemetry' exists in your models.py as a JSON column!
-        provider.last_telemetry = telemetry 
-        db.session.commit()
+    if is_known(provider_id):
+        # Acknowledged from memory; last_seen/telemetry/leases are flushed in batches
+        record_heartbeat(provider_id, telemetry, leases)
         return jsonify({"status": "received"}), 200
     
     return jsonify({"error": "Provider not found"}), 404
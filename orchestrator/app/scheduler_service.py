@@ -0,0 +1,375 @@
+import functools
+import json
+import os
+from datetime import datetime
+from sqlalchemy import select, func, and_, or_, bindparam, case
+from sqlalchemy.orm import aliased
+from .models import db, Task, Provider, GpuSlot, User
+from .claim_service import claim_next_task, claimable
+from .slot_service import parse_memory_mb, parse_capability
+
+# Capability-aware, fair-share matching. A task's requirements are
+# normalized into the req_* columns at submit time; tasks with identical
+# requirements form a class. Queued tasks sharing priority, owner and class
+# form a lane, which is plain FIFO. A poll finds every lane with work it may
+# claim, and that work's head, by hopping along ix_tasks_queued_lane from one
+# lane to the next (one index seek per lane, however deep the queue), keeps
+# the lanes this provider can run, and picks by priority, then per-user fair
+# share, then head age.
+
+REQUIREMENT_COLUMNS = ('req_gpu_memory_mb', 'req_gpu_count', 'req_cpu_cores', 'req_ram_mb', 'req_cuda_capability')
+LANE_COLUMNS = ('priority', 'user_id') + REQUIREMENT_COLUMNS  # ix_tasks_queued_lane, before submission_time
+PRIORITIES = {'low': 0, 'normal': 1, 'high': 2}
+USER_MAX_RUNNING = int(os.getenv('USER_MAX_RUNNING', '0'))  # Default per-user cap on RUNNING tasks, 0 = none
+QUEUE_STATS_SAMPLE = int(os.getenv('QUEUE_STATS_SAMPLE', '10000'))  # Most recent starts behind the wait percentiles
+MAX_GPU_COUNT = 16
+# nvidia-smi reports a "24 GB" card as 24564 MiB; don't turn that into a miss
+MEMORY_TOLERANCE = 0.98
+
+class InvalidRequirements(ValueError):
+    pass
+
+def parse_requirements(raw):
+    """
+    Normalizes submitted requirements into req_* column values, e.g.
+    {"gpu_memory": "24 GB", "gpu_count": 2, "cpu_cores": 8, "ram": "32 GB", "cuda_capability": "8.0"}.
+    Memory may also be given in MB as gpu_memory_mb / ram_mb. Missing keys mean no minimum.
+    """
+    raw = raw or {}
+    if not isinstance(raw, dict):
+        raise InvalidRequirements("requirements must be an object")
+
+    def _memory(*keys):
+        value = next((raw[k] for k in keys if raw.get(k) is not None), None)
+        if value is None:
+            return 0
+        mb = parse_memory_mb(value)
+        if mb is None or mb < 0:
+            raise InvalidRequirements(f"Can't read '{value}' as an amount of memory")
+        return mb
+
+    def _count(key, default, upper=None):
+        try:
+            value = int(raw.get(key, default))
+        except (TypeError, ValueError):
+            raise InvalidRequirements(f"{key} must be an integer")
+        if value < 0 or (upper is not None and value > upper):
+            raise InvalidRequirements(f"{key} must be between 0 and {upper}" if upper else f"{key} must be >= 0")
+        return value
+
+    capability = 0.0
+    if raw.get('cuda_capability') is not None:
+        capability = parse_capability(raw['cuda_capability'])
+        if capability is None:
+            raise InvalidRequirements("cuda_capability must look like 8.6")
+
+    return {
+        "req_gpu_memory_mb": _memory('gpu_memory_mb', 'gpu_memory'),
+        "req_gpu_count": max(_count('gpu_count', 1, MAX_GPU_COUNT), 1),
+        "req_cpu_cores": _count('cpu_cores', 0),
+        "req_ram_mb": _memory('ram_mb', 'ram'),
+        "req_cuda_capability": capability,
+    }
+
+def parse_priority(raw):
+    if raw is None:
+        return PRIORITIES['normal']
+    if raw not in PRIORITIES:
+        raise InvalidRequirements(f"priority must be one of {', '.join(PRIORITIES)}")
+    return PRIORITIES[raw]
+
+def requirements_of(task):
+    return {c: getattr(task, c) or 0 for c in REQUIREMENT_COLUMNS}
+
+def describe(req):
+    parts = [f"{req['req_gpu_count']} GPU(s)"]
+    if req['req_gpu_memory_mb']:
+        parts.append(f">= {req['req_gpu_memory_mb'] / 1024:g} GB VRAM each")
+    if req['req_cuda_capability']:
+        parts.append(f"CUDA capability >= {req['req_cuda_capability']:g}")
+    if req['req_cpu_cores']:
+        parts.append(f">= {req['req_cpu_cores']} CPU cores")
+    if req['req_ram_mb']:
+        parts.append(f">= {req['req_ram_mb'] / 1024:g} GB RAM")
+    return ", ".join(parts)
+
+def _slot_fits(slot, req):
+    if req['req_gpu_memory_mb'] and (slot.memory_mb or 0) < req['req_gpu_memory_mb'] * MEMORY_TOLERANCE:
+        return False
+    if req['req_cuda_capability'] and (slot.cuda_capability or 0) < req['req_cuda_capability']:
+        return False
+    return True
+
+def pick_slots(provider, slots, req):
+    """
+    The slots this provider would run `req` on, or None if it can't.
+    Best fit: the smallest adequate GPUs, so big cards stay free for big jobs.
+    Unknown CPU/RAM/VRAM never satisfies a non-zero minimum.
+    """
+    if req['req_cpu_cores'] and (provider.cpu_cores or 0) < req['req_cpu_cores']:
+        return None
+    if req['req_ram_mb'] and (provider.ram_mb or 0) < req['req_ram_mb']:
+        return None
+    fitting = sorted((s for s in slots if _slot_fits(s, req)), key=lambda s: (s.memory_mb or 0, s.gpu_id))
+    if len(fitting) < req['req_gpu_count']:
+        return None
+    return fitting[:req['req_gpu_count']]
+
+def class_criterion(req):
+    return and_(*[getattr(Task, c) == req[c] for c in REQUIREMENT_COLUMNS])
+
+def lane_criterion(lane):
+    user = Task.user_id.is_(None) if lane['user_id'] is None else Task.user_id == lane['user_id']
+    return and_(Task.priority == lane['priority'], user, class_criterion(lane['req']))
+
+def _lane_key(task):
+    return [getattr(task, c) for c in LANE_COLUMNS]
+
+@functools.lru_cache(maxsize=None)
+def lanes_query():
+    """
+    The head task of every lane with work :provider_id may claim at :now,
+    as a loose index scan: a recursive query that seeks ix_tasks_queued_lane
+    for the first claimable row past the previous lane's key, one seek per
+    lane. Rows in retry backoff or pinned to another provider are stepped
+    over. Built once; only the parameters change between polls.
+    """
+    task = aliased(Task)
+    # Every task has an owner (submit requires one); the key comparisons need it non-NULL
+    base = claimable(bindparam('provider_id'), bindparam('now'), task) + [task.user_id.is_not(None)]
+
+    def first(*criteria):
+        return (select(task.id).where(*base, *criteria)
+                .order_by(*_lane_key(task), task.submission_time)
+                .limit(1)
+                .scalar_subquery())
+
+    def next_head(prev=None):
+        if prev is None:
+            return first()
+        # "key > prev key" spelled as one seek per column: equal on the first n
+        # key columns, past prev on the next. Longer shared prefixes come first
+        # in index order, and COALESCE stops at the first hit. (SQLite only
+        # seeks on the leading column of a row-value comparison.)
+        key, prev_key = _lane_key(task), _lane_key(prev)
+        return func.coalesce(*[
+            first(*[k == p for k, p in zip(key[:n], prev_key[:n])], key[n] > prev_key[n])
+            for n in reversed(range(len(key)))
+        ])
+
+    heads = select(next_head().label('id')).cte('lane_heads', recursive=True)
+    prev = aliased(Task)
+    heads = heads.union_all(
+        select(next_head(prev).label('id')).select_from(heads.join(prev, prev.id == heads.c.id))
+    )
+    return select(*_lane_key(Task), Task.submission_time).join(heads, Task.id == heads.c.id)
+
+def queued_lanes(provider_id):
+    """
+    Every (priority, user, requirement class) with work provider_id may
+    claim now, and the submission time of that work's FIFO head.
+    """
+    rows = db.session.execute(lanes_query(), {"provider_id": provider_id, "now": datetime.utcnow()}).all()
+    return [{"priority": row[0], "user_id": row[1], "req": dict(zip(REQUIREMENT_COLUMNS, row[2:-1])), "head": row[-1]}
+            for row in rows]
+
+def _lane_head(lane, provider_id):
+    return db.session.execute(
+        select(func.min(Task.submission_time)).where(*claimable(provider_id), lane_criterion(lane))
+    ).scalar()
+
+def running_counts():
+    # Reads only RUNNING rows (ix_tasks_running_user), i.e. roughly one per busy GPU
+    return dict(db.session.execute(
+        select(Task.user_id, func.count(Task.id)).where(Task.status == 'RUNNING').group_by(Task.user_id)
+    ).all())
+
+def user_shares(user_ids):
+    """
+    {user_id: (weight, max_running)}; max_running 0 means no cap.
+    """
+    shares = {user_id: (1.0, USER_MAX_RUNNING) for user_id in user_ids}
+    known = [u for u in user_ids if u is not None]
+    if known:
+        for user in User.query.filter(User.id.in_(known)).all():
+            cap = user.max_running if user.max_running is not None else USER_MAX_RUNNING
+            shares[user.id] = (user.share_weight or 1.0, cap)
+    return shares
+
+def slot_gpus(slots):
+    return [{"id": s.gpu_id, "name": s.name, "memory_mb": s.memory_mb} for s in slots]
+
+def gpu_assignment(slots):
+    # Single-GPU tasks keep the one-object shape gpu_assigned always had
+    gpus = slot_gpus(slots)
+    return gpus[0] if len(gpus) == 1 else gpus
+
+def claim_matching_tasks(provider, slots, limit=1):
+    """
+    Claims up to `limit` queued tasks this provider's idle `slots` can run,
+    each on its own slots. Returns [(task, slots_to_occupy)]. Caller
+    occupies the slots and commits.
+
+    Lanes are served by priority, then by fair share (running tasks per unit
+    of the user's weight; users at their concurrency cap are skipped), then
+    by head age. Every claim counts against its user straight away, so one
+    batch round-robins across users instead of draining the biggest sweep.
+    """
+    free = list(slots)
+    lanes = queued_lanes(provider.id)
+    running = running_counts()
+    shares = user_shares({lane['user_id'] for lane in lanes})
+
+    def _usage(user_id):
+        return running.get(user_id, 0) / shares[user_id][0]
+
+    def _at_cap(user_id):
+        cap = shares[user_id][1]
+        return bool(cap) and running.get(user_id, 0) >= cap
+
+    claims = []
+    while lanes and free and len(claims) < limit:
+        lanes.sort(key=lambda l: (-l['priority'], _usage(l['user_id']), l['head']))
+        lane = next((l for l in lanes
+                     if not _at_cap(l['user_id']) and pick_slots(provider, free, l['req'])), None)
+        if lane is None:
+            break
+        lanes.remove(lane)
+        chosen = pick_slots(provider, free, lane['req'])
+        task = claim_next_task(provider.id, json.dumps(gpu_assignment(chosen)), lane_criterion(lane))
+        if not task:
+            continue  # Drained (or locked by other pollers) since we looked
+        claims.append((task, chosen))
+        free = [s for s in free if s not in chosen]
+        running[lane['user_id']] = running.get(lane['user_id'], 0) + 1
+
+        # The lane goes back in line behind its next-oldest task (one index seek)
+        lane['head'] = _lane_head(lane, provider.id)
+        if lane['head'] is not None:
+            lanes.append(lane)
+    return claims
+
+def _percentile(values, pct):
+    # Nearest-rank on an already sorted list
+    return values[max(-(-pct * len(values) // 100) - 1, 0)]
+
+def queue_wait_stats(since):
+    """
+    Per-user queue wait (start_time - submission_time) percentiles for tasks
+    started since `since`, plus what each user has queued and running now.
+    Speculative copies are left out: a task waited once, however many copies
+    it grew. Percentiles come from the QUEUE_STATS_SAMPLE most recent starts;
+    "started" counts the whole window.
+    """
+    # Copies are filtered in CASE / Python rather than WHERE, so the planner
+    # keeps to the start_time and status indexes instead of
+    # ix_tasks_speculative_of (where nearly every row is NULL)
+    own = case((Task.speculative_of.is_(None), Task.id))
+    waits = {}
+    for user_id, submission_time, start_time, copy_of in db.session.execute(
+        select(Task.user_id, Task.submission_time, Task.start_time, Task.speculative_of)
+        .where(Task.start_time >= since)
+        .order_by(Task.start_time.desc())  # ix_tasks_start_time
+        .limit(QUEUE_STATS_SAMPLE)
+    ).all():
+        if copy_of is None:
+            waits.setdefault(user_id, []).append((start_time - submission_time).total_seconds())
+
+    started = {user_id: count for user_id, count in db.session.execute(
+        select(Task.user_id, func.count(own)).where(Task.start_time >= since).group_by(Task.user_id)
+    ).all() if count}
+    queued = {user_id: (count, oldest) for user_id, count, oldest in db.session.execute(
+        select(Task.user_id, func.count(own),
+               func.min(case((Task.speculative_of.is_(None), Task.submission_time))))
+        .where(Task.status == 'QUEUED')
+        .group_by(Task.user_id)
+    ).all() if count}
+    running = running_counts()
+
+    now = datetime.utcnow()
+    stats = []
+    for user_id in set(started) | set(queued) | set(running):
+        values = sorted(waits.get(user_id, []))
+        count, oldest = queued.get(user_id, (0, None))
+        stats.append({
+            "user_id": user_id,
+            "queued": count,
+            "running": running.get(user_id, 0),
+            "started": started.get(user_id, 0),
+            "wait_p50_seconds": _percentile(values, 50) if values else None,
+            "wait_p90_seconds": _percentile(values, 90) if values else None,
+            "wait_p99_seconds": _percentile(values, 99) if values else None,
+            "wait_max_seconds": values[-1] if values else None,
+            "oldest_queued_seconds": (now - oldest).total_seconds() if oldest else None,
+        })
+    return sorted(stats, key=lambda s: -(s["wait_p90_seconds"] or 0))
+
+def explain_unscheduled(task):
+    """
+    Why a QUEUED task hasn't been picked up yet, from the fleet's point of view.
+    """
+    req = requirements_of(task)
+
+    # Slots good enough for this task, on online providers with enough CPU/RAM
+    slot_filters = [Provider.status == 'active']
+    if req['req_gpu_memory_mb']:
+        slot_filters.append(GpuSlot.memory_mb >= req['req_gpu_memory_mb'] * MEMORY_TOLERANCE)
+    if req['req_cuda_capability']:
+        slot_filters.append(GpuSlot.cuda_capability >= req['req_cuda_capability'])
+    if req['req_cpu_cores']:
+        slot_filters.append(Provider.cpu_cores >= req['req_cpu_cores'])
+    if req['req_ram_mb']:
+        slot_filters.append(Provider.ram_mb >= req['req_ram_mb'])
+
+    rows = db.session.execute(
+        select(GpuSlot.provider_id,
+               func.count(GpuSlot.id),
+               func.count(GpuSlot.id).filter(GpuSlot.status == 'idle'))
+        .join(Provider, Provider.id == GpuSlot.provider_id)
+        .where(*slot_filters)
+        .group_by(GpuSlot.provider_id)
+    ).all()
+    capable = [r for r in rows if r[1] >= req['req_gpu_count']]
+    idle_capable = [r for r in capable if r[2] >= req['req_gpu_count']]
+
+    ahead = db.session.execute(
+        select(func.count(Task.id))
+        .where(Task.status == 'QUEUED', class_criterion(req),
+               or_(Task.submission_time < task.submission_time,
+                   and_(Task.submission_time == task.submission_time, Task.id < task.id)))
+    ).scalar()
+
+    running = running_counts().get(task.user_id, 0)
+    cap = user_shares({task.user_id})[task.user_id][1]
+
+    now = datetime.utcnow()
+    if task.not_before and task.not_before > now:
+        reason = 'retry_backoff'
+        message = (f"Attempt {task.attempts} lost its provider; retrying in "
+                   f"{int((task.not_before - now).total_seconds())}s.")
+    elif not capable:
+        reason = 'no_capable_provider'
+        message = f"No online provider has {describe(req)}."
+    elif cap and running >= cap:
+        reason = 'user_concurrency_cap'
+        message = f"You already have {running} task(s) running, the most allowed at once."
+    elif not idle_capable:
+        reason = 'capable_providers_busy'
+        message = f"{len(capable)} online provider(s) can run this task, but none has enough idle GPUs right now."
+    else:
+        reason = 'waiting_for_poll'
+        message = (f"{len(idle_capable)} capable provider(s) are idle; {ahead} task(s) with the same requirements "
+                   f"are queued ahead, served by priority and fair share.")
+
+    return {
+        "reason": reason,
+        "message": message,
+        "requirements": describe(req),
+        "priority": next((name for name, level in PRIORITIES.items() if level == task.priority), task.priority),
+        "capable_providers": len(capable),
+        "idle_capable_providers": len(idle_capable),
+        "queued_ahead": ahead,
+        "running": running,
+        "max_running": cap or None,
+        "attempts": task.attempts or 0,
+    }
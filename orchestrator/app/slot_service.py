@@ -0,0 +1,113 @@
+import re
+from sqlalchemy import select, update, func
+from .models import db, GpuSlot
+
+def parse_memory_mb(raw):
+    # Agents (and consumers) give memory either as a number of MB or as a string like "24 GB"
+    if raw is None:
+        return None
+    if isinstance(raw, (int, float)):
+        return int(raw)
+    match = re.match(r'\s*([\d.]+)\s*([GMT]i?B)?', str(raw), re.IGNORECASE)
+    if not match:
+        return None
+    value = float(match.group(1))
+    unit = (match.group(2) or 'MB').upper()[0]
+    return int(value * {'M': 1, 'G': 1024, 'T': 1024 * 1024}[unit])
+
+def parse_capability(raw):
+    """
+    CUDA compute capability ("8.6", 8.6) as a float, or None.
+    """
+    try:
+        return float(raw) if raw not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+def _memory_mb(gpu):
+    return parse_memory_mb(gpu.get('memory_mb', gpu.get('memory')))
+
+def _capability(gpu):
+    # nvidia-smi calls it compute_cap
+    return parse_capability(gpu.get('cuda_capability', gpu.get('compute_capability', gpu.get('compute_cap'))))
+
+def provider_capacity(specs):
+    """
+    (cpu_cores, ram_mb) from the hardware_specs an agent registered with; None where unknown.
+    """
+    specs = specs or {}
+    cores = specs.get('cpu_cores', specs.get('cpu_count'))
+    ram = next((specs[k] for k in ('ram_mb', 'ram_total_mb', 'ram_total', 'memory_total', 'ram') if specs.get(k) is not None), None)
+    try:
+        cores = int(cores) if cores is not None else None
+    except (TypeError, ValueError):
+        cores = None
+    return cores, parse_memory_mb(ram)
+
+def sync_provider_slots(provider_id, gpus):
+    """
+    Reconciles the provider's slot rows with the GPU list it just reported.
+    Busy slots keep their task; GPUs that disappeared are dropped unless busy.
+    """
+    existing = {s.gpu_id: s for s in GpuSlot.query.filter_by(provider_id=provider_id).all()}
+    reported = set()
+
+    for gpu in gpus:
+        gpu_id = str(gpu.get('id'))
+        reported.add(gpu_id)
+        slot = existing.get(gpu_id)
+        if slot:
+            slot.name = gpu.get('name', slot.name)
+            slot.memory_mb = _memory_mb(gpu) or slot.memory_mb
+            slot.cuda_capability = _capability(gpu) or slot.cuda_capability
+        else:
+            db.session.add(GpuSlot(
+                provider_id=provider_id,
+                gpu_id=gpu_id,
+                name=gpu.get('name'),
+                memory_mb=_memory_mb(gpu),
+                cuda_capability=_capability(gpu),
+                status='idle'
+            ))
+
+    for gpu_id, slot in existing.items():
+        if gpu_id not in reported and slot.status == 'idle':
+            db.session.delete(slot)
+
+def idle_slots(provider_id):
+    return GpuSlot.query.filter_by(provider_id=provider_id, status='idle').order_by(GpuSlot.gpu_id).all()
+
+def occupy_slot(slot_id, task_id):
+    """
+    Marks a slot busy for task_id. Returns False if another poll took it first.
+    """
+    stmt = (
+        update(GpuSlot)
+        .where(GpuSlot.id == slot_id, GpuSlot.status == 'idle')
+        .values(status='busy', task_id=task_id)
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(stmt).rowcount == 1
+
+def release_task_slot(task_id):
+    """
+    Frees whatever slot is running task_id. Returns the number of slots freed.
+    """
+    stmt = (
+        update(GpuSlot)
+        .where(GpuSlot.task_id == task_id)
+        .values(status='idle', task_id=None)
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(stmt).rowcount
+
+def fleet_idle_capacity():
+    """
+    {provider_id: idle_slot_count} for the whole fleet in one grouped query.
+    """
+    rows = db.session.execute(
+        select(GpuSlot.provider_id, func.count(GpuSlot.id))
+        .where(GpuSlot.status == 'idle')
+        .group_by(GpuSlot.provider_id)
+    ).all()
+    return {provider_id: count for provider_id, count in rows}
@@ -0,0 +1,229 @@
+import os
+import statistics
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, and_, or_
+from sqlalchemy.orm import aliased
+from .models import db, Task, Provider, GpuSlot
+from .event_service import record_status_change
+from .notify_service import announce, WORK
+from .slot_service import release_task_slot
+from .scheduler_service import PRIORITIES, REQUIREMENT_COLUMNS, requirements_of, pick_slots
+
+# Speculative execution for stragglers at the tail of a batch. Tasks that
+# opted in (speculative=True) and share a batch_id are compared with their
+# completed peers; once the batch has nothing left in the queue, a task
+# running SPECULATION_FACTOR times longer than the batch median gets a copy
+# pinned to an idle provider that hasn't been a straggler on this batch
+# itself. Whichever finishes first completes the original; the other is
+# cancelled. An original that fails while a copy is still live is handed
+# over to it: it stays RUNNING without a lease and ends the way its copies
+# do. Copies are internal rows (speculative_of) that users don't see.
+
+SPECULATION_FACTOR = float(os.getenv('SPECULATION_FACTOR', '2.0'))  # 0 disables
+MIN_SAMPLES = int(os.getenv('SPECULATION_MIN_SAMPLES', '3'))
+RUNTIME_SAMPLES = 200  # Most recent completions a batch's median is taken over
+PIN_TTL = timedelta(seconds=int(os.getenv('SPECULATION_PIN_SECONDS', '120')))  # Unclaimed copies are dropped after this
+
+COPIED_COLUMNS = ('user_id', 'docker_image', 'gpu_requirements', 'input_path', 'project_digest',
+                  'script_path', 'env_vars', 'batch_id') + REQUIREMENT_COLUMNS
+LIVE_STATUSES = ('QUEUED', 'RUNNING')
+
+def _batch_runtimes(batch_id):
+    """
+    [(provider_id, seconds)] for the batch's most recent completed originals.
+    """
+    rows = db.session.execute(
+        select(Task.provider_id, Task.start_time, Task.end_time)
+        .where(Task.batch_id == batch_id, Task.status == 'COMPLETED', Task.speculative_of.is_(None),
+               Task.start_time.is_not(None), Task.end_time.is_not(None))
+        .order_by(Task.end_time.desc())
+        .limit(RUNTIME_SAMPLES)
+    ).all()
+    return [(provider_id, (end - start).total_seconds()) for provider_id, start, end in rows]
+
+def _fast_idle_provider(task, runtimes, median):
+    """
+    An idle provider (not the straggler's) that can run the task and hasn't
+    straggled on this batch itself. Returns its id or None.
+    """
+    per_provider = {}
+    for provider_id, seconds in runtimes:
+        per_provider.setdefault(provider_id, []).append(seconds)
+
+    req = requirements_of(task)
+    candidates = db.session.execute(
+        select(GpuSlot.provider_id).where(GpuSlot.status == 'idle', GpuSlot.provider_id != task.provider_id)
+        .join(Provider, Provider.id == GpuSlot.provider_id).where(Provider.status == 'active')
+        .distinct()
+    ).scalars().all()
+    # Proven-fast providers first, then ones with no history on this batch
+    candidates.sort(key=lambda p: statistics.mean(per_provider[p]) if p in per_provider else median)
+    for provider_id in candidates:
+        if provider_id in per_provider and statistics.mean(per_provider[provider_id]) >= SPECULATION_FACTOR * median:
+            continue
+        provider = db.session.get(Provider, provider_id)
+        slots = GpuSlot.query.filter_by(provider_id=provider_id, status='idle').all()
+        if pick_slots(provider, slots, req):
+            return provider_id
+    return None
+
+def launch_copies(now=None):
+    """
+    One straggler scan. Queues a pinned copy for every qualifying task and
+    returns how many were launched. Caller commits.
+    """
+    if SPECULATION_FACTOR <= 0:
+        return 0
+    now = now or datetime.utcnow()
+
+    # Opted-in originals still running that don't have a copy yet (one whose
+    # pin expired before anyone claimed it doesn't count: try another provider)
+    has_copy = select(Task.speculative_of).where(
+        Task.speculative_of.is_not(None), or_(Task.status != 'CANCELLED', Task.start_time.is_not(None)))
+    running = (Task.query
+               .filter(Task.status == 'RUNNING', Task.speculative.is_(True), Task.batch_id.is_not(None),
+                       Task.speculative_of.is_(None), Task.id.not_in(has_copy))
+               .all())
+
+    by_batch = {}
+    for task in running:
+        by_batch.setdefault(task.batch_id, []).append(task)
+
+    launched = 0
+    for batch_id, tasks in by_batch.items():
+        # Only the tail of a batch: while work is still queued, idle providers have better things to do
+        queued = db.session.execute(
+            select(func.count(Task.id)).where(Task.batch_id == batch_id, Task.status == 'QUEUED')
+        ).scalar()
+        if queued:
+            continue
+        runtimes = _batch_runtimes(batch_id)
+        if len(runtimes) < MIN_SAMPLES:
+            continue
+        median = statistics.median(seconds for _, seconds in runtimes)
+
+        for task in tasks:
+            elapsed = (now - task.start_time).total_seconds() if task.start_time else 0
+            if elapsed < SPECULATION_FACTOR * median:
+                continue
+            provider_id = _fast_idle_provider(task, runtimes, median)
+            if not provider_id:
+                continue
+            copy = Task(
+                status='QUEUED',
+                submission_time=now,
+                speculative_of=task.id,
+                pinned_provider_id=provider_id,
+                priority=PRIORITIES['high'],  # The pinned provider should take it on its next poll
+                max_attempts=1,               # A lost copy isn't retried; the original is still running
+                **{c: getattr(task, c) for c in COPIED_COLUMNS}
+            )
+            db.session.add(copy)
+            launched += 1
+            print(f"🐢 Task {task.id} running {elapsed:.0f}s vs batch median {median:.0f}s; "
+                  f"speculative copy pinned to {provider_id}")
+    return launched
+
+def _cancel(task, now):
+    task.status = 'CANCELLED'
+    task.end_time = now
+    task.lease_id = None  # Its agent's next report gets a 409 and can stop
+    task.lease_expires_at = None
+    if release_task_slot(task.id):
+        announce(WORK)
+    record_status_change(task)
+
+def _live_copies(original_id):
+    return Task.query.filter(Task.speculative_of == original_id, Task.status.in_(LIVE_STATUSES)).all()
+
+def live_copy_originals():
+    """
+    Subquery of the ids of originals that have a QUEUED or RUNNING copy.
+    """
+    copy = aliased(Task)
+    return select(copy.speculative_of).where(copy.speculative_of.is_not(None), copy.status.in_(LIVE_STATUSES))
+
+def handed_over():
+    # Every claimed RUNNING task holds a lease, except originals left to their copies
+    return and_(Task.status == 'RUNNING', Task.lease_id.is_(None))
+
+def hand_over(task):
+    """
+    An original that failed while a copy of it is still live doesn't fail
+    yet: it stays RUNNING, without a lease or a slot, and ends the way its
+    copies do (settle). Returns True if it was handed over. Caller commits.
+    """
+    if task.speculative_of is not None or not _live_copies(task.id):
+        return False
+    task.lease_id = None  # Its agent is done; further reports get a 409
+    task.lease_expires_at = None
+    if release_task_slot(task.id):
+        announce(WORK)
+    print(f"🐢 Task {task.id} failed on {task.provider_id}; its speculative copy carries on")
+    return True
+
+def settle(task):
+    """
+    Call in the transaction that moves `task` to a terminal status. An
+    original that completed or was cancelled takes its copies down with it.
+    A copy that completed first completes the original, with the copy as its
+    winner, and cancels any other copy; a handed-over original fails once
+    its last copy did. Returns the original if this finished it, else None.
+    """
+    now = datetime.utcnow()
+    if task.speculative_of is None:
+        # A failed one with a live copy was handed over instead (hand_over)
+        if task.status in ('COMPLETED', 'CANCELLED'):
+            for copy in _live_copies(task.id):
+                _cancel(copy, now)
+        return None
+
+    original = db.session.get(Task, task.speculative_of, populate_existing=True)  # The reaper may have just updated it
+    if not original or original.status not in LIVE_STATUSES:
+        return None
+
+    if task.status != 'COMPLETED':
+        # A failed copy changes nothing while the original, or another copy, still runs
+        if original.status != 'RUNNING' or original.lease_id is not None or _live_copies(original.id):
+            return None
+        original.status = 'FAILED'
+        original.end_time = now
+        original.error_message = original.error_message or "Failed, and so did its speculative copy."
+        record_status_change(original)
+        return original
+
+    original.status = 'COMPLETED'
+    original.end_time = now
+    original.winner_task_id = task.id
+    original.result_url = task.result_url
+    original.lease_id = None
+    original.lease_expires_at = None
+    if release_task_slot(original.id):
+        announce(WORK)
+    record_status_change(original)
+    for copy in _live_copies(original.id):
+        if copy.id != task.id:
+            _cancel(copy, now)
+    return original
+
+def expire_pins(now=None):
+    """
+    Cancels queued copies whose pinned provider went offline or hasn't
+    claimed them within PIN_TTL, so they don't sit at the head of the high
+    priority lane for good. The next scan may pin the straggler a new copy.
+    Returns (copies cancelled, originals that ended with them). Caller commits.
+    """
+    now = now or datetime.utcnow()
+    active = select(Provider.id).where(Provider.status == 'active')
+    stale = Task.query.filter(
+        Task.status == 'QUEUED', Task.speculative_of.is_not(None),
+        or_(Task.submission_time < now - PIN_TTL, Task.pinned_provider_id.not_in(active))
+    ).all()
+
+    ended = []
+    for copy in stale:
+        _cancel(copy, now)
+        original = settle(copy)
+        if original:
+            ended.append(original)
+    return len(stale), ended
@@ -0,0 +1,258 @@
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# One client per process, shared by every gunicorn thread (boto3 clients are
+# thread-safe). The pool must be at least as big as the worker's thread count,
+# or threads queue for a connection and urllib3 warns "pool is full".
+R2_MAX_POOL_CONNECTIONS = int(os.getenv('R2_MAX_POOL_CONNECTIONS', '32'))
+
+# Initialize the R2 client
+# Use 'auto' for region_name as R2 doesn't use standard AWS regions
+s3_client = boto3.client(
+    's3',
+    endpoint_url=os.getenv('R2_ENDPOINT_URL'),
+    aws_access_key_id=os.getenv('R2_ACCESS_KEY_ID'),
+    aws_secret_access_key=os.getenv('R2_SECRET_ACCESS_KEY'),
+    config=Config(
+        signature_version='s3v4',
+        max_pool_connections=R2_MAX_POOL_CONNECTIONS,
+        connect_timeout=5,
+        read_timeout=30,
+        retries={'max_attempts': 3, 'mode': 'standard'}
+    ),
+    region_name='auto'
+)
+
+URL_TTL_SECONDS = 3600
+URL_REISSUE_BEFORE = 600       # Stop handing out a cached URL once it has < 10 min left
+EXISTS_TTL_SECONDS = 3600      # Uploaded objects don't disappear
+MISSING_TTL_SECONDS = 10       # "Not uploaded yet" is re-checked quickly
+
+class TTLCache:
+    """
+    Small thread-safe LRU with a per-entry expiry.
+    """
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+_signed_urls = TTLCache()
+_head_results = TTLCache()
+
+def bucket_name():
+    return os.getenv('R2_BUCKET_NAME')
+
+def public_url(key):
+    return f"{os.getenv('R2_PUBLIC_DOMAIN')}/{key}"
+
+# Content-addressed projects: a ZIP lives at its sha256, inside the owner's
+# prefix (so one user can't probe for, or poison, another user's blobs).
+# Same bytes -> same key, so re-submitting a project never re-uploads it and
+# two concurrent uploads of it can't clobber each other with different data.
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+def is_digest(value):
+    return isinstance(value, str) and bool(DIGEST_RE.match(value))
+
+def project_blob_key(owner, digest):
+    return f"{owner}/blobs/sha256/{digest}.zip"
+
+# A client-hashed upload lands on a staging key first; only bytes that hash
+# to the claimed digest are promoted to project_blob_key(), so the dedup
+# check never vouches for a blob nobody verified.
+STAGED_BLOB_RE = re.compile(r'^[^/]+/uploads/[0-9a-f-]{36}/sha256-([0-9a-f]{64})\.zip$')
+
+def staging_blob_key(owner, digest):
+    return f"{owner}/uploads/{uuid.uuid4()}/sha256-{digest}.zip"
+
+def staged_digest(key):
+    """
+    The digest a staging key was created for, or None for any other key.
+    """
+    match = STAGED_BLOB_RE.match(key)
+    return match.group(1) if match else None
+
+def sha256_fileobj(fileobj, chunk_size=1024 * 1024):
+    """
+    Hashes a seekable file in chunks and rewinds it.
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(chunk_size), b''):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+def _presign(method, key, expires_in, **params):
+    """
+    Signed URLs are reused until they get close to expiry, so repeated
+    clicks (or a re-claimed task) get the same link instead of a new signature.
+    """
+    cache_key = (method, key, expires_in, tuple(sorted(params.items())))
+    url = _signed_urls.get(cache_key)
+    if url is None:
+        url = s3_client.generate_presigned_url(
+            method,
+            Params={'Bucket': bucket_name(), 'Key': key, **params},
+            ExpiresIn=expires_in
+        )
+        if expires_in > URL_REISSUE_BEFORE:
+            _signed_urls.set(cache_key, url, expires_in - URL_REISSUE_BEFORE)
+    return url
+
+def presign_get(key, expires_in=URL_TTL_SECONDS):
+    return _presign('get_object', key, expires_in)
+
+def presign_put(key, content_type, expires_in=URL_TTL_SECONDS):
+    return _presign('put_object', key, expires_in, ContentType=content_type)
+
+def object_exists(key):
+    """
+    HEAD check with the answer cached: hits for an hour, misses for a few
+    seconds. Anything other than a clean 404 is raised.
+    """
+    cached = _head_results.get(key)
+    if cached is not None:
+        return cached
+    try:
+        s3_client.head_object(Bucket=bucket_name(), Key=key)
+        exists = True
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+            raise
+        exists = False
+    _head_results.set(key, exists, EXISTS_TTL_SECONDS if exists else MISSING_TTL_SECONDS)
+    return exists
+
+# Direct-to-R2 multipart uploads: the orchestrator only initiates, signs part
+# URLs and completes; the bytes go browser -> R2. S3 rules: every part but the
+# last is >= 5 MiB and an upload has at most 10,000 parts.
+MULTIPART_PART_SIZE = 16 * 1024 * 1024
+MULTIPART_MAX_PARTS = 10000
+
+def multipart_part_size(total_size):
+    """
+    The default part size, grown in 1 MiB steps when the file would need
+    more than MULTIPART_MAX_PARTS parts.
+    """
+    size = MULTIPART_PART_SIZE
+    if total_size > size * MULTIPART_MAX_PARTS:
+        min_size = -(-total_size // MULTIPART_MAX_PARTS)
+        size = -(-min_size // (1024 * 1024)) * 1024 * 1024
+    return size
+
+def create_multipart_upload(key, content_type):
+    return s3_client.create_multipart_upload(
+        Bucket=bucket_name(), Key=key, ContentType=content_type)['UploadId']
+
+def presign_upload_part(key, upload_id, part_number, expires_in=URL_TTL_SECONDS):
+    # Not cached: thousands of one-shot part URLs would evict the useful entries
+    return s3_client.generate_presigned_url(
+        'upload_part',
+        Params={'Bucket': bucket_name(), 'Key': key, 'UploadId': upload_id, 'PartNumber': part_number},
+        ExpiresIn=expires_in
+    )
+
+def list_uploaded_parts(key, upload_id):
+    """
+    Parts R2 already has, as [{"PartNumber", "ETag", "Size"}]; lets a client resume.
+    """
+    parts, marker = [], 0
+    while True:
+        page = s3_client.list_parts(Bucket=bucket_name(), Key=key, UploadId=upload_id,
+                                    PartNumberMarker=marker)
+        parts.extend({"PartNumber": p['PartNumber'], "ETag": p['ETag'], "Size": p['Size']}
+                     for p in page.get('Parts', []))
+        if not page.get('IsTruncated'):
+            return parts
+        marker = page['NextPartNumberMarker']
+
+def complete_multipart_upload(key, upload_id, parts):
+    s3_client.complete_multipart_upload(
+        Bucket=bucket_name(), Key=key, UploadId=upload_id,
+        MultipartUpload={'Parts': sorted(parts, key=lambda p: p['PartNumber'])})
+    forget_object(key)
+
+def abort_multipart_upload(key, upload_id):
+    s3_client.abort_multipart_upload(Bucket=bucket_name(), Key=key, UploadId=upload_id)
+
+def object_sha256(key, chunk_size=1024 * 1024):
+    """
+    Streams an object back from R2 and hashes it, without holding it in memory.
+    """
+    body = s3_client.get_object(Bucket=bucket_name(), Key=key)['Body']
+    digest = hashlib.sha256()
+    for chunk in body.iter_chunks(chunk_size):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def delete_object(key):
+    s3_client.delete_object(Bucket=bucket_name(), Key=key)
+    forget_object(key)
+
+def move_object(source, dest):
+    """
+    Server-side copy, then delete; boto3 switches to a multipart copy for
+    objects over its threshold, so the bytes never pass through us.
+    """
+    s3_client.copy({'Bucket': bucket_name(), 'Key': source}, bucket_name(), dest)
+    delete_object(source)
+    forget_object(dest)
+
+def forget_object(key):
+    """
+    Drops the cached HEAD result for a key we just wrote.
+    """
+    _head_results.discard(key)
+
+def put_gzipped_text(key, parts):
+    """
+    Streams text parts through gzip into a spooled temp file and uploads it,
+    so a multi-hundred-MB log never has to sit in memory in one piece.
+    Returns the compressed size in bytes.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as buf:
+        with gzip.GzipFile(fileobj=buf, mode='wb') as gz:
+            for part in parts:
+                gz.write(part.encode('utf-8'))
+        stored_bytes = buf.tell()
+        buf.seek(0)
+        s3_client.upload_fileobj(buf, bucket_name(), key, ExtraArgs={
+            'ContentType': 'text/plain; charset=utf-8',
+            # Browsers and curl --compressed decode this transparently
+            'ContentEncoding': 'gzip'
+        })
+    forget_object(key)
+    return stored_bytes
@@ -0,0 +1,171 @@
+import itertools
+import json
+import math
+import os
+import uuid
+from datetime import datetime
+from sqlalchemy import select, insert, func
+from .models import db, Job, Task
+from .dependency_service import block_on
+from .scheduler_service import parse_requirements
+
+# Parameter sweeps (task arrays). One submit carries the shared task fields
+# plus a grid or list of env_vars overrides; every override becomes a child
+# task of a Job, written with one multi-row INSERT. Children use the job id
+# as their batch_id (so stragglers are judged within the sweep), stay out of
+# /consumer/tasks and the status stream, and are followed through the job's
+# per-status counts instead.
+#
+# A sharded job is a sweep over SHARD_INDEX (0..SHARD_COUNT-1), optionally
+# followed by a reduce task that waits for every shard (dependency_service)
+# and gets their artifacts as input.
+
+SWEEP_MAX_TASKS = int(os.getenv('SWEEP_MAX_TASKS', '10000'))
+SHARD_MAX_COUNT = int(os.getenv('SHARD_MAX_COUNT', '128'))  # The reduce's INPUT_ARTIFACTS must fit in one env var
+JOB_STATUSES = ('BLOCKED', 'QUEUED', 'RUNNING', 'COMPLETED', 'FAILED', 'CANCELLED')
+FINISHED_STATUSES = ('COMPLETED', 'FAILED', 'CANCELLED')
+
+class InvalidSweep(ValueError):
+    pass
+
+def expand_sweep(raw):
+    """
+    The env_vars overrides a sweep stands for, one per child task. An
+    object is a grid: every combination of its value lists, first key
+    slowest. A list of objects is taken as-is.
+    """
+    if isinstance(raw, dict):
+        if not raw:
+            raise InvalidSweep("sweep grid is empty")
+        names = list(raw)
+        values = [v if isinstance(v, list) else [v] for v in raw.values()]
+        if not all(values):
+            raise InvalidSweep("Every sweep grid key needs at least one value")
+        size = math.prod(len(v) for v in values)
+        if size > SWEEP_MAX_TASKS:
+            raise InvalidSweep(f"sweep grid has {size} points; the limit is {SWEEP_MAX_TASKS}")
+        return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+    if isinstance(raw, list):
+        if not raw:
+            raise InvalidSweep("sweep list is empty")
+        if len(raw) > SWEEP_MAX_TASKS:
+            raise InvalidSweep(f"sweep has {len(raw)} entries; the limit is {SWEEP_MAX_TASKS}")
+        if not all(isinstance(item, dict) for item in raw):
+            raise InvalidSweep("Every sweep entry must be an object of env_vars overrides")
+        return raw
+
+    raise InvalidSweep("sweep must be a grid object or a list of env_vars objects")
+
+def shard_overrides(count):
+    if isinstance(count, bool) or not isinstance(count, int) or not 1 <= count <= SHARD_MAX_COUNT:
+        raise InvalidSweep(f"shards must be an integer between 1 and {SHARD_MAX_COUNT}")
+    return [{"SHARD_INDEX": index, "SHARD_COUNT": count} for index in range(count)]
+
+def parse_reduce(raw, fields):
+    """
+    (env_vars, Task columns) of a sharded job's reduce step. It names its
+    own script_path and may override env_vars, docker_image and
+    requirements; everything else is the shards'.
+    """
+    if not isinstance(raw, dict) or not isinstance(raw.get('script_path'), str):
+        raise InvalidSweep("reduce must be an object with a script_path")
+    env = raw.get('env_vars') or {}
+    if not isinstance(env, dict):
+        raise InvalidSweep("reduce env_vars must be an object")
+    reduce_fields = {**fields, "script_path": raw['script_path']}
+    if raw.get('docker_image'):
+        reduce_fields['docker_image'] = raw['docker_image']
+    if raw.get('requirements') is not None:
+        reduce_fields.update(parse_requirements(raw['requirements']))  # InvalidRequirements propagates
+        reduce_fields['gpu_requirements'] = json.dumps(raw['requirements'])
+    return env, reduce_fields
+
+def create_sweep(user_id, overrides, base_env, fields, name=None, kind='sweep', parents=([], 0)):
+    """
+    Adds the Job and its QUEUED children, one per override merged over
+    base_env. `fields` are the Task columns every child shares; `parents`
+    is lock_parents() output for a job that waits on other tasks. Caller
+    commits. Returns the job and the children's ids, in override order.
+    """
+    parent_ids, pending = parents
+    now = datetime.utcnow()
+    job = Job(id=str(uuid.uuid4()), user_id=user_id, kind=kind, name=name,
+              task_count=len(overrides), created_at=now)
+    db.session.add(job)
+    db.session.flush()  # The jobs row goes in before the children that reference it
+
+    task_ids = [str(uuid.uuid4()) for _ in overrides]
+    # Core executemany on the session's connection: no ORM bookkeeping per row
+    db.session.connection().execute(insert(Task.__table__), [
+        {**fields, "id": task_id, "user_id": user_id, "job_id": job.id, "batch_id": job.id,
+         "status": 'BLOCKED' if pending else 'QUEUED', "pending_parents": pending,
+         "submission_time": now, "last_update": now, "env_vars": json.dumps({**base_env, **override})}
+        for task_id, override in zip(task_ids, overrides)
+    ])
+    if parent_ids:
+        block_on(task_ids, parent_ids)
+    return job, task_ids
+
+def add_reduce_task(job, shard_ids, env, fields):
+    """
+    Adds the job's reduce task, BLOCKED until every shard completed. Its
+    inputs are the shards' artifacts, in SHARD_INDEX order. Caller commits.
+    """
+    now = datetime.utcnow()
+    reduce_task = Task(
+        id=str(uuid.uuid4()),
+        user_id=job.user_id,
+        job_id=job.id,
+        status='BLOCKED',
+        pending_parents=len(shard_ids),
+        submission_time=now,
+        env_vars=json.dumps({**env, "SHARD_COUNT": len(shard_ids)}),
+        **{**fields, "speculative": False}  # Not a peer of the shards; never judged against them
+    )
+    db.session.add(reduce_task)
+    db.session.flush()
+    block_on([reduce_task.id], shard_ids)
+    job.reduce_task_id = reduce_task.id
+    job.task_count += 1
+    return reduce_task
+
+def job_progress(job_ids):
+    """
+    {job_id: {status: count}} from one grouped query over ix_tasks_job_status.
+    """
+    progress = {job_id: dict.fromkeys(JOB_STATUSES, 0) for job_id in job_ids}
+    if not progress:
+        return progress
+    rows = db.session.execute(
+        select(Task.job_id, Task.status, func.count())
+        .where(Task.job_id.in_(list(progress)))
+        .group_by(Task.job_id, Task.status)
+    ).all()
+    for job_id, status, count in rows:
+        progress[job_id][status] = count
+    return progress
+
+def job_status(job, counts):
+    """
+    One status for the whole job: RUNNING once any child started, and
+    COMPLETED only if every child did.
+    """
+    finished = sum(counts[s] for s in FINISHED_STATUSES)
+    if finished >= job.task_count:
+        return 'COMPLETED' if counts['COMPLETED'] == job.task_count else 'FAILED'
+    if counts['RUNNING'] or finished:
+        return 'RUNNING'
+    return 'QUEUED'
+
+def describe_job(job, counts):
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "name": job.name,
+        "status": job_status(job, counts),
+        "task_count": job.task_count,
+        "counts": counts,
+        "reduce_task_id": job.reduce_task_id,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+    }
@@ -0,0 +1,73 @@
+"""
+Heartbeat throughput with and without write coalescing.
+
+    DATABASE_URL=postgresql://localhost/matcha DATABASE_SSLMODE=disable \
+        python scripts/bench_heartbeat.py --providers 200 --requests 5000 --threads 16
+
+Runs the same load twice through the Flask test client: once write-through
+(HEARTBEAT_FLUSH_SECONDS=0, one UPDATE+COMMIT per ping, like before) and once
+buffered, then prints requests/sec for each.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app import heartbeat_service
+from app.models import db, Provider
+
+API_KEY = 'bench-provider-key'
+
+def run(app, provider_ids, total, threads):
+    per_thread = total // threads
+    telemetry = {"gpu_util": 42, "gpu_mem_used": 1024, "cpu": 13.5}
+
+    def worker(offset):
+        client = app.test_client()
+        for i in range(per_thread):
+            provider_id = provider_ids[(offset + i) % len(provider_ids)]
+            r = client.post('/provider/heartbeat', headers={'X-API-Key': API_KEY},
+                            json={'provider_id': provider_id, 'telemetry': telemetry})
+            assert r.status_code == 200, r.get_data(as_text=True)
+
+    workers = [threading.Thread(target=worker, args=(n * per_thread,)) for n in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--providers', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    os.environ['ORCHESTRATOR_API_KEY_PROVIDERS'] = API_KEY
+    app = create_app()
+    provider_ids = [f"bench-provider-{i}" for i in range(args.providers)]
+
+    with app.app_context():
+        for provider_id in provider_ids:
+            if not db.session.get(Provider, provider_id):
+                db.session.add(Provider(id=provider_id, name=provider_id, gpus='[]'))
+        db.session.commit()
+
+        results = {}
+        for label, flush_seconds in [("write-through", 0), ("buffered", 3)]:
+            heartbeat_service.FLUSH_SECONDS = flush_seconds
+            results[label] = run(app, provider_ids, args.requests, args.threads)
+            flushed = heartbeat_service.flush()
+            print(f"{label:>14}: {results[label]:8.0f} req/s  (final flush wrote {flushed} rows)")
+
+        print(f"{'speedup':>14}: {results['buffered'] / results['write-through']:8.1f}x")
+
+        Provider.query.filter(Provider.id.in_(provider_ids)).delete(synchronize_session=False)
+        db.session.commit()
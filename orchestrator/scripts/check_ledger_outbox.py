@@ -0,0 +1,276 @@
+"""
+Drives the ledger outbox writer against a fake chain and checks that gas
+bumps never record an event twice or put two events on one nonce.
+
+    python scripts/check_ledger_outbox.py
+    DATABASE_URL=postgresql+psycopg2://postgres@127.0.0.1/matcha DATABASE_SSLMODE=disable \
+        python scripts/check_ledger_outbox.py --events 8
+
+Runs against a scratch database (DATABASE_URL, or the local SQLite
+fallback) with nothing pending or in flight in its outbox. FakeChain is
+installed with ledger_service.set_chain() and keeps one account's nonces
+like a node does. Every transaction broadcast for a nonce stays minable
+until one of them is mined, because the original may already sit in a
+miner's pool when its replacement arrives. Each scenario queues --events
+events and calls drain_outbox() tick by tick. In-flight rows are aged past
+BUMP_AFTER instead of waiting for it:
+
+  mined_after_bump   every transaction is bumped, then the original is mined
+  mined_during_bump  the original lands just before its bump ("nonce too low")
+  foreign_nonce      another sender takes the first nonce; that event is re-sent
+  legacy_row         a row with only tx_hash (no tx_hashes) is bumped, original mined
+
+Exits non-zero if an event does not end up in exactly one confirmed row, a
+row is confirmed with a hash the chain did not mine, any nonce was sent for
+two different events, an event was sent under two nonces that could both be
+mined, or the writer keeps sending once everything is mined.
+"""
+import argparse
+import hashlib
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# One transaction per event, so every outbox row goes through the nonce/gas pipeline
+os.environ['LEDGER_MODE'] = 'per_event'
+
+from sqlalchemy import func
+
+from app import create_app
+from app import ledger_service
+from app.models import db, LedgerOutbox
+
+class FakeChain:
+    """
+    One account on a toy chain, with the Web3Chain interface drain_outbox() uses.
+    """
+    GAS_PRICE = 1_000_000_000
+
+    def __init__(self, start_nonce=0):
+        self.next_mined = start_nonce  # Nonces are mined strictly in order
+        self.pool = {}                 # nonce -> [(tx_hash, gas_price)], oldest first
+        self.mined = {}                # nonce -> tx_hash (None: a transaction we never sent)
+        self.receipts = {}             # tx_hash -> 1
+        self.events = {}               # nonce -> {(task_id, status)} ever sent at it
+        self.sends = 0
+        self.before_send = None        # hook(chain, nonce), e.g. to mine something first
+
+    def pending_nonce(self):
+        return max([self.next_mined] + [nonce + 1 for nonce in self.pool])
+
+    def gas_price(self):
+        return self.GAS_PRICE
+
+    def send(self, task_id, status, nonce, gas_price):
+        if self.before_send:
+            self.before_send(self, nonce)
+        if nonce < self.next_mined:
+            raise ValueError(f"nonce too low: next nonce {self.next_mined}, tx nonce {nonce}")
+        sent = self.pool.setdefault(nonce, [])
+        # Nodes only accept a replacement that pays at least 10% more
+        if sent and gas_price * 10 < max(g for _, g in sent) * 11:
+            raise ValueError("replacement transaction underpriced")
+        self.sends += 1
+        tx_hash = '0x' + hashlib.sha256(f"{nonce}|{gas_price}|{self.sends}".encode()).hexdigest()
+        sent.append((tx_hash, gas_price))
+        self.events.setdefault(nonce, set()).add((task_id, status))
+        return tx_hash
+
+    def receipt_status(self, tx_hash):
+        return self.receipts.get(tx_hash)
+
+    def mine(self, pick=0):
+        """
+        Mines the next nonce with its pick-th broadcast (0 = the original);
+        the others for that nonce can never be mined after it.
+        """
+        nonce = self.next_mined
+        tx_hash = self.pool.pop(nonce)[pick][0]
+        self.receipts[tx_hash] = 1
+        self.mined[nonce] = tx_hash
+        self.next_mined += 1
+        return tx_hash
+
+    def mine_foreign(self):
+        """
+        A transaction the writer never sent takes the next nonce.
+        """
+        self.pool.pop(self.next_mined, None)
+        self.mined[self.next_mined] = None
+        self.next_mined += 1
+
+    def mine_all(self, pick=0):
+        while self.next_mined in self.pool:
+            self.mine(pick)
+
+def queue_events(name, count):
+    events = [(f"{name}-{i}", f"check-{name}") for i in range(count)]
+    for task_id, status in events:
+        ledger_service.record_on_chain(task_id, status)
+    db.session.commit()
+    return events
+
+def our_rows(events):
+    return (LedgerOutbox.query
+            .filter(LedgerOutbox.task_id.in_([task_id for task_id, _ in events]))
+            .order_by(LedgerOutbox.id)
+            .all())
+
+def age_in_flight(events):
+    # As if BUMP_AFTER went by without a receipt
+    stale = datetime.utcnow() - ledger_service.BUMP_AFTER - timedelta(seconds=1)
+    for row in our_rows(events):
+        if row.state == 'sent':
+            row.sent_at = stale
+    db.session.commit()
+
+def tick():
+    counts = ledger_service.drain_outbox()
+    db.session.expire_all()
+    return counts
+
+def mined_after_bump(chain, events):
+    tick()                                           # nonce assigned, original sent
+    age_in_flight(events)
+    tick()                                           # replacement at +25% gas
+    bumped = [len(row.tx_hashes or []) for row in our_rows(events)]
+    originals = {row.id: row.tx_hashes[0] for row in our_rows(events)}
+    chain.mine_all(pick=0)                           # ...but the original wins
+    tick()
+    problems = [f"row {row.id} not bumped before mining" for row, n in zip(our_rows(events), bumped) if n < 2]
+    problems += [f"row {row.id} confirmed with {row.tx_hash}, not the mined original"
+                 for row in our_rows(events) if row.state == 'confirmed' and row.tx_hash != originals[row.id]]
+    return problems
+
+def mined_during_bump(chain, events):
+    def land_original_first(chain, nonce):
+        # The bump of the oldest in-flight nonce races its own original
+        if nonce == chain.next_mined and nonce in chain.pool:
+            chain.mine(pick=0)
+    tick()
+    age_in_flight(events)
+    chain.before_send = land_original_first
+    counts = tick()                                  # every bump hits "nonce too low"
+    chain.before_send = None
+    problems = []
+    if counts["bumped"]:
+        problems.append(f"{counts['bumped']} bump(s) accepted although every original was mined first")
+    if counts["confirmed"] != len(events):
+        problems.append(f"{counts['confirmed']} of {len(events)} confirmed in the tick their bump was refused")
+    return problems
+
+def foreign_nonce(chain, events):
+    tick()
+    first = our_rows(events)[0]
+    taken = first.nonce
+    chain.mine_foreign()                             # someone else's tx gets our first nonce
+    age_in_flight(events)
+    tick()                                           # its bump is refused, it is re-queued and re-sent
+    chain.mine_all(pick=0)
+    tick()
+    age_in_flight(events)
+    tick()                                           # a bump after mining must not re-send anything
+    resent = db.session.get(LedgerOutbox, first.id)
+    problems = []
+    if resent.nonce == taken:
+        problems.append(f"row {resent.id} still confirmed under nonce {taken}, which a foreign tx took")
+    if chain.mined.get(taken) is not None:
+        problems.append(f"nonce {taken} should belong to the foreign transaction")
+    return problems
+
+def legacy_row(chain, events):
+    tick()
+    # Rows sent before tx_hashes existed only know their latest hash
+    originals = {}
+    for row in our_rows(events):
+        originals[row.id] = row.tx_hash
+        row.tx_hashes = None
+    db.session.commit()
+    age_in_flight(events)
+    tick()
+    chain.mine_all(pick=0)
+    tick()
+    return [f"legacy row {row.id} confirmed with {row.tx_hash}, not its original {originals[row.id]}"
+            for row in our_rows(events) if row.state == 'confirmed' and row.tx_hash != originals[row.id]]
+
+SCENARIOS = [mined_after_bump, mined_during_bump, foreign_nonce, legacy_row]
+
+def check(chain, events):
+    """
+    What must hold after any scenario, once everything sent has been mined.
+    """
+    problems = []
+    rows = our_rows(events)
+    for event in events:
+        matching = [row for row in rows if (row.task_id, row.status) == event]
+        confirmed = [row for row in matching if row.state == 'confirmed']
+        if len(matching) != 1 or len(confirmed) != 1:
+            problems.append(f"{event[0]}: {len(matching)} outbox row(s), {len(confirmed)} confirmed "
+                            f"(states {[row.state for row in matching]})")
+    for row in rows:
+        if row.state == 'confirmed' and chain.mined.get(row.nonce) != row.tx_hash:
+            problems.append(f"row {row.id} confirmed with {row.tx_hash} at nonce {row.nonce}, "
+                            f"chain mined {chain.mined.get(row.nonce)}")
+    nonces = [row.nonce for row in rows if row.state == 'confirmed']
+    if len(nonces) != len(set(nonces)):
+        problems.append(f"confirmed rows share nonces: {sorted(nonces)}")
+    for nonce, sent in sorted(chain.events.items()):
+        if len(sent) > 1:
+            problems.append(f"nonce {nonce} was sent for {len(sent)} different events: {sorted(sent)}")
+    for event in events:
+        # Sent under two nonces that could both be mined = recorded twice. Only
+        # a nonce that went to a foreign transaction may be given up on.
+        live = [nonce for nonce, sent in chain.events.items()
+                if event in sent and not (nonce in chain.mined and chain.mined[nonce] is None)]
+        if len(live) != 1:
+            problems.append(f"{event[0]} was sent under {len(live)} minable nonces: {sorted(live)}")
+
+    # Settled: more ticks, even with stale sent_at, send nothing new
+    sends = chain.sends
+    age_in_flight(events)
+    tick()
+    if chain.sends != sends:
+        problems.append(f"writer sent {chain.sends - sends} more transaction(s) after everything was mined")
+    return problems
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=4, help='events queued per scenario')
+    args = parser.parse_args()
+
+    app = create_app()
+    # Only after create_app(), so the background writer thread never starts
+    os.environ['BLOCKCHAIN_ENABLED'] = 'true'
+
+    failed = False
+    with app.app_context():
+        print(f"Database: {db.engine.dialect.name}")
+        busy = LedgerOutbox.query.filter(LedgerOutbox.state.in_(['pending', 'sent'])).count()
+        if busy:
+            print(f"Outbox has {busy} pending/in-flight row(s); run this against a scratch database")
+            sys.exit(2)
+
+        for scenario in SCENARIOS:
+            # Continue after whatever nonces the database already holds
+            highest = db.session.query(func.max(LedgerOutbox.nonce)).scalar()
+            chain = FakeChain(start_nonce=(highest + 1) if highest is not None else 0)
+            ledger_service.set_chain(chain)
+            events = queue_events(scenario.__name__, args.events)
+            try:
+                problems = scenario(chain, events) + check(chain, events)
+            finally:
+                for row in our_rows(events):
+                    db.session.delete(row)
+                db.session.commit()
+
+            print(f"{scenario.__name__}: {chain.sends} broadcast(s) for {len(events)} events, "
+                  f"nonces {sorted(chain.events)}, {'FAIL' if problems else 'ok'}")
+            for problem in problems:
+                print(f"  {problem}")
+            failed = failed or bool(problems)
+
+    if failed:
+        sys.exit(1)
+    print("OK: every event confirmed exactly once, no nonce reused")
@@ -0,0 +1,90 @@
+"""
+Prints the query plan for every hot query the orchestrator runs, so a
+missing or unused index shows up as a sequential scan.
+
+    DATABASE_URL=postgresql://... python scripts/explain_hot_queries.py
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, func
+from app import create_app
+from app.models import db, Task, Provider, GpuSlot, Job, TaskDependency
+from app.scheduler_service import lanes_query, QUEUE_STATS_SAMPLE
+
+def hot_queries():
+    stale_limit = datetime.utcnow() - timedelta(minutes=10)
+    live_providers = select(Provider.id).where(Provider.last_seen >= stale_limit)
+    return {
+        "FIFO queue head (provider_get_task)":
+            select(Task.id).where(Task.status == 'QUEUED').order_by(Task.submission_time).limit(1),
+        "User task list (get_user_tasks)":
+            select(Task).where(Task.user_id == 'user_x').order_by(Task.submission_time.desc()),
+        "Stale RUNNING sweep":
+            select(Task.id).where(Task.status == 'RUNNING', Task.last_update < stale_limit),
+        "Reaper: RUNNING tasks on dead providers":
+            select(Task.id).where(Task.status == 'RUNNING', Task.provider_id.not_in(live_providers)),
+        "Reaper: RUNNING tasks with an expired lease":
+            select(Task.id).where(Task.status == 'RUNNING', Task.lease_expires_at < stale_limit),
+        "Lease renewal (heartbeat flush)":
+            select(Task.id).where(Task.lease_id.in_(['lease_x', 'lease_y']), Task.status == 'RUNNING'),
+        "Tasks by provider":
+            select(Task.id).where(Task.provider_id == 'provider_x'),
+        "Devices by owner (get_my_devices)":
+            select(Provider).where(Provider.user_id == 'user_x'),
+        "Idle slot on provider (provider_get_task)":
+            select(GpuSlot.id).where(GpuSlot.provider_id == 'provider_x', GpuSlot.status == 'idle').limit(1),
+        "Queued requirement classes (scheduler)":
+            select(Task.req_gpu_memory_mb, Task.req_gpu_count, Task.req_cpu_cores, Task.req_ram_mb,
+                   Task.req_cuda_capability, func.min(Task.submission_time))
+            .where(Task.status == 'QUEUED')
+            .group_by(Task.req_gpu_memory_mb, Task.req_gpu_count, Task.req_cpu_cores, Task.req_ram_mb,
+                      Task.req_cuda_capability),
+        "Queued lanes (fair-share scheduler)":
+            lanes_query().params(provider_id='provider_x', now=datetime.utcnow()),
+        "Running tasks per user (fair share)":
+            select(Task.user_id, func.count(Task.id)).where(Task.status == 'RUNNING').group_by(Task.user_id),
+        "Tasks started in the stats window (queue_stats)":
+            select(Task.user_id, Task.submission_time, Task.start_time, Task.speculative_of)
+            .where(Task.start_time >= stale_limit)
+            .order_by(Task.start_time.desc()).limit(QUEUE_STATS_SAMPLE),
+        "FIFO head of one class (scheduler)":
+            select(Task.id).where(Task.status == 'QUEUED', Task.req_gpu_memory_mb == 16384, Task.req_gpu_count == 1,
+                                  Task.req_cpu_cores == 0, Task.req_ram_mb == 0, Task.req_cuda_capability == 0)
+            .order_by(Task.submission_time).limit(1),
+        "Idle slots with enough VRAM (explain_unscheduled)":
+            select(GpuSlot.provider_id).where(GpuSlot.status == 'idle', GpuSlot.memory_mb >= 16000),
+        "Job progress counts (sweep_service)":
+            select(Task.job_id, Task.status, func.count()).where(Task.job_id.in_(['job_x']))
+            .group_by(Task.job_id, Task.status),
+        "Jobs by owner (get_user_jobs)":
+            select(Job).where(Job.user_id == 'user_x').order_by(Job.created_at.desc()).limit(100),
+        "Children of a completed parent (dependency release)":
+            select(Task.id).where(Task.id.in_(select(TaskDependency.task_id)
+                                              .where(TaskDependency.parent_id == 'task_x')),
+                                  Task.status == 'BLOCKED'),
+        "Parents of claimed tasks (input artifacts)":
+            select(TaskDependency.parent_id).where(TaskDependency.task_id.in_(['task_x', 'task_y']))
+            .order_by(TaskDependency.task_id, TaskDependency.position),
+        "Fleet idle capacity":
+            select(GpuSlot.provider_id, func.count(GpuSlot.id)).where(GpuSlot.status == 'idle').group_by(GpuSlot.provider_id),
+    }
+
+def explain(query):
+    dialect = db.engine.dialect
+    sql = str(query.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    prefix = "EXPLAIN" if dialect.name == 'postgresql' else "EXPLAIN QUERY PLAN"
+    rows = db.session.execute(db.text(f"{prefix} {sql}")).all()
+    # Postgres returns one text column; SQLite returns (id, parent, notused, detail)
+    return [row[-1] for row in rows]
+
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        for label, query in hot_queries().items():
+            print(f"\n=== {label} ===")
+            for line in explain(query):
+                print(f"  {line}")
@@ -0,0 +1,123 @@
+"""
+Batch tail latency with and without speculative copies for stragglers.
+
+    python scripts/simulate_stragglers.py --fast 4 --slow-speed 0.1 --tasks 16 --seconds 0.25
+
+Runs against a scratch database (DATABASE_URL, or the local SQLite
+fallback). Registers a few fast simulated providers and one slow one,
+submits a speculative batch through the Flask test client and plays the
+agents: each claims work, "runs" it for --seconds divided by its speed and
+reports COMPLETED with its lease. The straggler scan the reaper does is
+called every tick. The batch runs once with SPECULATION_FACTOR=0 and once
+with speculation on, then prints when its last task finished for each.
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+from sqlalchemy import select
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Presigning is local, nothing gets uploaded; any values do
+for name, value in [('R2_ENDPOINT_URL', 'https://r2.invalid'), ('R2_ACCESS_KEY_ID', 'sim'),
+                    ('R2_SECRET_ACCESS_KEY', 'sim'), ('R2_BUCKET_NAME', 'sim')]:
+    os.environ.setdefault(name, value)
+
+from app import create_app
+from app import heartbeat_service, speculation_service
+from app.models import db, User, Task, TaskEvent, Provider, GpuSlot
+
+API_KEY = 'sim-provider-key'
+USER_ID = 'sim-user'
+TICK_SECONDS = 0.02
+
+def run(app, speeds, tasks, seconds, factor):
+    speculation_service.SPECULATION_FACTOR = factor
+    client = app.test_client()
+    headers = {'X-API-Key': API_KEY}
+    batch_id = f"sim-{uuid.uuid4().hex[:8]}"
+
+    for i in range(tasks):
+        r = client.post('/consumer/submit_task', headers=headers,
+                        json={'clerk_id': USER_ID, 'batch_id': batch_id, 'speculative': True,
+                              'env_vars': {'SIM_INDEX': i}})
+        assert r.status_code == 200, r.get_data(as_text=True)
+
+    start = time.perf_counter()
+    running = {}  # provider_id -> (task_id, lease_id, done_at)
+    copies = 0
+    while True:
+        now = time.perf_counter()
+        for provider_id, speed in speeds.items():
+            if provider_id in running:
+                task_id, lease_id, done_at = running[provider_id]
+                # Stands in for the 409 a cancelled copy's agent gets on its next report
+                if db.session.get(Task, task_id).status == 'CANCELLED':
+                    del running[provider_id]
+                elif now >= done_at:
+                    client.post('/provider/task_update', headers=headers,
+                                json={'task_id': task_id, 'status': 'COMPLETED', 'lease_id': lease_id})
+                    del running[provider_id]
+            if provider_id not in running:
+                r = client.post('/provider/get_task', headers=headers, json={'provider_id': provider_id})
+                task = r.get_json().get('task')
+                if task:
+                    running[provider_id] = (task['task_id'], task['lease_id'], now + seconds / speed)
+
+        copies += speculation_service.launch_copies()
+        db.session.commit()
+
+        left = Task.query.filter(Task.batch_id == batch_id, Task.speculative_of.is_(None),
+                                 Task.status.in_(('QUEUED', 'RUNNING'))).count()
+        if not left:
+            break
+        db.session.expire_all()
+        time.sleep(TICK_SECONDS)
+
+    elapsed = time.perf_counter() - start
+    batch = select(Task.id).where(Task.batch_id == batch_id)
+    TaskEvent.query.filter(TaskEvent.task_id.in_(batch)).delete(synchronize_session=False)
+    Task.query.filter(Task.batch_id == batch_id).delete(synchronize_session=False)
+    db.session.commit()
+    return elapsed, copies
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fast', type=int, default=4, help='fast providers (speed 1.0)')
+    parser.add_argument('--slow-speed', type=float, default=0.1, help='relative speed of the one slow provider')
+    parser.add_argument('--tasks', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=0.25, help='task runtime on a fast provider')
+    parser.add_argument('--factor', type=float, default=2.0, help='SPECULATION_FACTOR for the second run')
+    args = parser.parse_args()
+
+    os.environ['ORCHESTRATOR_API_KEY_PROVIDERS'] = API_KEY
+    os.environ['ORCHESTRATOR_API_KEY_CONSUMERS'] = API_KEY
+    app = create_app()
+    speeds = {f"sim-fast-{i}": 1.0 for i in range(args.fast)}
+    speeds["sim-slow-0"] = args.slow_speed
+
+    with app.app_context():
+        if not db.session.get(User, USER_ID):
+            db.session.add(User(id=USER_ID, email=f"{USER_ID}@example.invalid"))
+            db.session.commit()
+        client = app.test_client()
+        for provider_id in speeds:
+            r = client.post('/provider/register', headers={'X-API-Key': API_KEY},
+                            json={'provider_id': provider_id,
+                                  'gpus': [{'id': 'gpu-0', 'name': 'Sim GPU', 'memory_mb': 24576}]})
+            assert r.status_code == 200, r.get_data(as_text=True)
+
+        results = {}
+        for label, factor in [("no speculation", 0), ("speculation", args.factor)]:
+            results[label], copies = run(app, speeds, args.tasks, args.seconds, factor)
+            print(f"{label:>15}: last task done after {results[label]:6.2f}s  ({copies} speculative copies)")
+
+        print(f"{'tail cut':>15}: {1 - results['speculation'] / results['no speculation']:6.0%}")
+
+        heartbeat_service.flush()
+        GpuSlot.query.filter(GpuSlot.provider_id.in_(list(speeds))).delete(synchronize_session=False)
+        Provider.query.filter(Provider.id.in_(list(speeds))).delete(synchronize_session=False)
+        db.session.commit()
@@ -0,0 +1,143 @@
+"""
+Hammers the claim path from many threads and checks that no task is ever
+handed out twice.
+
+    python scripts/stress_claims.py --providers 32 --tasks 1000 --threads 32
+    DATABASE_URL=postgresql://localhost/matcha DATABASE_SSLMODE=disable \
+        python scripts/stress_claims.py --max-tasks 4
+
+Runs against a scratch database (DATABASE_URL, or the local SQLite
+fallback). Registers --providers simulated providers with --gpus GPUs each,
+queues --tasks tasks, then lets --threads threads poll /provider/get_task
+for those providers at the same time through the Flask test client. Every
+claim is reported COMPLETED straight away, which frees its GPU for the next
+poll. Exits non-zero if a task id was assigned more than once, a task was
+never assigned, or a task ended up with more than one attempt.
+"""
+import argparse
+import collections
+import os
+import sys
+import threading
+import time
+import uuid
+
+from sqlalchemy import select
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Presigning is local, nothing gets uploaded; any values do
+for name, value in [('R2_ENDPOINT_URL', 'https://r2.invalid'), ('R2_ACCESS_KEY_ID', 'stress'),
+                    ('R2_SECRET_ACCESS_KEY', 'stress'), ('R2_BUCKET_NAME', 'stress')]:
+    os.environ.setdefault(name, value)
+
+from app import create_app
+from app import heartbeat_service
+from app.models import db, User, Task, TaskEvent, Provider, GpuSlot
+
+API_KEY = 'stress-key'
+USER_ID = 'stress-user'
+
+def run(app, provider_ids, task_ids, threads, max_tasks, timeout):
+    headers = {'X-API-Key': API_KEY}
+    assigned = []  # (task_id, provider_id) for every assignment handed out, duplicates included
+    errors = collections.Counter()
+    lock = threading.Lock()
+    deadline = time.monotonic() + timeout
+
+    def done():
+        with lock:
+            return len({task_id for task_id, _ in assigned}) >= len(task_ids)
+
+    def worker(mine):
+        client = app.test_client()
+        while not done() and time.monotonic() < deadline:
+            for provider_id in mine:
+                r = client.post('/provider/get_task', headers=headers,
+                                json={'provider_id': provider_id, 'max_tasks': max_tasks})
+                if r.status_code != 200:
+                    errors[f"get_task {r.status_code}"] += 1  # e.g. SQLite "database is locked"; just poll again
+                    continue
+                claims = r.get_json().get('tasks') or []
+                with lock:
+                    assigned.extend((a['task_id'], provider_id) for a in claims)
+                for a in claims:
+                    r = client.post('/provider/task_update', headers=headers,
+                                    json={'task_id': a['task_id'], 'status': 'COMPLETED', 'lease_id': a['lease_id']})
+                    if r.status_code != 200:
+                        errors[f"task_update {r.status_code}"] += 1
+
+    workers = [threading.Thread(target=worker, args=(provider_ids[n::threads],)) for n in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return assigned, errors, time.perf_counter() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--providers', type=int, default=32)
+    parser.add_argument('--gpus', type=int, default=1, help='GPUs per provider')
+    parser.add_argument('--tasks', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--max-tasks', type=int, default=1, help='max_tasks per get_task (batch claims)')
+    parser.add_argument('--timeout', type=float, default=300, help='give up after this many seconds')
+    args = parser.parse_args()
+
+    os.environ['ORCHESTRATOR_API_KEY_PROVIDERS'] = API_KEY
+    os.environ['ORCHESTRATOR_API_KEY_CONSUMERS'] = API_KEY
+    app = create_app()
+    run_id = uuid.uuid4().hex[:8]
+    provider_ids = [f"stress-{run_id}-{i}" for i in range(args.providers)]
+    batch_id = f"stress-{run_id}"
+
+    with app.app_context():
+        print(f"Database: {db.engine.dialect.name}")
+        if not db.session.get(User, USER_ID):
+            db.session.add(User(id=USER_ID, email=f"{USER_ID}@example.invalid"))
+            db.session.commit()
+        client = app.test_client()
+        for provider_id in provider_ids:
+            r = client.post('/provider/register', headers={'X-API-Key': API_KEY},
+                            json={'provider_id': provider_id,
+                                  'gpus': [{'id': f'gpu-{g}', 'name': 'Stress GPU', 'memory_mb': 24576}
+                                           for g in range(args.gpus)]})
+            assert r.status_code == 200, r.get_data(as_text=True)
+        task_ids = []
+        for i in range(args.tasks):
+            r = client.post('/consumer/submit_task', headers={'X-API-Key': API_KEY},
+                            json={'clerk_id': USER_ID, 'batch_id': batch_id, 'env_vars': {'STRESS_INDEX': i}})
+            assert r.status_code == 200, r.get_data(as_text=True)
+            task_ids.append(r.get_json()['task_id'])
+
+        assigned, errors, elapsed = run(app, provider_ids, task_ids, args.threads, args.max_tasks, args.timeout)
+
+        counts = collections.Counter(task_id for task_id, _ in assigned)
+        duplicates = {task_id: n for task_id, n in counts.items() if n > 1}
+        missing = set(task_ids) - set(counts)
+        db.session.expire_all()
+        retried = db.session.execute(
+            select(Task.id).where(Task.batch_id == batch_id, Task.attempts != 1)
+        ).scalars().all()
+
+        print(f"{len(assigned)} assignments of {len(task_ids)} tasks to {len(provider_ids)} providers "
+              f"from {args.threads} threads in {elapsed:.1f}s ({len(assigned) / elapsed:.0f} claims/s)")
+        if errors:
+            print(f"Errors (retried): {dict(errors)}")
+        print(f"Duplicate assignments: {len(duplicates)}, never assigned: {len(missing)}, "
+              f"attempts != 1: {len(retried)}")
+        for task_id, n in list(duplicates.items())[:10]:
+            print(f"  {task_id} assigned {n} times to {[p for t, p in assigned if t == task_id]}")
+
+        heartbeat_service.flush()
+        batch = select(Task.id).where(Task.batch_id == batch_id)
+        TaskEvent.query.filter(TaskEvent.task_id.in_(batch)).delete(synchronize_session=False)
+        Task.query.filter(Task.batch_id == batch_id).delete(synchronize_session=False)
+        GpuSlot.query.filter(GpuSlot.provider_id.in_(provider_ids)).delete(synchronize_session=False)
+        Provider.query.filter(Provider.id.in_(provider_ids)).delete(synchronize_session=False)
+        db.session.commit()
+
+        if duplicates or missing or retried:
+            sys.exit(1)
+        print("OK: every task was claimed exactly once")
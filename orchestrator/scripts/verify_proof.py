@@ -0,0 +1,64 @@
+"""
+Offline check of a task's ledger inclusion proofs.
+
+    curl -s -H "X-API-Key: $KEY" $API/consumer/task_status/<task_id> > status.json
+    python scripts/verify_proof.py status.json
+    python scripts/verify_proof.py status.json --rpc https://sepolia.base.org   # also check the root on-chain
+
+Accepts either the whole task_status response or a single proof object.
+Exits non-zero if any proof fails.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.merkle import verify
+
+def load_proofs(source):
+    data = json.load(sys.stdin if source == '-' else open(source))
+    if isinstance(data, dict) and 'ledger_proofs' in data:
+        return data['ledger_proofs']
+    return data if isinstance(data, list) else [data]
+
+def root_on_chain(rpc_url, tx_hash):
+    # Only this optional check needs web3 and a network connection
+    from web3 import Web3
+    base_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app')
+    with open(os.path.join(base_dir, 'contract_abi.json')) as f:
+        abi = json.load(f)
+    w3 = Web3(Web3.HTTPProvider(rpc_url))
+    tx = w3.eth.get_transaction(tx_hash)
+    _, args = w3.eth.contract(abi=abi).decode_function_input(tx['input'])
+    # Anchors are written as recordTask("anchor-<id>", "merkle-root:0x<root>")
+    return list(args.values())[1].split('merkle-root:0x', 1)[-1]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', help="JSON file from /consumer/task_status, or - for stdin")
+    parser.add_argument('--rpc', help="Also confirm each root against its anchor transaction")
+    args = parser.parse_args()
+
+    proofs = load_proofs(args.source)
+    if not proofs:
+        print("No ledger proofs in input (is LEDGER_MODE=anchor, and has the window closed?)")
+        sys.exit(1)
+
+    ok = True
+    for p in proofs:
+        included = verify(p['leaf'], p['proof'], p['root'])
+        line = f"{'OK  ' if included else 'FAIL'} {p['status']:<30} root {p['root'][:16]}…"
+        if included and args.rpc:
+            if not p.get('anchor_tx_hash'):
+                included = False
+                line += "  (anchor not sent yet)"
+            else:
+                on_chain = root_on_chain(args.rpc, p['anchor_tx_hash'])
+                included = on_chain == p['root']
+                line += f"  on-chain {'match' if included else 'MISMATCH'} in {p['anchor_tx_hash']}"
+        print(line)
+        ok = ok and included
+
+    sys.exit(0 if ok else 1)
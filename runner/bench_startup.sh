@@ -0,0 +1,68 @@
+#!/bin/bash
+set -e
+
+# Cold vs warm task start-up with the provider cache (MATCHA_CACHE_DIR).
+#
+#   ./bench_startup.sh                 # runs ruasnv/matcha-runner:latest in Docker
+#   IMAGE=my/runner ./bench_startup.sh
+#   LOCAL=1 ./bench_startup.sh         # runs entrypoint.sh directly, no Docker
+#
+# Builds a sample project whose requirements.txt pulls a few wheels, serves
+# it over HTTP, then times: no cache, cold cache, and N warm runs.
+
+IMAGE="${IMAGE:-ruasnv/matcha-runner:latest}"
+WARM_RUNS="${WARM_RUNS:-3}"
+PORT="${PORT:-8765}"
+REQUIREMENTS="${REQUIREMENTS:-scikit-learn
+matplotlib}"
+HERE="$(cd "$(dirname "$0")" && pwd)"
+
+WORK=$(mktemp -d)
+trap 'kill $SERVER_PID 2>/dev/null; rm -rf "$WORK"' EXIT
+
+# 1. Sample project, served like R2 would serve it
+mkdir -p "$WORK/src"
+echo "print('first output')" > "$WORK/src/main.py"
+echo "$REQUIREMENTS" > "$WORK/src/requirements.txt"
+(cd "$WORK/src" && zip -q ../project.zip main.py requirements.txt)
+DIGEST=$(sha256sum "$WORK/project.zip" | cut -d' ' -f1)
+(cd "$WORK" && exec python3 -m http.server "$PORT" >/dev/null 2>&1) &
+SERVER_PID=$!
+sleep 1
+URL="http://127.0.0.1:$PORT/project.zip"
+
+time_task() {
+    local label="$1" cache="$2" ws start
+    ws=$(mktemp -d -p "$WORK")
+    if [ -n "$LOCAL" ]; then
+        local path="$PATH"
+        if [ -z "$cache" ]; then
+            # Stand-in for a fresh container: installs go into a throwaway venv
+            python3 -m venv "$ws.venv"
+            path="$ws.venv/bin:$PATH"
+        fi
+        start=$(date +%s%N)
+        (cd "$ws" && PATH="$path" PROJECT_URL="$URL" PROJECT_DIGEST="$DIGEST" SCRIPT_PATH=main.py \
+            MATCHA_CACHE_DIR="$cache" bash "$HERE/entrypoint.sh") >"$ws.log" 2>&1 || true
+    else
+        local mount=()
+        [ -n "$cache" ] && mount=(-v "$cache:/cache" -e MATCHA_CACHE_DIR=/cache)
+        start=$(date +%s%N)
+        docker run --rm --network host "${mount[@]}" \
+            -e PROJECT_URL="$URL" -e PROJECT_DIGEST="$DIGEST" -e SCRIPT_PATH=main.py \
+            "$IMAGE" >"$ws.log" 2>&1 || true
+    fi
+    local ms=$(( ($(date +%s%N) - start) / 1000000 ))
+    grep -q "first output" "$ws.log" || { cat "$ws.log"; exit 1; }
+    printf "%-12s %4d.%02ds\n" "$label" $((ms / 1000)) $((ms % 1000 / 10))
+}
+
+CACHE="$WORK/cache"
+mkdir -p "$CACHE"
+
+echo "Project $DIGEST ($(echo "$REQUIREMENTS" | tr '\n' ' '))"
+time_task "no cache" ""
+time_task "cold cache" "$CACHE"
+for i in $(seq 1 "$WARM_RUNS"); do
+    time_task "warm #$i" "$CACHE"
+done
@@ -1,12 +1,137 @@
 #!/bin/bash
 set -e
 
-echo "📥 Downloading project from R2..."
-curl -L "$PROJECT_URL" -o project.zip
+# Optional provider-side cache, mounted by the agent (e.g. -v matcha-cache:/cache
+# -e MATCHA_CACHE_DIR=/cache). Shared by every task on the provider:
+#   projects/<digest>.zip  project ZIPs, keyed by PROJECT_DIGEST (sha256)
+#   venvs/<hash>/          virtualenvs, keyed by sha256 of requirements.txt
+#   pip/                   pip's wheel/http cache for building new venvs
+# Entries are evicted least-recently-used once the cache exceeds
+# MATCHA_CACHE_MAX_MB; pip/ counts as one entry, touched by every venv build
+# (it is only read while building, so dropping it costs a re-download at
+# worst). Without MATCHA_CACHE_DIR nothing changes.
+CACHE_DIR="${MATCHA_CACHE_DIR:-}"
+CACHE_MAX_MB="${MATCHA_CACHE_MAX_MB:-20480}"
+
+# Take a shared lock on a cache entry for the rest of the task, so eviction
+# in a concurrent runner leaves it alone
+hold_entry() {
+    local fd
+    exec {fd}>"$CACHE_DIR/locks/$1.lock"
+    flock -s "$fd"
+}
+
+evict_cache() {
+    local used_kb limit_kb entry name size_kb fd
+    limit_kb=$((CACHE_MAX_MB * 1024))
+    used_kb=$(du -sk "$CACHE_DIR/projects" "$CACHE_DIR/venvs" "$CACHE_DIR/pip" 2>/dev/null | awk '{s+=$1} END {print s+0}')
+    [ "$used_kb" -le "$limit_kb" ] && return 0
+
+    # Oldest first (entries are touched on every use)
+    while read -r entry; do
+        [ "$used_kb" -le "$limit_kb" ] && break
+        name=$(basename "$entry")
+        exec {fd}>"$CACHE_DIR/locks/$name.lock"
+        # Skip entries another task is using right now
+        if flock -n -x "$fd"; then
+            size_kb=$(du -sk "$entry" | cut -f1)
+            rm -rf "$entry"
+            used_kb=$((used_kb - size_kb))
+            echo "🧹 Evicted $name from cache (${size_kb} KB)"
+        fi
+        exec {fd}>&-
+    done < <(ls -1dtr "$CACHE_DIR"/projects/* "$CACHE_DIR"/venvs/* "$CACHE_DIR/pip" 2>/dev/null)
+}
+
+fetch_project() {
+    if [ -n "$CACHE_DIR" ] && [ -n "$PROJECT_DIGEST" ]; then
+        local cached="$CACHE_DIR/projects/$PROJECT_DIGEST.zip"
+        hold_entry "$PROJECT_DIGEST.zip"
+        if [ -f "$cached" ]; then
+            echo "♻️ Project $PROJECT_DIGEST found in cache"
+            touch "$cached"
+        else
+            echo "📥 Downloading project from R2 (caching by digest)..."
+            local tmp="$cached.$$.part"
+            curl -fL "$PROJECT_URL" -o "$tmp"
+            # Content-addressed: never cache bytes that don't match their name
+            if [ "$(sha256sum "$tmp" | cut -d' ' -f1)" != "$PROJECT_DIGEST" ]; then
+                rm -f "$tmp"
+                echo "❌ ERROR: Downloaded project does not match digest $PROJECT_DIGEST"
+                exit 1
+            fi
+            mv -f "$tmp" "$cached"
+        fi
+        cp "$cached" project.zip
+    else
+        echo "📥 Downloading project from R2..."
+        curl -L "$PROJECT_URL" -o project.zip
+    fi
+}
+
+install_requirements() {
+    local req="$1"
+    if [ -z "$CACHE_DIR" ]; then
+        pip install --no-cache-dir -r "$req"
+        return
+    fi
+
+    # Same requirements on the same image -> same venv. The base image's
+    # research stack stays visible through --system-site-packages.
+    local key venv fd pip_fd
+    key=$( (python3 --version; cat "$req") | sha256sum | cut -c1-32)
+    venv="$CACHE_DIR/venvs/$key"
+    hold_entry "$key"
+
+    if [ ! -f "$venv/.ready" ]; then
+        # One builder per key; others wait here and then reuse its venv
+        exec {fd}>"$CACHE_DIR/locks/$key.build"
+        flock -x "$fd"
+        if [ ! -f "$venv/.ready" ]; then
+            echo "📦 Building cached environment $key..."
+            rm -rf "$venv"
+            python3 -m venv --system-site-packages "$venv"
+            # Shared lock for the build only: eviction may drop pip/ any time after
+            exec {pip_fd}>"$CACHE_DIR/locks/pip.lock"
+            flock -s "$pip_fd"
+            mkdir -p "$CACHE_DIR/pip"
+            touch "$CACHE_DIR/pip"
+            "$venv/bin/pip" install --cache-dir "$CACHE_DIR/pip" -r "$req"
+            exec {pip_fd}>&-
+            touch "$venv/.ready"
+        fi
+        exec {fd}>&-
+    else
+        echo "♻️ Reusing cached environment $key"
+    fi
+    touch "$venv"
+    export VIRTUAL_ENV="$venv"
+    export PATH="$venv/bin:$PATH"
+}
+
+if [ -n "$CACHE_DIR" ]; then
+    mkdir -p "$CACHE_DIR/projects" "$CACHE_DIR/venvs" "$CACHE_DIR/pip" "$CACHE_DIR/locks"
+fi
+
+fetch_project
 
 echo "📂 Unzipping research code..."
 unzip -o project.zip
 
+# Artifacts of the tasks this one depends on (e.g. the shards of a reduce
+# step), in order: inputs/0/, inputs/1/, ...
+if [ -n "${INPUT_ARTIFACTS:-}" ]; then
+    echo "📥 Downloading input artifacts..."
+    i=0
+    for url in $INPUT_ARTIFACTS; do
+        mkdir -p "inputs/$i"
+        curl -fL "$url" -o "inputs/$i.zip"
+        unzip -oq "inputs/$i.zip" -d "inputs/$i"
+        rm -f "inputs/$i.zip"
+        i=$((i + 1))
+    done
+fi
+
 # Find the actual path of the script automatically
 ACTUAL_SCRIPT_PATH=$(find . -maxdepth 2 -name "${SCRIPT_PATH:-main.py}" | head -n 1)
 
@@ -23,8 +148,19 @@ echo "🎯 Found script at: $ACTUAL_SCRIPT_PATH"
 REQ_PATH=$(find . -maxdepth 2 -name "requirements.txt" | head -n 1)
 if [ -n "$REQ_PATH" ]; then
     echo "📦 Found dependencies at $REQ_PATH. Installing..."
-    pip install --no-cache-dir -r "$REQ_PATH"
+    install_requirements "$REQ_PATH"
+fi
+
+if [ -n "$CACHE_DIR" ]; then
+    evict_cache
+fi
+
+# Warm-pool mode (warm_worker.py): stop here and report what to run; the
+# worker executes the script in its already-initialised interpreter
+if [ -n "$MATCHA_PREPARE_OUT" ]; then
+    printf 'SCRIPT=%s\nVENV=%s\n' "$(realpath "$ACTUAL_SCRIPT_PATH")" "${VIRTUAL_ENV:-}" > "$MATCHA_PREPARE_OUT"
+    exit 0
 fi
 
 echo "🚀 Starting Python execution..."
-python3 "$ACTUAL_SCRIPT_PATH"
\ No newline at end of file
+python3 "$ACTUAL_SCRIPT_PATH"
@@ -0,0 +1,332 @@
+"""
+Provider-side warm pool of matcha-runner containers (see warm_worker.py).
+
+Keeps `size` containers booted and idle, each with the research stack already
+imported. A task is handed to an idle worker over its Unix socket (in a host
+directory mounted at /pool) and its output streams straight back; the pool
+then tops itself up in the background. The provider agent uses it like:
+
+    pool = WarmPool(size=2)
+    pool.start()
+    code = pool.run_task(env, owner=task_user_id, out=sys.stdout.buffer)
+
+and benchmark the difference in submit-to-first-output latency with
+
+    python warm_pool.py --bench                 # Docker
+    python warm_pool.py --bench --local         # workers as local processes
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+EXIT_MARKER = b'__MATCHA_EXIT__'
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class Worker:
+    def __init__(self, name, pool_dir, handle):
+        self.name = name
+        self.pool_dir = pool_dir
+        self.handle = handle  # docker container name or local Popen
+        self.owner = None
+        self.tasks = 0
+
+    @property
+    def socket_path(self):
+        return os.path.join(self.pool_dir, 'worker.sock')
+
+    def ready(self):
+        return os.path.exists(self.socket_path)
+
+class WarmPool:
+    def __init__(self, size=2, image='ruasnv/matcha-runner:latest', policy='recycle',
+                 cache_dir=None, gpus='all', local=False, root=None, preload=None):
+        self.size = size
+        self.image = image
+        self.policy = policy
+        self.cache_dir = cache_dir
+        self.gpus = gpus
+        self.local = local
+        self.preload = preload  # MATCHA_PRELOAD for the workers; None keeps the image's default
+        self.root = root or tempfile.mkdtemp(prefix='matcha-pool-')
+        self._lock = threading.Condition()
+        self._idle = []
+        self._booting = 0
+        self._stopped = False
+
+    # --- lifecycle ---
+
+    def start(self):
+        self._top_up()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            workers, self._idle = self._idle, []
+            # Booting workers notice _stopped and tear themselves down
+            self._lock.wait_for(lambda: self._booting == 0, 30)
+        for worker in workers:
+            self._destroy(worker)
+
+    def _top_up(self):
+        with self._lock:
+            missing = self.size - len(self._idle) - self._booting
+            if self._stopped or missing <= 0:
+                return
+            self._booting += missing
+        for _ in range(missing):
+            threading.Thread(target=self._boot, daemon=True).start()
+
+    def _boot(self):
+        name = f"matcha-warm-{uuid.uuid4().hex[:8]}"
+        pool_dir = os.path.join(self.root, name)
+        os.makedirs(pool_dir)
+        env = {'MATCHA_POOL_POLICY': self.policy, 'MATCHA_POOL_SOCKET': '/pool/worker.sock'}
+        if self.preload is not None:
+            env['MATCHA_PRELOAD'] = self.preload
+        worker = None
+        try:
+            if self.local:
+                env.update(MATCHA_POOL_SOCKET=os.path.join(pool_dir, 'worker.sock'),
+                           MATCHA_ENTRYPOINT=os.path.join(HERE, 'entrypoint.sh'),
+                           MATCHA_WORKSPACE_ROOT=os.path.join(pool_dir, 'workspace'))
+                if self.cache_dir:
+                    env['MATCHA_CACHE_DIR'] = self.cache_dir
+                handle = subprocess.Popen([sys.executable, os.path.join(HERE, 'warm_worker.py')],
+                                          env={**os.environ, **env}, stdout=subprocess.DEVNULL)
+            else:
+                cmd = ['docker', 'run', '-d', '--rm', '--name', name, '-v', f'{pool_dir}:/pool']
+                if self.gpus:
+                    cmd += ['--gpus', self.gpus]
+                if self.cache_dir:
+                    cmd += ['-v', f'{self.cache_dir}:/cache', '-e', 'MATCHA_CACHE_DIR=/cache']
+                for key, value in env.items():
+                    cmd += ['-e', f'{key}={value}']
+                cmd += ['--entrypoint', 'python3', self.image, '/warm_worker.py']
+                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+                handle = name
+            worker = Worker(name, pool_dir, handle)
+
+            # Ready once the worker has finished preloading and bound its socket
+            while not worker.ready():
+                if self._stopped or not self._alive(worker):
+                    raise RuntimeError(f"worker {name} exited while booting")
+                time.sleep(0.05)
+        except Exception as e:
+            if not self._stopped:
+                print(f"⚠️ Warm pool boot failed: {e}", file=sys.stderr)
+            if worker is not None:
+                self._destroy(worker)
+            shutil.rmtree(pool_dir, ignore_errors=True)
+            self._boot_done()
+            return
+
+        with self._lock:
+            if not self._stopped:
+                self._idle.append(worker)
+                self._booting -= 1
+                self._lock.notify_all()
+                return
+        # stop() waits on _booting: tear down first, so nothing outlives the pool
+        self._destroy(worker)
+        self._boot_done()
+
+    def _boot_done(self):
+        with self._lock:
+            self._booting -= 1
+            self._lock.notify_all()
+
+    def _alive(self, worker):
+        if self.local:
+            return worker.handle.poll() is None
+        result = subprocess.run(['docker', 'inspect', '-f', '{{.State.Running}}', worker.handle],
+                                capture_output=True, text=True)
+        return result.stdout.strip() == 'true'
+
+    def _destroy(self, worker):
+        if self.local:
+            worker.handle.kill()
+            worker.handle.wait()
+        else:
+            subprocess.run(['docker', 'rm', '-f', worker.handle], capture_output=True)
+        shutil.rmtree(worker.pool_dir, ignore_errors=True)
+
+    # --- tasks ---
+
+    def _acquire(self, owner, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            foreign = None
+            with self._lock:
+                # Prefer a reusable worker already tied to this owner, then a fresh one
+                for worker in sorted(self._idle, key=lambda w: w.owner != owner):
+                    if worker.owner in (None, owner):
+                        self._idle.remove(worker)
+                        return worker
+                if self._idle and self._booting == 0:
+                    # Only other owners' workers are idle: retire one to make room
+                    foreign = self._idle.pop(0)
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self._lock.wait(remaining)
+            if foreign is not None:
+                self._destroy(foreign)
+                self._top_up()
+
+    def run_task(self, env, owner=None, out=None, timeout=60):
+        """
+        Runs one task on a warm worker and returns its exit code, or None if
+        no worker became idle within `timeout` (the caller falls back to a cold run).
+        """
+        out = out or sys.stdout.buffer
+        worker = self._acquire(owner, timeout)
+        if worker is None:
+            return None
+        if self.policy != 'reuse':
+            # This worker won't come back: start its replacement right away
+            self._top_up()
+
+        code = 1
+        tail = b''
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                conn.connect(worker.socket_path)
+                conn.sendall(json.dumps({"env": env}).encode() + b'\n')
+                while True:
+                    chunk = conn.recv(65536)
+                    if not chunk:
+                        break
+                    data = tail + chunk
+                    marker = data.find(b'\n' + EXIT_MARKER)
+                    if marker >= 0:
+                        out.write(data[:marker])
+                        tail = data[marker:]
+                        continue
+                    # Only hold back a trailing fragment that could be the marker's start
+                    cut = data.rfind(b'\n')
+                    if cut < 0 or not (b'\n' + EXIT_MARKER).startswith(data[cut:]):
+                        cut = len(data)
+                    out.write(data[:cut])
+                    tail = data[cut:]
+                    out.flush()
+            marker = tail.find(EXIT_MARKER)
+            if marker >= 0:
+                code = int(tail[marker + len(EXIT_MARKER):].split()[0])
+            else:
+                out.write(tail)
+            out.flush()
+        finally:
+            worker.tasks += 1
+            worker.owner = owner
+            reusable = self.policy == 'reuse' and self._alive(worker) and worker.ready()
+            with self._lock:
+                # Keep it for the owner's next task unless the pool is already full
+                keep = reusable and not self._stopped and len(self._idle) < self.size
+                if keep:
+                    self._idle.append(worker)
+                    self._lock.notify_all()
+            if not keep:
+                self._destroy(worker)
+            self._top_up()
+        return code
+
+# --- Benchmark: submit-to-first-output, cold container vs warm pool ---
+
+class _FirstOutput:
+    def __init__(self, needle, started):
+        self.needle = needle
+        self.started = started
+        self.seen_at = None
+        self.buf = b''
+
+    def write(self, data):
+        self.buf += data
+        if self.seen_at is None and self.needle in self.buf:
+            self.seen_at = time.monotonic()
+
+    def flush(self):
+        pass
+
+def _serve_project(work, imports):
+    src = os.path.join(work, 'src')
+    os.makedirs(src)
+    with open(os.path.join(src, 'main.py'), 'w') as f:
+        f.write(f"import {imports}\nprint('first output', flush=True)\n")
+    shutil.make_archive(os.path.join(work, 'project'), 'zip', src)
+    server = subprocess.Popen([sys.executable, '-m', 'http.server', '8767'], cwd=work,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1)
+    return server, 'http://127.0.0.1:8767/project.zip'
+
+def bench(args):
+    work = tempfile.mkdtemp()
+    server, url = _serve_project(work, args.imports)
+    env = {'PROJECT_URL': url, 'SCRIPT_PATH': 'main.py'}
+    try:
+        cold = []
+        for _ in range(args.runs):
+            ws = tempfile.mkdtemp(dir=work)
+            started = time.monotonic()
+            if args.local:
+                cmd = ['bash', os.path.join(HERE, 'entrypoint.sh')]
+                proc = subprocess.Popen(cmd, cwd=ws, env={**os.environ, **env},
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            else:
+                cmd = ['docker', 'run', '--rm', '--network', 'host'] + \
+                      [a for k, v in env.items() for a in ('-e', f'{k}={v}')] + [args.image]
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            for line in proc.stdout:
+                if b'first output' in line:
+                    cold.append(time.monotonic() - started)
+                    break
+            proc.wait()
+
+        pool = WarmPool(size=args.size, image=args.image, local=args.local, gpus=None,
+                        preload=args.imports)
+        pool.start()
+        warm = []
+        try:
+            with pool._lock:
+                pool._lock.wait_for(lambda: len(pool._idle) >= args.size, 600)
+            for _ in range(args.runs):
+                # Pool refills between tasks, like it would between real submissions
+                with pool._lock:
+                    pool._lock.wait_for(lambda: len(pool._idle) >= 1, 600)
+                started = time.monotonic()
+                sink = _FirstOutput(b'first output', started)
+                code = pool.run_task(env, out=sink)
+                if sink.seen_at is None:
+                    raise RuntimeError(f"warm run exited {code} without output: {sink.buf[-2000:]!r}")
+                warm.append(sink.seen_at - started)
+        finally:
+            pool.stop()
+
+        print(f"submit-to-first-output over {args.runs} runs (script imports {args.imports}):")
+        print(f"  cold container  median {sorted(cold)[len(cold) // 2]:.2f}s")
+        print(f"  warm pool       median {sorted(warm)[len(warm) // 2]:.2f}s")
+    finally:
+        server.kill()
+        shutil.rmtree(work, ignore_errors=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--bench', action='store_true', help="compare cold vs warm start latency")
+    parser.add_argument('--local', action='store_true', help="run workers as local processes, not containers")
+    parser.add_argument('--image', default='ruasnv/matcha-runner:latest')
+    parser.add_argument('--size', type=int, default=2)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--imports', default='torch', help="modules the benchmark script imports")
+    args = parser.parse_args()
+    if args.bench:
+        bench(args)
+    else:
+        parser.print_help()
@@ -0,0 +1,135 @@
+"""
+Warm-pool worker: runs inside a matcha-runner container that was started
+before any task exists. It imports the research stack once, then waits on a
+Unix socket for a task. Each task is prepared by entrypoint.sh (download,
+unzip, requirements) and executed in a forked child, so the script starts
+with torch & co. already imported instead of paying for it every time.
+
+Protocol (one connection per task):
+    -> one JSON line: {"env": {"PROJECT_URL": ..., "SCRIPT_PATH": ..., ...}}
+    <- the task's combined stdout/stderr, as it is produced
+    <- a final line: "__MATCHA_EXIT__ <code>"
+
+Isolation policy (MATCHA_POOL_POLICY):
+    recycle  one task, then the container exits and the pool starts a fresh one (default)
+    reuse    keep serving up to MATCHA_POOL_MAX_TASKS tasks; the workspace is wiped
+             in between. The pool only reuses a container for the same owner.
+
+CUDA is never initialised in this process (importing torch doesn't), so the
+forked child can still pick its GPU through CUDA_VISIBLE_DEVICES.
+"""
+import importlib
+import json
+import os
+import runpy
+import shutil
+import site
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+SOCKET_PATH = os.getenv('MATCHA_POOL_SOCKET', '/pool/worker.sock')
+POLICY = os.getenv('MATCHA_POOL_POLICY', 'recycle')  # recycle | reuse
+MAX_TASKS = int(os.getenv('MATCHA_POOL_MAX_TASKS', '1' if POLICY == 'recycle' else '20'))
+PRELOAD = [m.strip() for m in os.getenv('MATCHA_PRELOAD', 'torch,numpy,pandas,scipy').split(',') if m.strip()]
+ENTRYPOINT = os.getenv('MATCHA_ENTRYPOINT', '/entrypoint.sh')
+WORKSPACE_ROOT = os.getenv('MATCHA_WORKSPACE_ROOT', '/workspace')
+EXIT_MARKER = b'__MATCHA_EXIT__'
+
+def preload():
+    started = time.monotonic()
+    for name in PRELOAD:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"⚠️ Preload skipped {name}: {e}", flush=True)
+    print(f"🔥 Preloaded {', '.join(PRELOAD)} in {time.monotonic() - started:.1f}s", flush=True)
+
+def run_task(conn, env):
+    """
+    Forks a child that prepares and runs the task with its output going to
+    `conn`. Returns the exit code.
+    """
+    workspace = tempfile.mkdtemp(dir=WORKSPACE_ROOT)
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            fd = conn.fileno()
+            os.dup2(fd, 1)
+            os.dup2(fd, 2)
+            sys.stdout = os.fdopen(1, 'w', buffering=1)
+            sys.stderr = os.fdopen(2, 'w', buffering=1)
+            os.chdir(workspace)
+            os.environ.update({k: str(v) for k, v in env.items()})
+
+            # 1. Download / unzip / requirements, exactly as a cold container would
+            prepared = os.path.join(workspace, '.prepared')
+            result = subprocess.run(['bash', ENTRYPOINT], env={**os.environ, 'MATCHA_PREPARE_OUT': prepared})
+            if result.returncode != 0:
+                os._exit(result.returncode)
+            info = dict(line.split('=', 1) for line in open(prepared).read().splitlines() if '=' in line)
+
+            # 2. Task requirements (cached venv) go in front of the preloaded stack
+            venv = info.get('VENV')
+            if venv:
+                for path in site.getsitepackages([venv]):
+                    if os.path.isdir(path):
+                        sys.path.insert(0, path)
+
+            print("🚀 Starting Python execution...", flush=True)
+            script = info['SCRIPT']
+            sys.argv = [script]
+            sys.path.insert(0, os.path.dirname(script))
+            runpy.run_path(script, run_name='__main__')
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    _, status = os.waitpid(pid, 0)
+    shutil.rmtree(workspace, ignore_errors=True)
+    return os.waitstatus_to_exitcode(status)
+
+def serve():
+    preload()
+    os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+    if os.path.exists(SOCKET_PATH):
+        os.unlink(SOCKET_PATH)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Listening before the socket appears under its real name: the pool only
+    # hands out workers whose socket exists, i.e. after preload and listen()
+    server.bind(SOCKET_PATH + '.tmp')
+    server.listen(1)
+    os.replace(SOCKET_PATH + '.tmp', SOCKET_PATH)
+    print(f"🟢 Warm worker ready on {SOCKET_PATH} (policy={POLICY})", flush=True)
+
+    served = 0
+    try:
+        while served < MAX_TASKS:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    request = json.loads(conn.makefile('rb').readline() or b'{}')
+                except ValueError:
+                    conn.sendall(EXIT_MARKER + b' 2\n')
+                    continue
+                code = run_task(conn, request.get('env') or {})
+                conn.sendall(b'\n' + EXIT_MARKER + f' {code}\n'.encode())
+            served += 1
+    finally:
+        server.close()
+        if os.path.exists(SOCKET_PATH):
+            os.unlink(SOCKET_PATH)
+    print(f"♻️ Warm worker done after {served} task(s)", flush=True)
+
+if __name__ == '__main__':
+    serve()
@@ -53,23 +53,64 @@ export default function App() {
     }
   }, [isLoaded, isSignedIn, user]);
 
-  // Polling for tasks
+  // Initial snapshot + live status stream for tasks
   useEffect(() => {
-    const fetchMyTasks = async () => {
-      if (isSignedIn && user && activePage === 'dashboard') {
-        try {
-          const response = await fetch(`${API_URL}/consumer/tasks?clerk_id=${user.id}`);
-          const data = await response.json();
-          setTasks(Array.isArray(data) ? data : []);
-        } catch (err) {
-          console.error("Task fetch failed", err);
-        }
+    if (!isSignedIn || !user || activePage !== 'dashboard') return;
+
+    let source = null;
+    let retryTimer = null;
+    let cancelled = false;
+
+    // The server resends recent events that may have committed out of order
+    const applied = new Set();
+    const applyEvent = (event) => {
+      const update = JSON.parse(event.data);
+      if (applied.has(update.seq)) return;
+      applied.add(update.seq);
+      setTasks((prev) => {
+        const idx = prev.findIndex((t) => t.id === update.id);
+        if (idx === -1) return [{ id: update.id, status: update.status }, ...prev];
+        const next = [...prev];
+        next[idx] = { ...next[idx], status: update.status };
+        return next;
+      });
+    };
+
+    const start = async () => {
+      try {
+        const response = await fetch(`${API_URL}/consumer/tasks?clerk_id=${user.id}`);
+        const data = await response.json();
+        if (cancelled) return;
+        setTasks(Array.isArray(data) ? data : []);
+
+        // Resume the stream right after the snapshot we just loaded;
+        // EventSource handles reconnects itself via Last-Event-ID.
+        let cursor = response.headers.get('X-Task-Event-Cursor') || '';
+        const open = () => {
+          source = new EventSource(`${API_URL}/consumer/tasks/stream?clerk_id=${user.id}&cursor=${cursor}`);
+          source.addEventListener('status', (event) => {
+            cursor = event.lastEventId || cursor;
+            applyEvent(event);
+          });
+          // A 503 (server at its open-stream limit) closes an EventSource for
+          // good instead of retrying: reopen it ourselves, a little later
+          source.onerror = () => {
+            if (cancelled || source.readyState !== EventSource.CLOSED) return;
+            retryTimer = setTimeout(open, 5000 + Math.random() * 5000);
+          };
+        };
+        open();
+      } catch (err) {
+        console.error("Task fetch failed", err);
       }
     };
 
-    fetchMyTasks();
-    const interval = setInterval(fetchMyTasks, 4000);
-    return () => clearInterval(interval);
+    start();
+    return () => {
+      cancelled = true;
+      clearTimeout(retryTimer);
+      if (source) source.close();
+    };
   }, [isSignedIn, user, activePage]);
 
   if (!isLoaded) return <Center h="100vh"><Loader /></Center>;
@@ -1,15 +1,117 @@
 import { useState, useEffect } from 'react';
-import { TextInput, Button, Stack, Title, Paper, FileInput, Group, Text as MantineText } from '@mantine/core';
+import { TextInput, Button, Stack, Title, Paper, FileInput, Group, Progress, Text as MantineText } from '@mantine/core';
 import JSZip from 'jszip';
 import { useUser } from '@clerk/clerk-react';
 
 const API_URL = import.meta.env.VITE_API_URL || "https://matcha-orchestrator.onrender.com";
 const CONSUMER_API_KEY = "ultrasecretconsumerkey456"; 
 
+// --- Direct-to-R2 multipart upload ---
+// The orchestrator only signs part URLs; the ZIP goes straight from the
+// browser to R2, PARALLEL_PARTS at a time. Progress is remembered in
+// localStorage, so retrying after a failure (or a reload) only sends the
+// parts R2 doesn't have yet.
+const PARALLEL_PARTS = 4;
+const MAX_HASH_BYTES = 512 * 1024 * 1024; // crypto.subtle hashes in one buffer; bigger files skip dedup
+const PART_RETRIES = 3;
+const SIGN_BATCH = 100;
+
+const api = async (path, body) => {
+  const res = await fetch(`${API_URL}${path}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'X-API-Key': CONSUMER_API_KEY },
+    body: JSON.stringify(body)
+  });
+  const data = await res.json().catch(() => ({}));
+  if (!res.ok) throw Object.assign(new Error(data.error || `${path} failed`), { status: res.status });
+  return data;
+};
+
+// Projects are stored by sha256: identical ZIPs (e.g. a hyperparameter sweep
+// resubmitting the same code) are uploaded once and then referenced by digest.
+const sha256Hex = async (blob) => {
+  const hash = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+  return [...new Uint8Array(hash)].map((b) => b.toString(16).padStart(2, '0')).join('');
+};
+
+const resumeKey = (clerkId, blob) =>
+  `matcha-upload:${clerkId}:${blob.name}:${blob.size}:${blob.lastModified || 0}`;
+
+const putPart = async (url, chunk) => {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      const res = await fetch(url, { method: 'PUT', body: chunk });
+      if (!res.ok) throw new Error(`Part upload failed (${res.status})`);
+      // Needs ETag in the bucket's CORS ExposeHeaders
+      return res.headers.get('ETag');
+    } catch (err) {
+      if (attempt >= PART_RETRIES) throw err;
+      await new Promise((r) => setTimeout(r, 1000 * 2 ** attempt));
+    }
+  }
+};
+
+async function uploadToR2(clerkId, blob, digest, onProgress) {
+  const storageKey = resumeKey(clerkId, blob);
+  let session = JSON.parse(localStorage.getItem(storageKey) || 'null');
+  const done = new Map(); // part number -> etag
+
+  // 1. Resume what R2 already has, or start a new upload
+  if (session) {
+    try {
+      const { parts } = await api('/consumer/uploads/parts', { clerk_id: clerkId, ...session });
+      parts.forEach((p) => done.set(p.PartNumber, p.ETag));
+    } catch (err) {
+      if (err.status !== 404) throw err;
+      session = null; // Expired or already completed: start over
+    }
+  }
+  if (!session) {
+    const init = await api('/consumer/uploads/initiate', {
+      clerk_id: clerkId, filename: blob.name, size: blob.size, content_type: 'application/zip',
+      ...(digest && { digest })
+    });
+    session = { key: init.key, upload_id: init.upload_id, part_size: init.part_size };
+    localStorage.setItem(storageKey, JSON.stringify(session));
+  }
+
+  const partCount = Math.ceil(blob.size / session.part_size);
+  const todo = [];
+  for (let n = 1; n <= partCount; n++) if (!done.has(n)) todo.push(n);
+  onProgress(done.size / partCount);
+
+  // 2. Sign in batches, upload each batch with PARALLEL_PARTS workers
+  for (let i = 0; i < todo.length; i += SIGN_BATCH) {
+    const batch = todo.slice(i, i + SIGN_BATCH);
+    const { urls } = await api('/consumer/uploads/sign_parts', {
+      clerk_id: clerkId, key: session.key, upload_id: session.upload_id, part_numbers: batch
+    });
+    const queue = [...batch];
+    const worker = async () => {
+      while (queue.length) {
+        const n = queue.shift();
+        const start = (n - 1) * session.part_size;
+        done.set(n, await putPart(urls[n], blob.slice(start, start + session.part_size)));
+        onProgress(done.size / partCount);
+      }
+    };
+    await Promise.all(Array.from({ length: PARALLEL_PARTS }, worker));
+  }
+
+  // 3. Stitch the parts together on R2
+  const { project_url } = await api('/consumer/uploads/complete', {
+    clerk_id: clerkId, key: session.key, upload_id: session.upload_id,
+    parts: [...done].map(([part_number, etag]) => ({ part_number, etag }))
+  });
+  localStorage.removeItem(storageKey);
+  return project_url;
+}
+
 export function SubmitForm() {
   const { user } = useUser();
   const [file, setFile] = useState(null);
   const [uploading, setUploading] = useState(false);
+  const [progress, setProgress] = useState(0);
   const [entryPoint, setEntryPoint] = useState('main.py');
 
   const handleUploadAndSubmit = async () => {
@@ -20,29 +122,31 @@ export function SubmitForm() {
     }
     
     setUploading(true);
+    setProgress(0);
     console.log("📤 Initializing upload for:", file.name);
 
     try {
-      const zip = new JSZip();
-      if (file.name.endsWith('.zip')) {
-        await zip.loadAsync(file);
-      } else {
+      // ZIPs go up as-is; a lone script is wrapped in a small ZIP first
+      let upload = file;
+      if (!file.name.endsWith('.zip')) {
+        const zip = new JSZip();
         zip.file(file.name, file);
+        upload = new File([await zip.generateAsync({ type: 'blob' })], 'project.zip', { type: 'application/zip', lastModified: file.lastModified });
       }
-      
-      const zipBlob = await zip.generateAsync({ type: 'blob' });
-      const formData = new FormData();
-      formData.append('file', zipBlob, 'project.zip'); 
-      formData.append('clerk_id', user?.id); 
 
-      const uploadRes = await fetch(`${API_URL}/consumer/upload_project`, {
-        method: 'POST',
-        headers: { 'X-API-Key': CONSUMER_API_KEY },
-        body: formData
-      });
-
-      if (!uploadRes.ok) throw new Error('Cloud Storage Upload failed');
-      const { project_url } = await uploadRes.json();
+      // Skip the upload entirely if this exact ZIP is already stored
+      const digest = upload.size <= MAX_HASH_BYTES ? await sha256Hex(upload) : null;
+      let project_url = null;
+      if (digest) {
+        const check = await api('/consumer/blobs/check', { clerk_id: user?.id, digest });
+        if (check.exists) {
+          console.log("♻️ Project already stored, skipping upload:", digest);
+          project_url = check.project_url;
+        }
+      }
+      if (!project_url) {
+        project_url = await uploadToR2(user?.id, upload, digest, setProgress);
+      }
       
       const submitRes = await fetch(`${API_URL}/consumer/submit_task`, {
         method: 'POST',
@@ -53,6 +157,7 @@ export function SubmitForm() {
         body: JSON.stringify({
           clerk_id: user?.id,
           input_path: project_url,
+          ...(digest && { project_digest: digest }),
           docker_image: 'ruasnv/matcha-runner:latest',
           script_path: entryPoint 
         })
@@ -64,7 +169,7 @@ export function SubmitForm() {
       setFile(null);
     } catch (err) {
       console.error("Submission Error:", err);
-      alert("Error: " + err.message);
+      alert("Error: " + err.message + " (submitting again resumes the upload)");
     } finally {
       setUploading(false);
     }
@@ -98,6 +203,8 @@ export function SubmitForm() {
           onChange={(e) => setEntryPoint(e.target.value)}
         />
 
+        {uploading && <Progress value={progress * 100} size="sm" animated />}
+
         <Button 
             onClick={handleUploadAndSubmit} 
             loading={uploading} 
@@ -106,7 +213,7 @@ export function SubmitForm() {
             // If the state is flickering, this condition will catch it
             disabled={!file}
         >
-          {file ? "Zip & Run on Network" : "Please Select File"}
+          {file ? (uploading ? `Uploading ${Math.round(progress * 100)}%` : "Zip & Run on Network") : "Please Select File"}
         </Button>
       </Stack>
     </Paper>
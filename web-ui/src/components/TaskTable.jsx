@@ -31,7 +31,7 @@ export function TaskTable({ tasks = [] }) {
         <Table.Tr>
           <Table.Th>ID</Table.Th>
           <Table.Th>Status</Table.Th>
-          <Table.Th>Output Snapshot</Table.Th>
+          <Table.Th>Submitted</Table.Th>
           <Table.Th>Actions</Table.Th>
         </Table.Tr>
       </Table.Thead>
@@ -52,8 +52,8 @@ export function TaskTable({ tasks = [] }) {
               </Badge>
             </Table.Td>
             <Table.Td>
-              <Text size="xs" truncate w={200}>
-                {task.stdout || "No logs yet..."}
+              <Text size="xs" c="dimmed">
+                {task.submission_time ? new Date(task.submission_time + 'Z').toLocaleString() : "Just now"}
               </Text>
             </Table.Td>
             <Table.Td>